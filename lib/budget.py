@@ -0,0 +1,246 @@
+"""
+budget.py
+=========
+``--budget 5m``: make the host usable within a deadline and finish the rest
+later.
+
+Modules are admitted in priority order (BUDGET_PRIORITY: SSH keys, sudoers,
+packages, Tailscale and the firewall first) while their estimated cost
+fits in what is left of the budget.  A module's estimate is its median
+successful duration from the run history or, if it has none, the larger of
+BUDGET_UNKNOWN_ESTIMATE_SECONDS and what simulating its apt transaction
+predicts (``apt_tools.plan_transaction``).  A module is only admitted
+if the modules it depends on (BUDGET_DEPENDS) are, and each one is checked
+against the clock again just before it starts, so one that overruns defers
+the rest instead of blowing through the deadline.  Modules are never
+interrupted: the host is left with whole modules done and whole modules
+not started.  The final wait for pending deploy keys (lib/gates.py) is
+capped at what's left of the budget too; a module still waiting on one is
+finished by the follow-up run.
+
+Deferred modules are handed to a systemd timer (BUDGET_FOLLOWUP_UNIT) that
+re-runs the same command with ``--resume`` (the journal skips what this run
+completed), retries if that fails, and disables itself once it succeeds.
+"""
+
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from . import constants, history
+from .constants import (
+    BUDGET_DEFAULT_PRIORITY, BUDGET_DEPENDS, BUDGET_FOLLOWUP_DELAY, BUDGET_FOLLOWUP_RETRY,
+    BUDGET_FOLLOWUP_UNIT, BUDGET_PRIORITY, BUDGET_UNKNOWN_ESTIMATE_SECONDS,
+)
+from .executor import Executor
+from .logger import log
+from .platform_utils import is_linux
+
+# (journal key, banner, step), as built by setup_machine.py
+PlanEntry = Tuple[str, str, Callable[[], object]]
+
+# Only worth running once every other planned module has
+_LAST: Tuple[str, ...] = ("autoremove",)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)([hms]?)")
+_UNIT_SECONDS: Dict[str, int] = {"h": 3600, "m": 60, "s": 1, "": 1}
+
+_SERVICE_TEMPLATE = """[Unit]
+Description=machine-setup: modules deferred by --budget
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Type=oneshot
+WorkingDirectory={cwd}
+ExecStart={command}
+ExecStartPost=/bin/systemctl disable --now {unit}.timer
+"""
+
+_TIMER_TEMPLATE = """[Unit]
+Description=Run the modules machine-setup deferred to meet its --budget
+
+[Timer]
+OnActiveSec={delay}
+OnUnitInactiveSec={retry}
+
+[Install]
+WantedBy=timers.target
+"""
+
+
+def parse_duration(text: str) -> float:
+    """Seconds in '90s', '5m', '1h30m' or a bare number of seconds; raises ValueError."""
+    spec = text.strip().lower()
+    parts = _DURATION_PART.findall(spec)
+    if not spec or "".join(number + unit for number, unit in parts) != spec:
+        raise ValueError(f"Invalid duration '{text}' (expected e.g. 90s, 5m or 1h30m).")
+    seconds = sum(float(number) * _UNIT_SECONDS[unit] for number, unit in parts)
+    if seconds <= 0:
+        raise ValueError(f"Invalid duration '{text}': must be more than zero.")
+    return seconds
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, secs = divmod(int(round(seconds)), 60)
+    return f"{minutes}m{secs:02d}s" if minutes else f"{secs}s"
+
+
+class Budget:
+    """Decides which planned modules run now and which are deferred."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.deferred: List[str] = []
+        self._deadline = time.monotonic() + seconds
+        self._planned: List[str] = []
+        self._estimates: Dict[str, float] = {}
+        self._apt_estimates: Dict[str, float] = {}
+
+    def remaining(self) -> float:
+        return self._deadline - time.monotonic()
+
+    def estimate(self, key: str) -> float:
+        if key in self._estimates:
+            return self._estimates[key]
+        return max(BUDGET_UNKNOWN_ESTIMATE_SECONDS, self._apt_estimates.get(key, 0.0))
+
+    def _blocked(self, key: str, admitted: Set[str]) -> bool:
+        """True if something *key* depends on is planned but not admitted."""
+        if key in _LAST:
+            depends: Tuple[str, ...] = tuple(k for k in self._planned if k != key)
+        else:
+            depends = BUDGET_DEPENDS.get(key, ())
+        return any(d in self._planned and d not in admitted for d in depends)
+
+    def schedule(
+        self, plan: List[PlanEntry], apt_estimates: Optional[Dict[str, float]] = None
+    ) -> List[PlanEntry]:
+        """
+        The entries of *plan* that fit, highest priority first (plan order
+        within a priority); the keys of the rest are recorded in .deferred.
+        *apt_estimates* (module key -> seconds its apt transaction should
+        take) stand in for modules without history.
+        """
+        self._planned = [key for key, _, _ in plan]
+        self._estimates = history.estimates(self._planned)
+        self._apt_estimates = apt_estimates or {}
+        order = sorted(
+            range(len(plan)),
+            key=lambda i: (BUDGET_PRIORITY.get(plan[i][0], BUDGET_DEFAULT_PRIORITY), i),
+        )
+
+        admitted: Set[str] = set()
+        left = self.remaining()
+        for i in order:
+            key = plan[i][0]
+            if not self._blocked(key, admitted) and self.estimate(key) <= left:
+                admitted.add(key)
+                left -= self.estimate(key)
+        self.deferred = [key for key in self._planned if key not in admitted]
+
+        scheduled = [plan[i] for i in order if plan[i][0] in admitted]
+        unknown = [key for key in admitted if key not in self._estimates]
+        log.info(
+            f"--budget {_format_duration(self.seconds)}: running "
+            f"{', '.join(key for key, _, _ in scheduled) or 'nothing'} "
+            f"(~{_format_duration(self.seconds - left)}"
+            + (f", {len(unknown)} without history" if unknown else "")
+            + ")."
+        )
+        if self.deferred:
+            log.warning(f"--budget: deferring {', '.join(self.deferred)} to a follow-up run.")
+        return scheduled
+
+    def admit(self, key: str) -> bool:
+        """Re-checks *key* against the clock just before it starts; False defers it."""
+        admitted = {k for k in self._planned if k not in self.deferred}
+        if self._blocked(key, admitted):
+            reason = "something it depends on was deferred"
+        elif self.estimate(key) > self.remaining():
+            reason = (
+                f"{_format_duration(max(self.remaining(), 0))} of the budget left, "
+                f"needs ~{_format_duration(self.estimate(key))}"
+            )
+        else:
+            return True
+        log.warning(f"--budget: deferring '{key}' ({reason}).")
+        if key not in self.deferred:
+            self.deferred.append(key)
+        return False
+
+    def defer(self, keys: List[str], reason: str) -> None:
+        """Hands *keys*, which already ran but aren't finished, to the follow-up run."""
+        for key in keys:
+            log.warning(f"--budget: deferring the rest of '{key}' ({reason}).")
+            if key not in self.deferred:
+                self.deferred.append(key)
+
+
+def _followup_args(argv: List[str]) -> List[str]:
+    """*argv* without --budget (and its value) and with --resume."""
+    forwarded: List[str] = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg == "--budget":
+            skip_next = True
+            continue
+        if arg.startswith("--budget=") or arg == "--resume":
+            continue
+        forwarded.append(arg)
+    return forwarded + ["--resume"]
+
+
+def _install_unit(exec_obj: Executor, name: str, content: str) -> bool:
+    try:
+        exec_obj.write_file(f"/etc/systemd/system/{name}", content, 0o644)
+    except (subprocess.CalledProcessError, OSError):
+        return False
+    return True
+
+
+def schedule_followup(exec_obj: Executor, argv: List[str]) -> None:
+    """Starts the timer that runs the deferred modules: *argv* again, with --resume."""
+    args = _followup_args(argv)
+    if not is_linux:
+        log.warning(
+            f"--budget: no systemd here; finish the deferred modules with: "
+            f"{shlex.join([sys.argv[0]] + args)}"
+        )
+        return
+
+    entry = constants.BUNDLE or os.path.abspath(
+        os.path.join(constants.REPO_ROOT, "setup_machine.py")
+    )
+    # systemd expands %-specifiers in ExecStart
+    command = shlex.join([sys.executable, entry] + args).replace("%", "%%")
+    unit = BUDGET_FOLLOWUP_UNIT
+    service = _SERVICE_TEMPLATE.format(cwd=os.getcwd(), command=command, unit=unit)
+    timer = _TIMER_TEMPLATE.format(delay=BUDGET_FOLLOWUP_DELAY, retry=BUDGET_FOLLOWUP_RETRY)
+
+    log.info(f"Scheduling the deferred modules as {unit}.timer (in {BUDGET_FOLLOWUP_DELAY}).")
+    ok = (
+        _install_unit(exec_obj, f"{unit}.service", service)
+        and _install_unit(exec_obj, f"{unit}.timer", timer)
+        and exec_obj.run("systemctl daemon-reload", force_sudo=True, check=False).returncode == 0
+        and exec_obj.run(
+            f"systemctl enable {unit}.timer", force_sudo=True, check=False
+        ).returncode == 0
+        # Restart so an already-active timer (an earlier --budget run) counts from now
+        and exec_obj.run(
+            f"systemctl restart {unit}.timer", force_sudo=True, check=False
+        ).returncode == 0
+    )
+    if ok:
+        log.success(f"Deferred modules will run from {unit}.timer; follow with "
+                    f"'journalctl -u {unit}.service'.")
+    else:
+        log.error(f"Could not schedule {unit}.timer; finish the deferred modules with: "
+                  f"{shlex.join([entry] + args)}")
@@ -0,0 +1,93 @@
+"""
+bundle.py
+=========
+Support for running from the single-file zipapp built by
+``tools/build-pyz.py`` (``python3 machine-setup.pyz --all``).
+
+Inside the archive the modules are sourceless ``.pyc`` files loaded by
+zipimport, so anything that needs a real path or a source file goes through
+here:
+
+* ``bundle_path()`` — the ``.pyz`` we're running from, or None in a checkout.
+* ``extract_tools()`` — ``tools/`` unpacked once per archive to a temp dir
+  (those scripts are copied onto the host or run by other users).
+* ``read_repo_file()`` — a repo file's bytes, from the archive or the checkout.
+
+Deliberately imports nothing from lib/: constants.py depends on it.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import Optional
+
+# Directory containing setup_machine.py and lib/ (a checkout, or the .pyz itself)
+_ROOT: str = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def bundle_path() -> Optional[str]:
+    """The zipapp this code is running from, or None when running from a checkout."""
+    if os.path.isfile(_ROOT) and zipfile.is_zipfile(_ROOT):
+        return _ROOT
+    return None
+
+
+def _trusted(path: str) -> bool:
+    # The temp dir is shared: only reuse an extraction we own and others can't modify
+    st = os.lstat(path)
+    return st.st_uid == os.geteuid() and not st.st_mode & 0o022 and not os.path.islink(path)
+
+
+def extract_tools(bundle: str) -> str:
+    """
+    Unpacks the archive's tools/ into a directory keyed by the archive's
+    size and mtime (so a rebuilt bundle gets a fresh copy) and returns it.
+    """
+    st = os.stat(bundle)
+    key = hashlib.sha256(f"{bundle}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:12]
+    base = os.path.join(tempfile.gettempdir(), f"machine-setup-{key}")
+    tools_dir = os.path.join(base, "tools")
+    if os.path.isdir(tools_dir) and _trusted(base):
+        return tools_dir
+
+    staging = tempfile.mkdtemp(prefix="machine-setup-tools-")
+    with zipfile.ZipFile(bundle) as zf:
+        for info in zf.infolist():
+            if not info.filename.startswith("tools/") or info.is_dir():
+                continue
+            dest = zf.extract(info, staging)
+            # zipfile doesn't restore permissions; keep the executable bits
+            mode = (info.external_attr >> 16) & 0o755
+            os.chmod(dest, mode or 0o644)
+    # Helpers are run by other users (e.g. env-generator.py), so keep them readable
+    os.chmod(staging, 0o755)  # nosec B103  # noqa: S103
+    os.chmod(os.path.join(staging, "tools"), 0o755)  # nosec B103  # noqa: S103
+    try:
+        os.rename(staging, base)
+    except OSError:
+        if os.path.isdir(tools_dir) and _trusted(base):
+            # Another run extracted it first
+            shutil.rmtree(staging, ignore_errors=True)
+        else:
+            # Someone else owns that path; keep our private copy instead
+            return os.path.join(staging, "tools")
+    return tools_dir
+
+
+def read_repo_file(relpath: str) -> bytes:
+    """
+    Reads *relpath* (e.g. ``lib/constants.py``) from the checkout or the
+    archive.  The archive ships bytecode only, so ``x.py`` falls back to
+    ``x.pyc`` there (still changes whenever the source does).
+    """
+    bundle = bundle_path()
+    if bundle is None:
+        with open(os.path.join(_ROOT, relpath), "rb") as f:
+            return f.read()
+    with zipfile.ZipFile(bundle) as zf:
+        names = set(zf.namelist())
+        if relpath not in names and relpath.endswith(".py"):
+            relpath += "c"
+        return zf.read(relpath)
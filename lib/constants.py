@@ -1,7 +1,9 @@
 import os
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import shutil
 
+from .bundle import bundle_path, extract_tools
+
 # --- Global Configuration Paths ---
 VENVDIR: str = "/opt/setup-venv"
 
@@ -10,6 +12,12 @@ REPO_ROOT: str = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 LIB_DIR: str = os.path.join(REPO_ROOT, "lib")
 TOOLS_DIR: str = os.path.join(REPO_ROOT, "tools")
 
+# Running from the zipapp built by tools/build-pyz.py: REPO_ROOT is the .pyz
+# itself, and tools/ must be unpacked to real files before use.
+BUNDLE: Optional[str] = bundle_path()
+if BUNDLE:
+    TOOLS_DIR = extract_tools(BUNDLE)
+
 # --- System Config ---
 ROOT_SRC_CHECKOUT: str = "/usr/local/src"
 DEFAULT_VM_USER: str = "adam"
@@ -157,3 +165,107 @@ FIREWALL_CONF_DIR: str = "/etc/iptables"
 # iptables and ip6tables are standard, but we ensure iptables-persistent
 # directory structure exists for our own script's logic.
 FIREWALL_PACKAGES: List[str] = ["iptables", "curl"]
+
+# Fleet mode: where the orchestrator bundle is unpacked on each remote host,
+# and how many hosts are provisioned at once by default.
+FLEET_REMOTE_DIR: str = "/var/tmp/machine-setup-fleet"  # nosec B108  # noqa: S108
+FLEET_DEFAULT_CONCURRENCY: int = 4
+
+# --- Prefetch ---
+# Artifacts downloaded concurrently before any module mutates the host.
+PREFETCH_CACHE_DIR: str = "/var/cache/machine-setup"
+PREFETCH_WORKERS: int = 8
+# apt's own cache and package lists (offline bundles restore both)
+APT_ARCHIVES_DIR: str = "/var/cache/apt/archives"
+APT_LISTS_DIR: str = "/var/lib/apt/lists"
+# What apt update's result depends on: when none of these has changed and the
+# lists were refreshed within APT_LISTS_TTL_SECONDS, apt update is skipped.
+APT_SOURCE_PATHS: List[str] = [
+    "/etc/apt/sources.list", "/etc/apt/sources.list.d",
+    "/etc/apt/trusted.gpg", "/etc/apt/trusted.gpg.d",
+    "/etc/apt/keyrings", "/usr/share/keyrings",
+]
+APT_LISTS_TTL_SECONDS: float = 3600.0
+# Transaction estimates (apt_tools.plan_transaction) until the run history
+# has measured this host's download throughput and per-package install time
+APT_DEFAULT_THROUGHPUT: float = 4_000_000.0  # bytes/s
+APT_DEFAULT_SECONDS_PER_PACKAGE: float = 1.5
+
+# --- APT cache (--apt-cache / --apt-proxy) ---
+# apt-cacher-ng on a cache host; other hosts fetch through it with
+# --apt-proxy http://<cache host>:APT_CACHE_PORT while it answers.
+APT_CACHE_PACKAGE: str = "apt-cacher-ng"
+APT_CACHE_PORT: int = 3142
+APT_PROXY_PROBE_TIMEOUT: float = 2.0
+
+# Remote artifact URLs (single source of truth for modules and the prefetch phase)
+DOCKER_GPG_URL: str = "https://download.docker.com/linux/{os_id}/gpg"
+OLLAMA_INSTALL_URL: str = "https://ollama.com/install.sh"
+TAILSCALE_INSTALL_URL: str = "https://tailscale.com/install.sh"
+VSCODE_GPG_URL: str = "https://packages.microsoft.com/keys/microsoft.asc"
+GITHUB_KEYS_URL: str = "https://github.com/{account}.keys"
+OPEN_WEBUI_IMAGE: str = "ghcr.io/open-webui/open-webui:main"
+
+# --- Run state ---
+# Persistent orchestrator state (run journal for --resume, etc.)
+STATE_DIR: str = "/var/lib/machine-setup"
+JOURNAL_FILE: str = os.path.join(STATE_DIR, "journal.json")
+# Compiled --profile plans, keyed by profile + constants hash
+PROFILE_CACHE_DIR: str = os.path.join(STATE_DIR, "plans")
+# Per-module/per-command timings of every run (ETA, slow-module flags, --history)
+HISTORY_DB: str = os.path.join(STATE_DIR, "runs.db")
+# Sources/keyrings fingerprint and time of the last apt update we ran
+APT_LISTS_STAMP: str = os.path.join(STATE_DIR, "apt-lists.json")
+# node_exporter's textfile collector directory (the Debian/Ubuntu package's
+# default); run metrics are only written if it exists.
+METRICS_TEXTFILE_DIR: str = "/var/lib/prometheus/node-exporter"
+# How long the end-of-run barrier waits for pending deploy keys to be authorised
+GATE_TIMEOUT_SECONDS: int = 1800
+# Terminal-owner lock shared by the orchestrator and its delegated children
+TTY_LOCK_FILE: str = "/run/lock/machine-setup-tty.lock"
+
+# --- Time budget (--budget) ---
+# Which modules run first when not everything fits (lower first).  A module
+# never has a lower number than anything it depends on.
+BUDGET_PRIORITY: Dict[str, int] = {
+    "snapshot_import": 0,
+    "root_ssh_keys": 0,
+    "sudoers": 0,
+    "packages": 1,
+    "tailscale": 1,
+    "firewall": 1,
+    "cloud_init": 2,
+    "pseudohome": 2,
+    "no2id": 2,
+    "vm": 2,
+    "docker": 3,
+    "ollama_terminal": 6,
+    "autoremove": 9,
+}
+BUDGET_DEFAULT_PRIORITY: int = 5
+# Modules that must have run first (when they're also planned): deferring
+# one defers these dependants too.  autoremove waits for everything.
+BUDGET_DEPENDS: Dict[str, Tuple[str, ...]] = {
+    "tailscale": ("packages",),
+    "firewall": ("packages", "tailscale"),
+    "cloud_init": ("packages",),
+    "pseudohome": ("packages",),
+    "no2id": ("packages", "cloud_init"),
+    "vm": ("packages",),
+    "docker": ("packages", "pseudohome", "no2id"),
+    "wolfcraig": ("docker",),
+    "personal_repos": ("docker",),
+    "traefik_proxy": ("docker",),
+    "dracula": ("packages",),
+    "docker_dns_reso": ("docker",),
+    "fake_le": ("docker",),
+    "ollama": ("docker",),
+    "ollama_terminal": ("ollama",),
+    "desktop": ("packages",),
+}
+# Assumed duration of a module with no successful run in the history yet
+BUDGET_UNKNOWN_ESTIMATE_SECONDS: float = 120.0
+# systemd service/timer that runs the deferred modules afterwards
+BUDGET_FOLLOWUP_UNIT: str = "machine-setup-deferred"
+BUDGET_FOLLOWUP_DELAY: str = "2min"
+BUDGET_FOLLOWUP_RETRY: str = "30min"
@@ -0,0 +1,140 @@
+"""
+dpkg_status.py
+==============
+The dpkg status database (``/var/lib/dpkg/status``) read in-process.
+
+Checking packages one ``dpkg -s`` (or ``dpkg-query``/``dpkg
+--get-selections``) at a time costs a process per question.  Instead the
+file is parsed once into a dict keyed by ``(package, architecture)`` and
+kept until dpkg rewrites it (its mtime or size changes), so membership
+checks are O(1) and re-reading after an ``apt install`` only re-parses when
+something actually changed.
+
+The file is read through ``host_path()``, so under ``--root`` it comes from
+the alternate root (and is simply empty if the root has none).
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .logger import log
+from .paths import host_path
+
+STATUS_FILE = "/var/lib/dpkg/status"
+
+# db:Status-Status values for which nothing of the package is on disk
+_ABSENT_STATES = ("not-installed", "config-files")
+# ...and those of a configured package: only its triggers are still to run
+# (as after an apt install with triggers deferred by --fast-dpkg)
+_INSTALLED_STATES = ("installed", "triggers-pending", "triggers-awaited")
+
+
+@dataclass(frozen=True)
+class PackageStatus:
+    package: str
+    arch: str
+    want: str     # install, hold, deinstall, purge, unknown
+    state: str    # installed, half-configured, config-files, ...
+    version: str
+
+    @property
+    def installed(self) -> bool:
+        """Configured, as ``dpkg -s`` reports it: pending triggers don't count against it."""
+        return self.state in _INSTALLED_STATES
+
+
+Index = Dict[Tuple[str, str], PackageStatus]
+
+# (path, st_mtime_ns, st_size) the cached index was parsed from
+_cache_key: Optional[Tuple[str, int, int]] = None
+_cache: Index = {}
+# package name -> its entries (one per installed architecture)
+_by_name: Dict[str, List[PackageStatus]] = {}
+
+
+def _parse(text: str) -> Index:
+    """Only the four fields we need; continuation lines and other fields are skipped."""
+    index: Index = {}
+    for stanza in text.split("\n\n"):
+        fields: Dict[str, str] = {}
+        for line in stanza.splitlines():
+            if line[:1] in (" ", "\t"):
+                continue
+            name, sep, value = line.partition(": ")
+            if sep and name in ("Package", "Architecture", "Status", "Version"):
+                fields[name] = value.strip()
+        package = fields.get("Package")
+        status = fields.get("Status", "").split()
+        if not package or len(status) != 3:
+            continue
+        arch = fields.get("Architecture", "all")
+        index[(package, arch)] = PackageStatus(
+            package, arch, status[0], status[2], fields.get("Version", "")
+        )
+    return index
+
+
+def read() -> Index:
+    """The status database, re-parsed only if dpkg has rewritten it since the last call."""
+    global _cache_key, _cache, _by_name
+    path = host_path(STATUS_FILE)
+    try:
+        st = os.stat(path)
+    except OSError:
+        _cache_key, _cache, _by_name = None, {}, {}
+        return _cache
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key != _cache_key:
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                _cache = _parse(f.read())
+        except OSError as e:
+            log.debug(f"Could not read {path}: {e}")
+            _cache = {}
+        _by_name = {}
+        for entry in _cache.values():
+            _by_name.setdefault(entry.package, []).append(entry)
+        _cache_key = key
+    return _cache
+
+
+def _split(package: str) -> Tuple[str, Optional[str]]:
+    """'libc6:i386' -> ('libc6', 'i386'); an unqualified name matches any arch."""
+    name, _, arch = package.partition(":")
+    return name, arch or None
+
+
+def installed() -> Dict[str, str]:
+    """Installed package -> version (any architecture), as facts.packages holds them."""
+    return {p.package: p.version for p in read().values() if p.installed}
+
+
+def is_installed(package: str) -> bool:
+    """True if *package* (optionally ``name:arch``) is fully installed."""
+    name, arch = _split(package)
+    index = read()
+    if arch is not None:
+        entry = index.get((name, arch))
+        return entry is not None and entry.installed
+    return any(p.installed for p in _by_name.get(name, ()))
+
+
+def present(packages: Iterable[str]) -> List[str]:
+    """
+    Those of *packages* with anything left on disk (installed, half-installed
+    or unpacked), in the order given; what ``dpkg --get-selections`` would
+    report for removal.
+    """
+    index = read()
+
+    def on_disk(package: str) -> bool:
+        name, arch = _split(package)
+        if arch is None:
+            entries = _by_name.get(name, [])
+        else:
+            entry = index.get((name, arch))
+            entries = [entry] if entry else []
+        return any(e.state not in _ABSENT_STATES for e in entries)
+
+    return [pkg for pkg in packages if on_disk(pkg)]
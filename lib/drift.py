@@ -0,0 +1,390 @@
+"""
+drift.py
+========
+Read-only drift detection for ``--check``.  Each module's desired state is
+compared against the host without mutating anything; checks run
+concurrently and the result is a machine-readable JSON report suitable for
+cron / fleet collection.
+
+Exit codes (see setup_machine.py): 0 = no drift, 2 = drift found.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from .constants import (
+    APT_CACHE_PACKAGE,
+    DOCKER_PKGS,
+    FIREWALL_PACKAGES,
+    FIREWALL_SCRIPT_DEST,
+    FIREWALL_SERVICE_NAME,
+    HWGA_REPOS,
+    OLLAMA_STACK_DIR,
+    PERSONAL_GITHUB_REPOS,
+    ROOT_SRC_CHECKOUT,
+    STANDARD_PACKAGES,
+    SYSTEM_REPOS,
+    VM_PACKAGES,
+)
+from . import stubs
+from .facts import Facts
+from .logger import log
+from .paths import host_path, which
+
+_CMD_TIMEOUT: int = 10
+_CHECK_WORKERS: int = 8
+
+# Rules the firewall script installs that disappear on ``iptables -F`` (the
+# DROP policies alone survive a flush, so the terminal REJECTs matter most).
+_FIREWALL_RULES_V4: List[str] = [
+    "-P INPUT DROP",
+    "-P FORWARD DROP",
+    "-A FORWARD -j DOCKER-USER",
+    "-A INPUT -i tailscale0 -j ACCEPT",
+    "-A INPUT -j REJECT",
+]
+_FIREWALL_RULES_V6: List[str] = [
+    "-P INPUT DROP",
+    "-P FORWARD DROP",
+    "-A INPUT -i tailscale0 -j ACCEPT",
+    "-A INPUT -j REJECT",
+]
+
+
+@dataclass
+class Drift:
+    """One difference between desired and actual host state."""
+
+    kind: str  # e.g. package_missing, file_differs, service_inactive, repo_behind
+    item: str
+    detail: str = ""
+
+
+# ---------------------------------------------------------------------------
+# Read-only probes
+# ---------------------------------------------------------------------------
+
+def _run(cmd: List[str]) -> Optional[subprocess.CompletedProcess[str]]:
+    """Runs a read-only probe with a short timeout; None if it couldn't run."""
+    stub = stubs.current()
+    if stub is not None:
+        return stub.run(" ".join(cmd), cmd)
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    try:
+        return subprocess.run(
+            cmd, capture_output=True, text=True, timeout=_CMD_TIMEOUT, env=env
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return None
+
+
+def _missing_packages(facts: Facts, packages: List[str]) -> List[Drift]:
+    return [Drift("package_missing", pkg) for pkg in packages if not facts.is_installed(pkg)]
+
+
+def _file_content(path: str, expected: str) -> List[Drift]:
+    try:
+        with open(host_path(path)) as f:
+            actual = f.read()
+    except FileNotFoundError:
+        return [Drift("file_missing", path)]
+    except PermissionError:
+        return [Drift("file_unreadable", path)]
+    if actual.strip() != expected.strip():
+        return [Drift("file_differs", path)]
+    return []
+
+
+def _file_has_line(path: str, line: str) -> List[Drift]:
+    try:
+        with open(host_path(path)) as f:
+            if any(existing.strip() == line.strip() for existing in f):
+                return []
+    except FileNotFoundError:
+        return [Drift("file_missing", path)]
+    return [Drift("line_absent", path, line)]
+
+
+def _file_mode(path: str, mode: int) -> List[Drift]:
+    mapped = host_path(path)
+    if os.path.exists(mapped) and (os.stat(mapped).st_mode & 0o777) != mode:
+        actual = oct(os.stat(mapped).st_mode & 0o777)
+        return [Drift("mode_differs", path, f"expected {oct(mode)}, found {actual}")]
+    return []
+
+
+def _binary(name: str) -> List[Drift]:
+    return [] if which(name) else [Drift("binary_missing", name)]
+
+
+def _service_active(unit: str) -> List[Drift]:
+    result = _run(["systemctl", "is-active", unit])
+    state = result.stdout.strip() if result else "unknown"
+    return [] if state == "active" else [Drift("service_inactive", unit, state)]
+
+
+def _service_enabled(unit: str) -> List[Drift]:
+    result = _run(["systemctl", "is-enabled", unit])
+    state = result.stdout.strip() if result else "unknown"
+    return [] if state == "enabled" else [Drift("service_disabled", unit, state)]
+
+
+def _rules_present(command: str, expected: List[str]) -> List[Drift]:
+    """
+    Live ruleset check: ``<command> -S`` must still carry each expected rule
+    prefix.  A flush leaves a RemainAfterExit unit "active", so the unit
+    state alone can't see it.
+    """
+    result = _run([command, "-S"])
+    if result is None:
+        return [Drift("rules_unverifiable", command, "not installed")]
+    if result.returncode != 0:
+        return [Drift("rules_unverifiable", command, result.stderr.strip())]
+    rules = result.stdout.splitlines()
+    return [
+        Drift("rule_missing", command, rule)
+        for rule in expected
+        if not any(line.startswith(rule) for line in rules)
+    ]
+
+
+def _repo(dest: str, url: str, check_remote: bool = True) -> List[Drift]:
+    """
+    Checkout present, and (for public repos) whether the remote has moved on
+    from what was last fetched.  Private repos are presence-only: their
+    deploy keys belong to another user.
+    """
+    if not os.path.isdir(host_path(os.path.join(dest, ".git"))):
+        return [Drift("repo_missing", dest, url)]
+    if not check_remote:
+        return []
+
+    local = _run(["git", "-c", f"safe.directory={dest}", "-C", dest, "rev-parse", "HEAD"])
+    remote = _run(["git", "ls-remote", url, "HEAD"])
+    if not local or not remote or local.returncode != 0 or remote.returncode != 0:
+        return [Drift("repo_unverifiable", dest, url)]
+
+    local_sha = local.stdout.strip()
+    remote_sha = remote.stdout.split()[0] if remote.stdout.strip() else ""
+    if remote_sha and remote_sha != local_sha:
+        return [Drift("repo_behind", dest, f"{local_sha[:12]} != {remote_sha[:12]}")]
+    return []
+
+
+# ---------------------------------------------------------------------------
+# Per-module checks
+# ---------------------------------------------------------------------------
+
+def _check_packages(facts: Facts) -> List[Drift]:
+    config = SYSTEM_REPOS["update-all-the-packages"]
+    dest = os.path.join(ROOT_SRC_CHECKOUT, "update-all-the-packages")
+    return _missing_packages(facts, STANDARD_PACKAGES) + _repo(dest, config["url"])
+
+
+def _check_root_ssh_keys(facts: Facts) -> List[Drift]:
+    return [
+        Drift("file_missing", path)
+        for path in ("/root/.ssh/authorized_keys", "/home/adam/.ssh/authorized_keys")
+        if not os.path.isfile(host_path(path))
+    ]
+
+
+def _check_sudoers(facts: Facts) -> List[Drift]:
+    from .installer_utils.user_mgmt import SUDOERS_STAFF_CONTENT, SUDOERS_STAFF_FILE
+
+    return _file_content(SUDOERS_STAFF_FILE, SUDOERS_STAFF_CONTENT) + _file_mode(
+        SUDOERS_STAFF_FILE, 0o440
+    )
+
+
+def _check_tailscale(facts: Facts) -> List[Drift]:
+    drift = _binary("tailscale")
+    return drift or _service_active("tailscaled")
+
+
+def _check_docker(facts: Facts) -> List[Drift]:
+    from .installer_utils.apt_tools import deb822_stanza
+    from .installer_utils.module_docker import DOCKER_APT_LIST, docker_repo_line
+
+    drift = _missing_packages(facts, DOCKER_PKGS)
+    repo_line = docker_repo_line(facts)
+    if repo_line:
+        drift += _file_content(DOCKER_APT_LIST, deb822_stanza(repo_line))
+    elif not os.path.isfile(host_path(DOCKER_APT_LIST)):
+        drift.append(Drift("file_missing", DOCKER_APT_LIST))
+    return drift + _service_active("docker")
+
+
+def _check_cloud_init(facts: Facts) -> List[Drift]:
+    drift: List[Drift] = []
+    for name, config in SYSTEM_REPOS.items():
+        drift += _repo(os.path.join(ROOT_SRC_CHECKOUT, name), config["url"])
+    return drift
+
+
+def _check_firewall(facts: Facts) -> List[Drift]:
+    from .installer_utils.module_firewall import (
+        FIREWALL_SCRIPT_CONTENT,
+        FIREWALL_SERVICE_PATH,
+        SERVICE_CONTENT,
+    )
+
+    return (
+        _missing_packages(facts, FIREWALL_PACKAGES)
+        + _file_content(FIREWALL_SCRIPT_DEST, FIREWALL_SCRIPT_CONTENT)
+        + _file_content(FIREWALL_SERVICE_PATH, SERVICE_CONTENT)
+        + _service_enabled(FIREWALL_SERVICE_NAME)
+        + _service_active(FIREWALL_SERVICE_NAME)
+        + _rules_present("iptables", _FIREWALL_RULES_V4)
+        + _rules_present("ip6tables", _FIREWALL_RULES_V6)
+    )
+
+
+def _check_apt_cache(facts: Facts) -> List[Drift]:
+    return (
+        _missing_packages(facts, [APT_CACHE_PACKAGE])
+        + _service_enabled(APT_CACHE_PACKAGE)
+        + _service_active(APT_CACHE_PACKAGE)
+    )
+
+
+def _check_no2id(facts: Facts) -> List[Drift]:
+    drift: List[Drift] = []
+    for config in HWGA_REPOS.values():
+        drift += _repo(config["dest"], config["url"], check_remote=False)
+    return drift
+
+
+def _check_pseudohome(facts: Facts) -> List[Drift]:
+    from .installer_utils.module_pseudohome import PSEUDOHOME_DEST_DIR, PSEUDOHOME_REPO_URL
+
+    return _repo(PSEUDOHOME_DEST_DIR, PSEUDOHOME_REPO_URL, check_remote=False)
+
+
+def _check_wolfcraig(facts: Facts) -> List[Drift]:
+    from .installer_utils.module_wolfcraig import (
+        GHOST_DOCKER_REPO,
+        GHOST_DOCKER_REPO_URL,
+        WOLFCRAIG_REPO,
+        WOLFCRAIG_REPO_URL,
+    )
+
+    return _repo(WOLFCRAIG_REPO, WOLFCRAIG_REPO_URL) + _repo(
+        GHOST_DOCKER_REPO, GHOST_DOCKER_REPO_URL
+    )
+
+
+def _check_personal_repos(facts: Facts) -> List[Drift]:
+    from .installer_utils.module_personal_repos import PERSONAL_REPOS_USER
+
+    home = (
+        facts.home(PERSONAL_REPOS_USER)
+        if facts.user_exists(PERSONAL_REPOS_USER)
+        else os.path.expanduser(f"~{PERSONAL_REPOS_USER}")
+    )
+    drift: List[Drift] = []
+    for key, config in PERSONAL_GITHUB_REPOS.items():
+        drift += _repo(os.path.join(home, "projects", key), config["url"])
+    return drift
+
+
+def _check_ollama(facts: Facts) -> List[Drift]:
+    from .installer_utils.module_ollama import _find_ollama_bin
+
+    drift: List[Drift] = []
+    if not _find_ollama_bin():
+        drift.append(Drift("binary_missing", "ollama"))
+    compose = os.path.join(OLLAMA_STACK_DIR, "docker-compose.yml")
+    if not os.path.isfile(host_path(compose)):
+        drift.append(Drift("file_missing", compose))
+    return drift + _service_active("ollama")
+
+
+def _check_vm(facts: Facts) -> List[Drift]:
+    from .installer_utils.virtmachine import FSTAB_FILE, FSTAB_LINE_VIRTIO
+
+    return _missing_packages(facts, VM_PACKAGES) + _file_has_line(FSTAB_FILE, FSTAB_LINE_VIRTIO)
+
+
+# Keyed by the same names as the orchestrator's task list (plus "vm").
+CHECKS: Dict[str, Callable[[Facts], List[Drift]]] = {
+    "root_ssh_keys": _check_root_ssh_keys,
+    "packages": _check_packages,
+    "cloud_init": _check_cloud_init,
+    "sudoers": _check_sudoers,
+    "tailscale": _check_tailscale,
+    "firewall": _check_firewall,
+    "apt_cache": _check_apt_cache,
+    "pseudohome": _check_pseudohome,
+    "no2id": _check_no2id,
+    "docker": _check_docker,
+    "wolfcraig": _check_wolfcraig,
+    "personal_repos": _check_personal_repos,
+    "ollama": _check_ollama,
+    "vm": _check_vm,
+}
+
+
+def _run_check(name: str, facts: Facts) -> Dict[str, object]:
+    try:
+        items = CHECKS[name](facts)
+        return {"ok": not items, "items": [asdict(d) for d in items]}
+    except Exception as e:
+        return {"ok": False, "error": str(e), "items": []}
+
+
+def run_checks(modules: List[str], facts: Facts) -> Dict[str, object]:
+    """Runs the checks for *modules* concurrently and returns the drift report."""
+    selected = [m for m in modules if m in CHECKS]
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=_CHECK_WORKERS) as pool:
+        results = dict(
+            zip(selected, pool.map(lambda m: _run_check(m, facts), selected), strict=True)
+        )
+
+    return {
+        "host": platform.node(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "duration_s": round(time.monotonic() - start, 3),
+        "drift": any(not r["ok"] for r in results.values()),
+        "modules": results,
+    }
+
+
+def missing_packages(report: Dict[str, object]) -> List[str]:
+    """Every package_missing item in *report*, in module order."""
+    modules = report["modules"]
+    assert isinstance(modules, dict)  # noqa: S101
+    return list(dict.fromkeys(
+        item["item"] for result in modules.values() for item in result["items"]
+        if item["kind"] == "package_missing"
+    ))
+
+
+def write_report(report: Dict[str, object], output: Optional[str] = None) -> None:
+    """
+    Writes the report as JSON to *output* and logs a summary, or prints
+    bare JSON to stdout (the log goes to stderr) so it can be piped to jq.
+    """
+    text = json.dumps(report, indent=2)
+    if not output:
+        print(text)
+        return
+
+    with open(output, "w") as f:
+        f.write(text + "\n")
+
+    modules = report["modules"]
+    assert isinstance(modules, dict)  # noqa: S101
+    drifted = [name for name, r in modules.items() if not r["ok"]]
+    if drifted:
+        log.warning(f"Drift detected in {len(drifted)} module(s): {', '.join(drifted)}")
+    else:
+        log.success(f"No drift across {len(modules)} module(s).")
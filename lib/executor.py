@@ -1,9 +1,12 @@
 import subprocess
 import os
 import sys
-from typing import List, Optional, Union, Dict
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 from .logger import log
-from . import constants
+from . import constants, gates, history, paths, stubs, terminal
+from .facts import Facts
 
 class Executor:
     """
@@ -18,6 +21,19 @@ class Executor:
         self.quiet = quiet
         self.verbose = verbose
         self.force = force # Propagated for idempotency overrides
+        self.profile: Optional[str] = None # --profile path, propagated to delegated children
+        self._facts: Optional[Facts] = None
+
+    @property
+    def facts(self) -> Facts:
+        """Host facts snapshot, gathered on first access and shared by every module."""
+        if self._facts is None:
+            self._facts = Facts.gather()
+        return self._facts
+
+    @facts.setter
+    def facts(self, value: Facts) -> None:
+        self._facts = value
 
     def _should_sudo(self, force_sudo: bool) -> bool:
         """Determines if 'sudo' needs to be prepended to the command."""
@@ -25,6 +41,46 @@ class Executor:
             return False
         return os.geteuid() != 0
 
+    @staticmethod
+    def _popen(cmd_list: List[str],
+               cwd: Optional[str],
+               stdin: Any,
+               stdout: Any,
+               stderr: Any,
+               env: Dict[str, str]) -> "subprocess.Popen[str]":
+        try:
+            return subprocess.Popen(
+                cmd_list,
+                cwd=cwd,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                env=env,
+                universal_newlines=True,
+            )
+        except FileNotFoundError:
+            log.critical(f"Command not found: {cmd_list[0]}")
+            sys.exit(1)
+
+    @staticmethod
+    def _communicate(process: "subprocess.Popen[str]",
+                     log_cmd: str,
+                     suppress_logging: bool) -> Tuple[str, str]:
+        # Poll with a timeout instead of blocking outright, so a slow/stalled
+        # command (flaky network, unauthorised SSH key, etc.) logs a heartbeat
+        # instead of looking indistinguishable from a hang. communicate() can
+        # be safely re-called after a TimeoutExpired without losing output.
+        heartbeat_seconds = 15
+        elapsed = 0
+        while True:
+            try:
+                stdout_data, stderr_data = process.communicate(timeout=heartbeat_seconds)
+                return stdout_data or "", stderr_data or ""
+            except subprocess.TimeoutExpired:
+                elapsed += heartbeat_seconds
+                if not suppress_logging:
+                    log.info(f"Still running ({elapsed}s elapsed): {log_cmd}")
+
     def run(self, 
             command: Union[str, List[str]], 
             force_sudo: bool = False, 
@@ -45,6 +101,7 @@ class Executor:
         else:
             cmd_list = command
             log_cmd = " ".join(command)
+        plain_cmd = log_cmd
 
         if user:
             # Running as root but delegating via sudo -u; recursive calls handle user context.
@@ -89,40 +146,35 @@ class Executor:
         if env:
             full_env.update(env)
 
-        try:
-            process = subprocess.Popen(
-                cmd_list,
-                cwd=cwd,
-                stdin=stdin_target,
-                stdout=stdout_target,
-                stderr=stderr_target,
-                env=full_env,
-                universal_newlines=True,
+        started = time.time()
+        stub = stubs.current()
+        if stub is not None:
+            # --root: answered from the stub rules and recorded, never executed
+            result = stub.run(plain_cmd, cmd_list, user)
+        elif interactive:
+            # Interactive commands own the terminal while they run. In a delegated
+            # child our stdout is the parent's prefixing pipe, so talk to the
+            # controlling terminal directly instead.
+            with terminal.exclusive():
+                tty = None if sys.stdout.isatty() else terminal.controlling_tty()
+                try:
+                    # tty is None when stdio already is the terminal: inherit it
+                    process = self._popen(cmd_list, cwd, tty, tty, tty, full_env)
+                    stdout_data, stderr_data = self._communicate(process, log_cmd, suppress_logging)
+                finally:
+                    if tty is not None:
+                        tty.close()
+        else:
+            process = self._popen(
+                cmd_list, cwd, stdin_target, stdout_target, stderr_target, full_env
             )
-        except FileNotFoundError:
-            log.critical(f"Command not found: {cmd_list[0]}")
-            sys.exit(1)
+            stdout_data, stderr_data = self._communicate(process, log_cmd, suppress_logging)
 
-        # Poll with a timeout instead of blocking outright, so a slow/stalled
-        # command (flaky network, unauthorised SSH key, etc.) logs a heartbeat
-        # instead of looking indistinguishable from a hang. communicate() can
-        # be safely re-called after a TimeoutExpired without losing output.
-        heartbeat_seconds = 15
-        elapsed = 0
-        stdout_data = ""
-        stderr_data = ""
-        while True:
-            try:
-                stdout_data, stderr_data = process.communicate(timeout=heartbeat_seconds)
-                break
-            except subprocess.TimeoutExpired:
-                elapsed += heartbeat_seconds
-                if not suppress_logging:
-                    log.info(f"Still running ({elapsed}s elapsed): {log_cmd}")
-
-        result = subprocess.CompletedProcess(
-            args=cmd_list, returncode=process.returncode, stdout=stdout_data, stderr=stderr_data
-        )
+        if stub is None:
+            result = subprocess.CompletedProcess(
+                args=cmd_list, returncode=process.returncode, stdout=stdout_data, stderr=stderr_data
+            )
+        history.record_command(log_cmd, started, time.time() - started, result.returncode)
 
         if check and result.returncode != 0:
             # This block only executes if 'check=True' AND the command failed.
@@ -143,7 +195,39 @@ class Executor:
                 log.success(f"Executed: {log_cmd}")
 
         return result
-            
+
+    def write_file(self, path: str, content: str, mode: int, owner: Optional[str] = None) -> None:
+        """
+        Installs *content* as the host file *path* with *mode* (and *owner*,
+        ``user[:group]``), replacing it.  On the host it goes through
+        ``install`` from a private temp file, which is always removed.  Under
+        ``--root`` the file is written straight into the alternate root: a
+        shell write there would only be recorded by the stub backend.
+        """
+        if self.dry_run:
+            if not self.quiet:
+                log.info(f"[DRY-RUN] Would write {path} (mode {mode:04o})")
+            return
+        if paths.is_alternate():
+            target = paths.host_path(path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "w") as f:
+                f.write(content)
+            os.chmod(target, mode)
+            return
+
+        user, _, group = (owner or "").partition(":")
+        ownership = (f" -o {user}" if user else "") + (f" -g {group}" if group else "")
+        # NamedTemporaryFile creates it 0600, so the content is never world-readable
+        with tempfile.NamedTemporaryFile("w", prefix="machine-setup-", delete=False) as tmp:
+            tmp.write(content)
+            tmp_path = tmp.name
+        try:
+            self.run(f"install -m {mode:04o}{ownership} {tmp_path} {path}", force_sudo=True)
+        finally:
+            os.unlink(tmp_path)
+
+
 EXEC = Executor()
 
 
@@ -155,12 +239,18 @@ def run_function_as_user(executor: Executor,
     Executes a specific Python function (by name) from the main script as another user
     by recursively calling the setup script.
     
-    NOTE: This call is always interactive to support the deploy key workflow.
+    The child's output is multiplexed onto ours line by line under a "[user]"
+    prefix, so several delegated modules can run at once; the child prompts
+    (and runs interactive commands) on /dev/tty under the terminal lock.
     """
     
+    # From a zipapp, re-exec the bundle itself rather than a checkout
+    entry = constants.BUNDLE or os.path.abspath(
+        os.path.join(constants.REPO_ROOT, 'setup_machine.py')
+    )
     cmd_list = [
         "python3", 
-        os.path.abspath(os.path.join(constants.REPO_ROOT, 'setup_machine.py')), 
+        entry, 
         "--run-cmd", 
         function_name
     ]
@@ -184,9 +274,86 @@ def run_function_as_user(executor: Executor,
         cmd_list.append("--verbose")
     if executor.force:
         cmd_list.append("--force")
+    if executor.profile:
+        cmd_list.extend(["--profile", executor.profile])
+    if paths.is_alternate():
+        cmd_list.extend(["--root", paths.root()])
+
+    # Hand the child our facts snapshot so it doesn't re-probe the host
+    with tempfile.NamedTemporaryFile(
+        prefix="machine-setup-facts-", suffix=".json", delete=False
+    ) as tmp:
+        facts_file = tmp.name
+    executor.facts.save(facts_file)
+    cmd_list.extend(["--facts-file", facts_file])
+    # Where the child hands over deploy-key gates it would otherwise wait on
+    with tempfile.NamedTemporaryFile(prefix="machine-setup-gates-", delete=False) as tmp:
+        gate_file = tmp.name
+    cmd_list.extend(["--gate-file", gate_file])
+    # Let the child's command timings land in this run's history
+    history_context = history.context_arg()
+    if history_context:
+        cmd_list.extend(["--history-context", history_context])
+    # ...and the prefetch phase's results: the mirrors it made usable, and offline mode.
+    # Imported here: offline/prefetch -> executor
+    from . import offline, prefetch
+    fresh = prefetch.fresh_sources()
+    if fresh:
+        cmd_list.extend(["--prefetched", *fresh])
+    bundle = offline.context_arg()
+    if bundle:
+        cmd_list.extend(["--from-bundle", bundle])
     
     log.info(f"Delegating execution to user '{user}' for function: {function_name}")
 
-    # Run non-interactively but set interactive=True 
-    # to allow the sub-process to communicate with the terminal.
-    return executor.run(cmd_list, check=True, interactive=True)
\ No newline at end of file
+    def run_probe(command: str, probe_user: str) -> bool:
+        return executor.run(command, user=probe_user, check=False, run_quiet=True).returncode == 0
+
+    try:
+        result = _run_prefixed(executor, cmd_list, f"[{user}] ")
+        # Probed with the rest of the run's gates; the child re-runs once a key works
+        # (under the same module: checkpoint() resumes it in that module's context)
+        gates.adopt(
+            gate_file, f"{function_name} as {user}", run_probe,
+            lambda: run_function_as_user(executor, user, function_name, *func_args),
+            module=history.current_module(),
+        )
+        return result
+    finally:
+        os.unlink(facts_file)
+        os.unlink(gate_file)
+
+
+def _run_prefixed(executor: Executor,
+                  cmd_list: List[str],
+                  prefix: str) -> subprocess.CompletedProcess[str]:
+    """Runs *cmd_list*, relaying its combined output line by line under *prefix*."""
+    log_cmd = " ".join(cmd_list)
+    if executor.dry_run:
+        if not executor.quiet:
+            log.info(f"[DRY-RUN] {log_cmd}")
+        return subprocess.CompletedProcess(args=cmd_list, returncode=0, stdout="", stderr="")
+
+    if not executor.quiet:
+        log.info(f"Executing: {log_cmd}")
+    # Unbuffered, or the child's log lines arrive in 4 KiB bursts through the pipe
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    process = subprocess.Popen(
+        cmd_list,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=env,
+        universal_newlines=True,
+        errors="replace",
+    )
+    started = time.time()
+    assert process.stdout is not None  # noqa: S101
+    for line in process.stdout:
+        terminal.emit(prefix, line)
+    returncode = process.wait()
+    history.record_command(log_cmd, started, time.time() - started, returncode)
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd_list)
+    return subprocess.CompletedProcess(args=cmd_list, returncode=0, stdout="", stderr="")
\ No newline at end of file
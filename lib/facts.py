@@ -0,0 +1,266 @@
+"""
+facts.py
+========
+A snapshot of host facts gathered once per run: OS release, desktop
+detection, virtualisation type, users/groups and installed packages.
+
+Modules read from ``exec_obj.facts`` instead of each shelling out to
+``id``, ``getent``, ``dpkg -s`` or re-parsing ``/etc/os-release``.  The
+sections are gathered concurrently on first use; a module that mutates
+the host (``useradd``, ``usermod``, ``apt install``) calls
+``facts.refresh(...)`` for the section it changed.
+
+The snapshot is JSON-serialisable so ``--run-cmd`` children started via
+``run_function_as_user`` load it from ``--facts-file`` rather than
+re-probing the host as another user.
+
+Under ``--root`` the files are read from the alternate root (users and
+groups from its etc/passwd and etc/group rather than NSS) and probes go
+to the command stubs.
+"""
+
+import grp
+import json
+import os
+import pwd
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from . import dpkg_status, stubs
+from .logger import log
+from .paths import host_path, is_alternate
+
+SECTIONS: List[str] = ["os_release", "desktop", "virt", "users", "groups", "packages"]
+
+
+@dataclass
+class UserFact:
+    uid: int
+    gid: int
+    home: str
+    shell: str
+
+
+@dataclass
+class GroupFact:
+    gid: int
+    members: List[str]
+
+
+# ---------------------------------------------------------------------------
+# Gatherers (one per section, all read-only)
+# ---------------------------------------------------------------------------
+
+def _probe(cmd: List[str]) -> Optional[subprocess.CompletedProcess[str]]:
+    """Runs a read-only probe (stubbed under --root); None if it isn't installed."""
+    stub = stubs.current()
+    if stub is not None:
+        return stub.run(" ".join(cmd), cmd)
+    if not shutil.which(cmd[0]):
+        return None
+    return subprocess.run(cmd, capture_output=True, text=True, check=False)
+
+
+def _read_colon_file(path: str) -> List[List[str]]:
+    """Fields of each entry in a passwd(5)/group(5)-format file."""
+    try:
+        with open(host_path(path)) as f:
+            return [line.rstrip("\n").split(":") for line in f if line.count(":") >= 3]
+    except FileNotFoundError:
+        return []
+
+
+def _read_os_release() -> Dict[str, str]:
+    """Parses /etc/os-release into a dictionary."""
+    info: Dict[str, str] = {}
+    try:
+        with open(host_path("/etc/os-release")) as f:
+            for line in f:
+                if "=" in line:
+                    key, value = line.rstrip().split("=", 1)
+                    # Remove surrounding quotes often found in these files
+                    info[key] = value.strip('"')
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.error(f"Failed to read /etc/os-release: {e}")
+    return info
+
+
+def _read_desktop() -> bool:
+    from .platform_utils import is_ubuntu_desktop
+
+    return is_ubuntu_desktop()
+
+
+def _read_virt() -> str:
+    """systemd-detect-virt's answer ("none" on bare metal, "" if unknown)."""
+    result = _probe(["systemd-detect-virt"])
+    return result.stdout.strip() if result else ""
+
+
+def _read_users() -> Dict[str, UserFact]:
+    if is_alternate():
+        return {
+            f[0]: UserFact(int(f[2]), int(f[3]), f[5], f[6])
+            for f in _read_colon_file("/etc/passwd")
+            if len(f) >= 7
+        }
+    return {
+        pw.pw_name: UserFact(pw.pw_uid, pw.pw_gid, pw.pw_dir, pw.pw_shell)
+        for pw in pwd.getpwall()
+    }
+
+
+def _read_groups() -> Dict[str, GroupFact]:
+    if is_alternate():
+        return {
+            f[0]: GroupFact(int(f[2]), [m for m in f[3].split(",") if m])
+            for f in _read_colon_file("/etc/group")
+        }
+    return {gr.gr_name: GroupFact(gr.gr_gid, list(gr.gr_mem)) for gr in grp.getgrall()}
+
+
+def _read_packages() -> Dict[str, str]:
+    """Installed package -> version, from the dpkg status database (no subprocess)."""
+    return dpkg_status.installed()
+
+
+_GATHERERS: Dict[str, Callable[[], object]] = {
+    "os_release": _read_os_release,
+    "desktop": _read_desktop,
+    "virt": _read_virt,
+    "users": _read_users,
+    "groups": _read_groups,
+    "packages": _read_packages,
+}
+
+
+# ---------------------------------------------------------------------------
+# Snapshot
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Facts:
+    """Host facts shared by every module for the duration of a run."""
+
+    os_release: Dict[str, str] = field(default_factory=dict)
+    desktop: bool = False
+    virt: str = ""
+    users: Dict[str, UserFact] = field(default_factory=dict)
+    groups: Dict[str, GroupFact] = field(default_factory=dict)
+    packages: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def gather(cls) -> "Facts":
+        """Collects every section concurrently."""
+        facts = cls()
+        facts.refresh(*SECTIONS)
+        return facts
+
+    def refresh(self, *sections: str) -> None:
+        """Re-reads the given sections after the host has been changed."""
+        with ThreadPoolExecutor(max_workers=len(sections) or 1) as pool:
+            values = list(pool.map(lambda s: _GATHERERS[s](), sections))
+        for section, value in zip(sections, values, strict=True):
+            setattr(self, section, value)
+
+    # --- OS ---
+
+    @property
+    def os_id(self) -> str:
+        return self.os_release.get("ID", "")
+
+    @property
+    def codename(self) -> str:
+        # Docker's Ubuntu install docs prefer UBUNTU_CODENAME over VERSION_CODENAME
+        # (falling back to the latter): unofficial derivatives like Mint or Pop!_OS
+        # report their own VERSION_CODENAME but still carry UBUNTU_CODENAME for the
+        # underlying Ubuntu release.
+        return self.os_release.get("UBUNTU_CODENAME") or self.os_release.get(
+            "VERSION_CODENAME", ""
+        )
+
+    @property
+    def is_vm(self) -> bool:
+        return self.virt not in ("", "none")
+
+    # --- Users and groups ---
+
+    def user_exists(self, user: str) -> bool:
+        return user in self.users
+
+    def uid(self, user: str) -> int:
+        """The user's uid; raises KeyError if the user doesn't exist."""
+        return self.users[user].uid
+
+    def gid(self, user: str) -> int:
+        """The user's primary gid; raises KeyError if the user doesn't exist."""
+        return self.users[user].gid
+
+    def home(self, user: str) -> str:
+        """The user's home directory; raises KeyError if the user doesn't exist."""
+        return self.users[user].home
+
+    def group_exists(self, group: str) -> bool:
+        return group in self.groups
+
+    def user_groups(self, user: str) -> List[str]:
+        """Primary plus supplementary group names (as ``id -nG`` would list them)."""
+        primary = self.users[user].gid if user in self.users else None
+        return [
+            name
+            for name, g in self.groups.items()
+            if g.gid == primary or user in g.members
+        ]
+
+    def uid_taken(self, uid: int) -> bool:
+        return any(u.uid == uid for u in self.users.values())
+
+    def gid_taken(self, gid: int) -> bool:
+        return any(g.gid == gid for g in self.groups.values())
+
+    # --- Packages ---
+
+    def is_installed(self, package: str) -> bool:
+        """*package* may be arch-qualified (``libc6:i386``); that is looked up in dpkg's index."""
+        if ":" in package:
+            return dpkg_status.is_installed(package)
+        return package in self.packages
+
+    # --- Serialisation ---
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, text: str) -> "Facts":
+        data = json.loads(text)
+        return cls(
+            os_release=data["os_release"],
+            desktop=data["desktop"],
+            virt=data["virt"],
+            users={name: UserFact(**u) for name, u in data["users"].items()},
+            groups={name: GroupFact(**g) for name, g in data["groups"].items()},
+            packages=data["packages"],
+        )
+
+    def save(self, path: str) -> None:
+        """Writes the snapshot for a delegated child process to load."""
+        with open(path, "w") as f:
+            f.write(self.to_json())
+        # The child runs as another user; passwd/group data is world-readable anyway.
+        os.chmod(path, 0o644)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Facts"]:
+        """Loads a snapshot written by the parent; None if it's missing or unreadable."""
+        try:
+            with open(path) as f:
+                return cls.from_json(f.read())
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.debug(f"Could not load facts from {path}: {e}")
+            return None
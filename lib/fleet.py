@@ -0,0 +1,303 @@
+"""
+fleet.py
+========
+Inventory-driven fleet runner: pushes this orchestrator to N hosts over SSH
+and runs the selected modules on each one, a bounded number at a time.
+
+Inventory format (TOML)
+-----------------------
+    [defaults]
+    ssh_user = "root"          # optional; non-root users get 'sudo -n'
+    args = ["--packages"]      # optional; extra flags for every host
+
+    [hosts.web1]
+    address = "web1.example.org"
+    args = ["--docker"]        # optional; appended after the defaults
+
+    [hosts.vm2]
+    address = "100.64.0.12"
+    port = 2222
+
+Flags given on the command line alongside ``--fleet`` (minus the fleet
+flags themselves) are forwarded to every host ahead of the inventory args.
+Flags naming a local file (``--profile``, ``--report``, ...) are rejected:
+the hosts can't read it.  Put them in the inventory args instead, with a
+path on the host.
+
+Each host's output is streamed line-by-line with a ``[host]`` prefix, and a
+per-host summary table is printed once every host has finished.
+"""
+
+import io
+import os
+import shlex
+import subprocess
+import tarfile
+import time
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from . import terminal
+from .constants import BUNDLE, FLEET_REMOTE_DIR, REPO_ROOT
+from .executor import Executor
+from .logger import log
+
+# Paths (relative to REPO_ROOT) shipped to each host.
+_BUNDLE_MEMBERS: List[str] = ["setup_machine.py", "lib", "tools", "requirements.txt"]
+# Name the zipapp is shipped under when fleet mode itself runs from one
+_ZIPAPP_NAME: str = "machine-setup.pyz"
+
+# Flags consumed locally by the fleet runner; never forwarded to hosts.
+_FLEET_FLAGS_WITH_VALUE: List[str] = ["--fleet", "--fleet-concurrency", "--fleet-hosts"]
+
+# Flags whose value is a file on this machine, which the hosts can't open.
+# (Inventory args may use them, with paths on the host.)
+_LOCAL_FILE_FLAGS: List[str] = [
+    "--profile", "--from-bundle", "--offline-bundle", "--snapshot-import",
+    "--snapshot-export", "--report", "--check-output",
+]
+
+_SSH_OPTS: List[str] = [
+    "-o", "BatchMode=yes",
+    "-o", "ConnectTimeout=15",
+    "-o", "ServerAliveInterval=30",
+]
+
+
+@dataclass
+class FleetHost:
+    """One inventory entry."""
+
+    name: str
+    address: str
+    ssh_user: str = "root"
+    port: int = 22
+    args: List[str] = field(default_factory=list)
+
+    @property
+    def target(self) -> str:
+        return f"{self.ssh_user}@{self.address}"
+
+
+@dataclass
+class FleetResult:
+    """Outcome of provisioning a single host."""
+
+    host: str
+    returncode: int
+    duration: float
+    stage: str = "run"
+
+
+def _table(value: Any, where: str) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        raise ValueError(f"{where} must be a table, not {type(value).__name__}.")
+    return value
+
+
+def _args(table: Dict[str, Any], where: str) -> List[str]:
+    args = table.get("args", [])
+    if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+        raise ValueError(f"{where}: 'args' must be a list of strings.")
+    return args
+
+
+def load_inventory(path: str) -> List[FleetHost]:
+    """Parses a TOML inventory file into a list of FleetHost entries; raises ValueError."""
+    try:
+        with open(path, "rb") as f:
+            data: Dict[str, Any] = tomllib.load(f)
+    except OSError as e:
+        raise ValueError(f"Cannot read inventory {path}: {e.strerror}") from e
+    except tomllib.TOMLDecodeError as e:
+        raise ValueError(f"Invalid inventory {path}: {e}") from e
+
+    defaults = _table(data.get("defaults", {}), f"{path}: [defaults]")
+    hosts: List[FleetHost] = []
+    for name, value in _table(data.get("hosts", {}), f"{path}: [hosts]").items():
+        where = f"{path}: [hosts.{name}]"
+        entry = _table(value, where)
+        try:
+            port = int(entry.get("port", defaults.get("port", 22)))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{where}: invalid port: {e}") from e
+        hosts.append(
+            FleetHost(
+                name=name,
+                address=str(entry.get("address", name)),
+                ssh_user=str(entry.get("ssh_user", defaults.get("ssh_user", "root"))),
+                port=port,
+                args=_args(defaults, f"{path}: [defaults]") + _args(entry, where),
+            )
+        )
+
+    if not hosts:
+        raise ValueError(f"No [hosts.*] entries found in inventory {path}")
+    return hosts
+
+
+def strip_fleet_args(argv: List[str]) -> List[str]:
+    """Returns argv with the fleet-only flags (and their values) removed."""
+    forwarded: List[str] = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in _FLEET_FLAGS_WITH_VALUE:
+            skip_next = True
+            continue
+        if any(arg.startswith(f"{flag}=") for flag in _FLEET_FLAGS_WITH_VALUE):
+            continue
+        forwarded.append(arg)
+    return forwarded
+
+
+def local_file_flags(argv: List[str]) -> List[str]:
+    """The flags in *argv* that name a local file (rejected alongside --fleet)."""
+    return [
+        flag for flag in _LOCAL_FILE_FLAGS
+        if any(arg == flag or arg.startswith(f"{flag}=") for arg in argv)
+    ]
+
+
+def build_bundle() -> bytes:
+    """Packs the orchestrator (script, lib/, tools/, or the zipapp) into an in-memory tar.gz."""
+
+    def _exclude_caches(info: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+        if "__pycache__" in info.name or info.name.endswith(".pyc"):
+            return None
+        return info
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        if BUNDLE:
+            # Running from the zipapp: it's self-contained, so ship it as is
+            tar.add(BUNDLE, arcname=_ZIPAPP_NAME)
+        else:
+            for member in _BUNDLE_MEMBERS:
+                src = os.path.join(REPO_ROOT, member)
+                if os.path.exists(src):
+                    tar.add(src, arcname=member, filter=_exclude_caches)
+    return buf.getvalue()
+
+
+def _ssh_cmd(host: FleetHost, remote_cmd: str) -> List[str]:
+    return ["ssh", *_SSH_OPTS, "-p", str(host.port), host.target, remote_cmd]
+
+
+def _push_bundle(exec_obj: Executor, host: FleetHost, bundle: bytes) -> int:
+    """Streams the bundle to the host and unpacks it into FLEET_REMOTE_DIR."""
+    remote = (
+        f"rm -rf {FLEET_REMOTE_DIR} && mkdir -p {FLEET_REMOTE_DIR} "
+        f"&& tar -xzf - -C {FLEET_REMOTE_DIR}"
+    )
+    cmd = _ssh_cmd(host, remote)
+    if exec_obj.dry_run:
+        log.info(f"[{host.name}] [DRY-RUN] {' '.join(cmd)} < bundle ({len(bundle)} bytes)")
+        return 0
+
+    result = subprocess.run(cmd, input=bundle, capture_output=True)
+    if result.returncode != 0:
+        log.error(f"[{host.name}] Bundle push failed: {result.stderr.decode(errors='replace')}")
+    return result.returncode
+
+
+def _run_remote(exec_obj: Executor, host: FleetHost, module_args: List[str]) -> int:
+    """Runs the pushed orchestrator on the host, streaming prefixed output."""
+    sudo = "" if host.ssh_user == "root" else "sudo -n "
+    entry = _ZIPAPP_NAME if BUNDLE else "setup_machine.py"
+    remote = f"{sudo}python3 {FLEET_REMOTE_DIR}/{entry} {shlex.join(module_args)}"
+    cmd = _ssh_cmd(host, remote)
+    if exec_obj.dry_run:
+        log.info(f"[{host.name}] [DRY-RUN] {' '.join(cmd)}")
+        return 0
+
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        errors="replace",
+    )
+    assert process.stdout is not None  # noqa: S101
+    for line in process.stdout:
+        terminal.emit(f"[{host.name}] ", line)
+    return process.wait()
+
+
+def _provision_host(
+    exec_obj: Executor, host: FleetHost, bundle: bytes, forwarded_args: List[str]
+) -> FleetResult:
+    start = time.monotonic()
+    stage = "push"
+    try:
+        log.info(f"[{host.name}] Pushing orchestrator bundle to {host.target}...")
+        rc = _push_bundle(exec_obj, host, bundle)
+        if rc != 0:
+            return FleetResult(host.name, rc, time.monotonic() - start, stage=stage)
+
+        stage = "run"
+        module_args = forwarded_args + host.args
+        log.info(f"[{host.name}] Running: setup_machine.py {' '.join(module_args)}")
+        rc = _run_remote(exec_obj, host, module_args)
+    except OSError as e:
+        # e.g. no ssh binary: this host failed, the rest of the fleet carries on
+        log.error(f"[{host.name}] Could not {stage}: {e}")
+        return FleetResult(host.name, 255, time.monotonic() - start, stage=stage)
+    return FleetResult(host.name, rc, time.monotonic() - start)
+
+
+def _print_summary(results: List[FleetResult]) -> None:
+    border = "=" * 60
+    print(f"\n{border}")
+    print(f"  {'HOST':<24} {'STATUS':<14} {'EXIT':>4} {'TIME':>10}")
+    print(border)
+    for r in results:
+        status = "ok" if r.returncode == 0 else f"FAILED ({r.stage})"
+        print(f"  {r.host:<24} {status:<14} {r.returncode:>4} {r.duration:>9.1f}s")
+    print(border + "\n")
+
+
+def run_fleet(
+    exec_obj: Executor,
+    inventory_path: str,
+    forwarded_args: List[str],
+    concurrency: int,
+    only_hosts: Optional[List[str]] = None,
+) -> bool:
+    """
+    Provisions every host in the inventory, at most *concurrency* at a time.
+    Returns True only if every host succeeded.
+    """
+    hosts = load_inventory(inventory_path)
+    if only_hosts:
+        hosts = [h for h in hosts if h.name in only_hosts]
+        if not hosts:
+            log.error(f"None of the requested hosts are in {inventory_path}: {only_hosts}")
+            return False
+
+    # The bundle is identical for every host, so build it once up front.
+    bundle = build_bundle()
+    log.info(
+        f"Provisioning {len(hosts)} host(s) with concurrency {concurrency} "
+        f"(bundle: {len(bundle)} bytes)."
+    )
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [
+            pool.submit(_provision_host, exec_obj, host, bundle, forwarded_args)
+            for host in hosts
+        ]
+        results = [f.result() for f in futures]
+
+    _print_summary(results)
+    failed = [r.host for r in results if r.returncode != 0]
+    if failed:
+        log.error(f"Fleet run failed on {len(failed)} host(s): {', '.join(failed)}")
+        return False
+    log.success(f"Fleet run completed on all {len(results)} host(s).")
+    return True
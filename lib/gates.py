@@ -0,0 +1,303 @@
+"""
+gates.py
+========
+Non-blocking human-in-the-loop gates, used for deploy-key authorisation.
+
+When a private clone fails because its deploy key isn't authorised yet,
+the caller opens a gate instead of blocking on ``input()``: the key's
+instructions are queued, and the run carries on with unrelated work.
+A background thread probes each pending gate (``git ls-remote`` / SSH) with
+exponential backoff; once a probe succeeds, the gate's continuation (the
+dependent clone and everything after it) runs at the next checkpoint.
+
+* ``checkpoint()`` — called between modules / sub-steps: prints every newly
+  pending key in one block and runs the continuations of ready gates.
+  Continuations always run on the calling (main) thread, never the poller.
+* ``wait_all()`` — barrier at the end of a run: waits until every gate has
+  opened and resumed, or GATE_TIMEOUT_SECONDS passes (under ``--budget``, no
+  longer than what is left of it, handing what's still gated to the
+  follow-up run).
+* ``hand_off()`` / ``adopt()`` — the barrier of a delegated module.  The
+  parent is blocked on the child, so the child doesn't wait: it writes its
+  pending gates' probe commands to the parent's hand-off file and exits, and
+  the parent opens one gate for them that re-runs the child once a key works.
+"""
+
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+from . import history, terminal
+from .constants import GATE_TIMEOUT_SECONDS
+from .logger import log
+
+_BACKOFF_START: float = 5.0
+_BACKOFF_MAX: float = 60.0
+_REMINDER_SECONDS: int = 60
+
+
+@dataclass
+class Gate:
+    """A piece of work waiting on a human to authorise something."""
+
+    name: str
+    instructions: Callable[[], None]  # prints what the human needs to do
+    probe: Callable[[], bool]  # True once the work can proceed
+    resume: Callable[[], None]  # the dependent work
+    # (shell command, user) equivalent to probe, so a parent process can run it
+    probe_command: Optional[Tuple[str, str]] = None
+    announced: bool = False
+    # The orchestrator module that opened it (journalled as failed if it never resumes)
+    module: Optional[str] = field(default_factory=history.current_module)
+    ready: bool = False
+    attempts: int = 0
+    next_probe: float = field(default_factory=time.monotonic)
+
+
+_PENDING: List[Gate] = []
+_FAILED: List[Gate] = []
+_failed_modules: List[str] = []
+_LOCK = threading.Lock()
+_CHANGED = threading.Event()  # set by the poller when a gate becomes ready
+_poller: Optional[threading.Thread] = None
+# In a delegated child: where hand_off() writes the pending gates for the parent
+_handoff_file: Optional[str] = None
+
+
+def _backoff(attempts: int) -> float:
+    return float(min(_BACKOFF_MAX, _BACKOFF_START * (2 ** attempts)))
+
+
+def _poll_loop() -> None:
+    while True:
+        with _LOCK:
+            due = [g for g in _PENDING if not g.ready and g.next_probe <= time.monotonic()]
+        for gate in due:
+            try:
+                ok = gate.probe()
+            except Exception as e:
+                log.debug(f"Gate '{gate.name}': probe error: {e}")
+                ok = False
+            with _LOCK:
+                gate.attempts += 1
+                if ok:
+                    gate.ready = True
+                    _CHANGED.set()
+                else:
+                    gate.next_probe = time.monotonic() + _backoff(gate.attempts)
+        time.sleep(1)
+
+
+def open_gate(
+    name: str,
+    instructions: Callable[[], None],
+    probe: Callable[[], bool],
+    resume: Callable[[], None],
+    probe_command: Optional[Tuple[str, str]] = None,
+    announced: bool = False,
+    module: Optional[str] = None,
+) -> None:
+    """
+    Registers a gate; its instructions are printed at the next checkpoint
+    (unless *announced*: someone else already printed them).  *module* is
+    the orchestrator module it belongs to (default: the calling thread's).
+    """
+    global _poller
+    gate = Gate(name, instructions, probe, resume, probe_command, announced)
+    if module is not None:
+        gate.module = module
+    with _LOCK:
+        _PENDING.append(gate)
+        if _poller is None:
+            _poller = threading.Thread(target=_poll_loop, name="gate-poller", daemon=True)
+            _poller.start()
+    log.warning(f"'{name}' is waiting on an authorisation; carrying on with other work.")
+
+
+def pending() -> List[str]:
+    with _LOCK:
+        return [g.name for g in _PENDING]
+
+
+def _announce() -> None:
+    """Prints the instructions of every not-yet-announced gate in one block."""
+    with _LOCK:
+        new = [g for g in _PENDING if not g.announced and not g.ready]
+        for gate in new:
+            gate.announced = True
+    if not new:
+        return
+
+    # One block, even if other modules are writing concurrently
+    with terminal.owner():
+        print("\n" + "#" * 70, flush=True)
+        log.warning(
+            f"ACTION REQUIRED: {len(new)} deploy key(s) to authorise. "
+            "The run continues meanwhile; each is retried automatically."
+        )
+        print("#" * 70, flush=True)
+        for gate in new:
+            try:
+                gate.instructions()
+            except Exception as e:
+                log.error(f"Could not show instructions for '{gate.name}': {e}")
+        print("#" * 70 + "\n", flush=True)
+
+
+def checkpoint() -> None:
+    """Announces newly pending gates and resumes any that have opened."""
+    _announce()
+    with _LOCK:
+        ready = [g for g in _PENDING if g.ready]
+        for gate in ready:
+            _PENDING.remove(gate)
+        if not any(g.ready for g in _PENDING):
+            _CHANGED.clear()
+
+    for gate in ready:
+        log.success(f"'{gate.name}' is authorised now; resuming.")
+        try:
+            # Still the opening module's work (its commands, and any gate it opens again)
+            with history.module_context(gate.module):
+                gate.resume()
+        except Exception as e:
+            log.error(f"Resumed work for '{gate.name}' failed: {e}")
+            _FAILED.append(gate)
+
+
+def wait_all(timeout: float = GATE_TIMEOUT_SECONDS, defer: bool = False) -> List[str]:
+    """
+    Blocks until every pending gate has opened and its work has run.
+    Raises RuntimeError if any gate timed out or its resumed work failed.
+    With *defer*, gates still pending at the timeout aren't failures: they
+    are dropped and the modules that opened them are returned (to run again
+    later); gates opened outside a module still fail.
+    """
+    deferred: List[str] = []
+    checkpoint()
+    waiting_for = pending()
+    started = time.time()
+    start = time.monotonic()
+    last_reminder = start
+    while pending():
+        elapsed = time.monotonic() - start
+        if elapsed >= timeout:
+            with _LOCK:
+                timed_out = list(_PENDING)
+                _PENDING.clear()
+            if defer:
+                deferred = list(dict.fromkeys(g.module for g in timed_out if g.module))
+                timed_out = [g for g in timed_out if not g.module]
+                if deferred:
+                    log.warning(
+                        f"Stopped waiting after {int(elapsed)}s for deploy keys of: "
+                        f"{', '.join(deferred)}"
+                    )
+            if timed_out:
+                names = ", ".join(g.name for g in timed_out)
+                log.error(f"Gave up after {int(elapsed)}s waiting for authorisation of: {names}")
+                _FAILED.extend(timed_out)
+            break
+        if time.monotonic() - last_reminder >= _REMINDER_SECONDS:
+            log.info(f"Still waiting ({int(elapsed)}s elapsed) for: {', '.join(pending())}")
+            last_reminder = time.monotonic()
+        _CHANGED.wait(timeout=min(5.0, timeout - elapsed))
+        checkpoint()
+    if waiting_for:
+        history.record_wait(
+            f"deploy keys: {', '.join(waiting_for)}", started, time.time() - started
+        )
+    _raise_failed()
+    return deferred
+
+
+def _raise_failed() -> None:
+    if _FAILED:
+        failed = list(_FAILED)
+        _FAILED.clear()
+        _failed_modules[:] = list(dict.fromkeys(g.module for g in failed if g.module))
+        raise RuntimeError(
+            f"Gated work did not complete for: {', '.join(g.name for g in failed)}"
+        )
+
+
+def failed_modules() -> List[str]:
+    """The modules whose gated work didn't complete, after wait_all() raised."""
+    return list(_failed_modules)
+
+
+def set_handoff_file(path: str) -> None:
+    """In a delegated child (``--gate-file``): hand_off() writes to *path*."""
+    global _handoff_file
+    _handoff_file = path
+
+
+def hand_off() -> bool:
+    """
+    The barrier of a delegated module.  Returns True if nothing is pending
+    (the module is complete).  Otherwise the pending gates are written to
+    the hand-off file for the parent to adopt() and False is returned: the
+    parent re-runs the module once a key works.  Without a parent to hand
+    to, or for a gate that can't be probed from outside, it waits here
+    (wait_all()) instead.
+    """
+    checkpoint()
+    with _LOCK:
+        handed = list(_PENDING)
+    if handed and _handoff_file is not None and all(g.probe_command for g in handed):
+        with open(_handoff_file, "w") as f:
+            json.dump([
+                {"name": g.name, "command": g.probe_command[0], "user": g.probe_command[1]}
+                for g in handed if g.probe_command
+            ], f)
+        with _LOCK:
+            for gate in handed:
+                _PENDING.remove(gate)
+        _raise_failed()
+        log.warning(
+            f"Handing {', '.join(g.name for g in handed)} to the parent run; "
+            "this module re-runs once a key is authorised."
+        )
+        return False
+    wait_all()
+    return True
+
+
+def adopt(
+    path: str,
+    label: str,
+    run_probe: Callable[[str, str], bool],
+    rerun: Callable[[], object],
+    module: Optional[str],
+) -> None:
+    """
+    In the parent: opens one gate of *module* for whatever the delegated
+    child *label* handed off to *path*.  It opens once any of the child's
+    probes (``run_probe(command, user)``) succeeds, and resumes by re-running
+    the child (*rerun*), which hands off again whatever is still pending.
+    The child already printed the instructions.
+    """
+    try:
+        with open(path) as f:
+            handed = json.load(f)
+    except (OSError, ValueError):
+        return  # empty: the child completed
+    if not handed:
+        return
+
+    def probe() -> bool:
+        return any(run_probe(g["command"], g["user"]) for g in handed)
+
+    def resume() -> None:
+        rerun()
+
+    open_gate(
+        f"{label} ({', '.join(g['name'] for g in handed)})",
+        lambda: None,
+        probe,
+        resume,
+        announced=True,
+        module=module,
+    )
@@ -0,0 +1,509 @@
+"""
+history.py
+==========
+Historical run database (HISTORY_DB, SQLite).  Every real run records its
+per-module durations, the timing of every command the Executor ran, time
+spent waiting on a human (prompts, deploy-key gates) and a few counters
+(bytes downloaded, repos updated; see ``count()``).
+
+From that history the orchestrator:
+
+* shows an ETA for the rest of the run as each module starts (sum of the
+  remaining modules' median durations),
+* flags a module that took much longer than its historical median, and
+* lists those regressions across runs with ``--history``.
+
+Delegated ``--run-cmd`` children record their commands into the same run
+via ``--history-context``.  History is best-effort: a database error is
+logged at debug level and never fails a run.  Dry runs aren't recorded.
+"""
+
+import os
+import socket
+import sqlite3
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from .constants import HISTORY_DB, STATE_DIR
+from .logger import log
+from .paths import host_path
+
+if TYPE_CHECKING:
+    from .executor import Executor
+
+# A module is flagged slow if it takes SLOW_FACTOR x its median duration
+# and at least SLOW_MIN_SECONDS longer (so quick modules' jitter isn't flagged).
+SLOW_FACTOR: float = 1.5
+SLOW_MIN_SECONDS: float = 10.0
+# Successful runs needed before a module's median is trusted
+MIN_SAMPLES: int = 3
+# Most recent successful runs of a module that its median is taken over
+_MEDIAN_WINDOW: int = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, started REAL, finished REAL, host TEXT, argv TEXT, ok INTEGER
+);
+CREATE TABLE IF NOT EXISTS modules (
+    run_id INTEGER, module TEXT, started REAL, duration REAL, ok INTEGER, slow INTEGER
+);
+CREATE TABLE IF NOT EXISTS commands (
+    run_id INTEGER, module TEXT, command TEXT, started REAL, duration REAL, returncode INTEGER
+);
+CREATE TABLE IF NOT EXISTS counters (
+    run_id INTEGER, module TEXT, name TEXT, value INTEGER
+);
+CREATE TABLE IF NOT EXISTS waits (
+    run_id INTEGER, module TEXT, label TEXT, started REAL, duration REAL
+);
+CREATE INDEX IF NOT EXISTS modules_by_name ON modules (module, run_id);
+CREATE INDEX IF NOT EXISTS commands_by_run ON commands (run_id, module);
+"""
+
+
+@dataclass
+class Baseline:
+    median: float
+    samples: int
+
+
+@dataclass
+class ModuleRecord:
+    module: str
+    duration: float
+    ok: bool
+    commands: int
+
+
+@dataclass
+class Span:
+    """One bar on a run's timeline (see report.py)."""
+
+    module: Optional[str]
+    label: str
+    started: float
+    duration: float
+    ok: bool
+
+
+@dataclass
+class Timeline:
+    run_id: int
+    started: float
+    finished: Optional[float]
+    argv: str
+    modules: List[Span]
+    commands: List[Span]
+    waits: List[Span]
+
+
+@dataclass
+class RunRecord:
+    """The current run as recorded so far (see metrics.py)."""
+
+    started: float
+    finished: Optional[float]
+    ok: Optional[bool]
+    modules: List[ModuleRecord]
+    commands: int
+    counters: Dict[str, int]
+    last_success: Optional[float]
+
+
+_run_id: Optional[int] = None
+_default_module: Optional[str] = None  # set in delegated children
+_local = threading.local()  # .module: the module the calling thread is running
+_commands: List[Tuple[int, Optional[str], str, float, float, int]] = []
+_commands_lock = threading.Lock()
+# (module, name, amount); kept until a run is being recorded (prefetch runs before it starts)
+_counters: List[Tuple[Optional[str], str, int]] = []
+_waits: List[Tuple[int, Optional[str], str, float, float]] = []
+_baseline: Dict[str, Baseline] = {}
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(host_path(STATE_DIR), exist_ok=True)
+    conn = sqlite3.connect(host_path(HISTORY_DB), timeout=30)
+    # WAL lets delegated children append while the parent holds the database open
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def current_module() -> Optional[str]:
+    """The module the calling thread is running (a delegated child's, by default)."""
+    return getattr(_local, "module", None) or _default_module
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, secs = divmod(int(round(seconds)), 60)
+    return f"{minutes}m{secs:02d}s" if minutes else f"{secs}s"
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+def begin_run(exec_obj: "Executor", argv: List[str], modules: List[str]) -> None:
+    """Opens a run record and loads the baselines for the planned *modules*."""
+    global _run_id
+    if exec_obj.dry_run:
+        return
+    try:
+        with _connect() as conn:
+            _baseline.update(_load_baselines(conn, modules))
+            cur = conn.execute(
+                "INSERT INTO runs (started, host, argv) VALUES (?, ?, ?)",
+                (time.time(), socket.gethostname(), " ".join(argv)),
+            )
+            _run_id = cur.lastrowid
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        log.debug(f"Run history disabled: {e}")
+
+
+def attach(context: str) -> None:
+    """In a delegated child: records into the parent's run/module (``RUN_ID:MODULE``)."""
+    global _run_id, _default_module
+    run_id, _, module = context.partition(":")
+    _run_id = int(run_id)
+    _default_module = module or None
+
+
+def context_arg() -> Optional[str]:
+    """The ``--history-context`` value for a delegated child, if a run is being recorded."""
+    if _run_id is None:
+        return None
+    return f"{_run_id}:{current_module() or ''}"
+
+
+def record_command(command: str, started: float, duration: float, returncode: int) -> None:
+    """Called by the Executor for every command it runs; buffered until the module ends."""
+    if _run_id is None:
+        return
+    with _commands_lock:
+        _commands.append((_run_id, current_module(), command, started, duration, returncode))
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Adds *amount* to the run's *name* counter (e.g. ``repos_updated``)."""
+    with _commands_lock:
+        _counters.append((current_module(), name, amount))
+
+
+def record_wait(label: str, started: float, duration: float) -> None:
+    """Records time spent waiting on a human (a prompt, a deploy-key gate)."""
+    if _run_id is None:
+        return
+    with _commands_lock:
+        _waits.append((_run_id, current_module(), label, started, duration))
+
+
+def flush() -> None:
+    """Writes buffered command timings, waits and counters."""
+    if _run_id is None:
+        return
+    with _commands_lock:
+        pending = list(_commands)
+        _commands.clear()
+        waits = list(_waits)
+        _waits.clear()
+        counters = [(_run_id, module, name, amount) for module, name, amount in _counters]
+        _counters.clear()
+    if not pending and not waits and not counters:
+        return
+    try:
+        with _connect() as conn:
+            conn.executemany(
+                "INSERT INTO commands (run_id, module, command, started, duration, returncode) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                pending,
+            )
+            conn.executemany(
+                "INSERT INTO waits (run_id, module, label, started, duration) "
+                "VALUES (?, ?, ?, ?, ?)",
+                waits,
+            )
+            conn.executemany(
+                "INSERT INTO counters (run_id, module, name, value) VALUES (?, ?, ?, ?)",
+                counters,
+            )
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        log.debug(f"Could not record command timings: {e}")
+
+
+def start_module(module: str) -> None:
+    """Attributes the calling thread's commands to *module*."""
+    _local.module = module
+
+
+@contextmanager
+def module_context(module: Optional[str]) -> Iterator[None]:
+    """Attributes the calling thread's commands to *module* for a while (resumed gated work)."""
+    previous = getattr(_local, "module", None)
+    _local.module = module
+    try:
+        yield
+    finally:
+        _local.module = previous
+
+
+def finish_module(module: str, started: float, ok: bool) -> None:
+    """Records *module*'s duration, warning if it was much slower than usual."""
+    _local.module = None
+    if _run_id is None:
+        return
+    duration = time.time() - started
+    base = _baseline.get(module)
+    slow = bool(
+        ok
+        and base
+        and base.samples >= MIN_SAMPLES
+        and duration >= base.median * SLOW_FACTOR
+        and duration - base.median >= SLOW_MIN_SECONDS
+    )
+    if slow and base:
+        log.warning(
+            f"'{module}' took {_format_duration(duration)}, "
+            f"{duration / base.median:.1f}x its median of {_format_duration(base.median)} "
+            f"over {base.samples} runs. See --history."
+        )
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT INTO modules (run_id, module, started, duration, ok, slow) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (_run_id, module, started, duration, int(ok), int(slow)),
+            )
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        log.debug(f"Could not record module timing: {e}")
+    flush()
+
+
+def end_run(ok: bool) -> None:
+    if _run_id is None:
+        return
+    flush()
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "UPDATE runs SET finished = ?, ok = ? WHERE id = ?", (time.time(), int(ok), _run_id)
+            )
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        log.debug(f"Could not close run record: {e}")
+
+
+def run_record() -> Optional[RunRecord]:
+    """The current run's record (including delegated children's), or None if not recorded."""
+    if _run_id is None:
+        return None
+    try:
+        with _connect() as conn:
+            started, finished, ok = conn.execute(
+                "SELECT started, finished, ok FROM runs WHERE id = ?", (_run_id,)
+            ).fetchone()
+            per_module = dict(
+                conn.execute(
+                    "SELECT module, COUNT(*) FROM commands WHERE run_id = ? GROUP BY module",
+                    (_run_id,),
+                ).fetchall()
+            )
+            modules = [
+                ModuleRecord(module, duration, bool(module_ok), per_module.get(module, 0))
+                for module, duration, module_ok in conn.execute(
+                    "SELECT module, duration, ok FROM modules WHERE run_id = ? ORDER BY started",
+                    (_run_id,),
+                )
+            ]
+            counters = dict(
+                conn.execute(
+                    "SELECT name, SUM(value) FROM counters WHERE run_id = ? GROUP BY name",
+                    (_run_id,),
+                ).fetchall()
+            )
+            (last_success,) = conn.execute(
+                "SELECT MAX(finished) FROM runs WHERE ok = 1"
+            ).fetchone()
+        conn.close()
+    except (sqlite3.Error, OSError, TypeError) as e:
+        log.debug(f"Could not read the run record: {e}")
+        return None
+    return RunRecord(
+        started=started,
+        finished=finished,
+        ok=None if ok is None else bool(ok),
+        modules=modules,
+        commands=sum(per_module.values()),
+        counters=counters,
+        last_success=last_success,
+    )
+
+
+def timeline() -> Optional[Timeline]:
+    """Every module, command and wait of the current run, or None if it isn't recorded."""
+    if _run_id is None:
+        return None
+    try:
+        with _connect() as conn:
+            started, finished, argv = conn.execute(
+                "SELECT started, finished, argv FROM runs WHERE id = ?", (_run_id,)
+            ).fetchone()
+            modules = [
+                Span(module, module, start, duration, bool(ok))
+                for module, start, duration, ok in conn.execute(
+                    "SELECT module, started, duration, ok FROM modules WHERE run_id = ?",
+                    (_run_id,),
+                )
+            ]
+            commands = [
+                Span(module, command, start, duration, returncode == 0)
+                for module, command, start, duration, returncode in conn.execute(
+                    "SELECT module, command, started, duration, returncode FROM commands "
+                    "WHERE run_id = ? ORDER BY started",
+                    (_run_id,),
+                )
+            ]
+            waits = [
+                Span(module, label, start, duration, True)
+                for module, label, start, duration in conn.execute(
+                    "SELECT module, label, started, duration FROM waits "
+                    "WHERE run_id = ? ORDER BY started",
+                    (_run_id,),
+                )
+            ]
+        conn.close()
+    except (sqlite3.Error, OSError, TypeError) as e:
+        log.debug(f"Could not read the run timeline: {e}")
+        return None
+    return Timeline(_run_id, started, finished, argv, modules, commands, waits)
+
+
+# ---------------------------------------------------------------------------
+# Prediction
+# ---------------------------------------------------------------------------
+
+def _load_baselines(conn: sqlite3.Connection, modules: List[str]) -> Dict[str, Baseline]:
+    baselines: Dict[str, Baseline] = {}
+    for module in modules:
+        rows = conn.execute(
+            "SELECT duration FROM modules WHERE module = ? AND ok = 1 "
+            "ORDER BY run_id DESC LIMIT ?",
+            (module, _MEDIAN_WINDOW),
+        ).fetchall()
+        if rows:
+            baselines[module] = Baseline(statistics.median(r[0] for r in rows), len(rows))
+    return baselines
+
+
+def estimates(modules: List[str]) -> Dict[str, float]:
+    """Median successful duration of each of *modules* that has any history (for --budget)."""
+    if not os.path.exists(host_path(HISTORY_DB)):
+        return {}
+    try:
+        with _connect() as conn:
+            baselines = _load_baselines(conn, modules)
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        log.debug(f"Run history unavailable for estimates: {e}")
+        return {}
+    return {module: b.median for module, b in baselines.items()}
+
+
+def recent_totals(names: List[str]) -> Dict[str, int]:
+    """Each counter in *names* summed over the most recent runs that recorded it."""
+    if not os.path.exists(host_path(HISTORY_DB)):
+        return {}
+    totals: Dict[str, int] = {}
+    try:
+        with _connect() as conn:
+            for name in names:
+                row = conn.execute(
+                    "SELECT SUM(value) FROM counters WHERE name = ? AND run_id IN "
+                    "(SELECT DISTINCT run_id FROM counters WHERE name = ? "
+                    "ORDER BY run_id DESC LIMIT ?)",
+                    (name, name, _MEDIAN_WINDOW),
+                ).fetchone()
+                if row and row[0]:
+                    totals[name] = int(row[0])
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        log.debug(f"Run history unavailable for counters: {e}")
+    return totals
+
+
+def eta_message(remaining: List[str]) -> Optional[str]:
+    """'ETA ~3m10s' for the *remaining* modules, from their medians; None if no history."""
+    if _run_id is None:
+        return None
+    known = [_baseline[m].median for m in remaining if m in _baseline]
+    if not known:
+        return None
+    unknown = len(remaining) - len(known)
+    msg = f"ETA ~{_format_duration(sum(known))} for {len(remaining)} remaining module(s)"
+    if unknown:
+        msg += f" ({unknown} without history)"
+    return msg
+
+
+# ---------------------------------------------------------------------------
+# --history
+# ---------------------------------------------------------------------------
+
+def print_history(limit: int = 10) -> None:
+    """Prints the most recent runs and every slow-flagged module among them."""
+    if not os.path.isfile(host_path(HISTORY_DB)):
+        print("No run history yet.")
+        return
+    with _connect() as conn:
+        runs = conn.execute(
+            "SELECT id, started, finished, ok, argv FROM runs ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        slow = conn.execute(
+            "SELECT run_id, module, duration FROM modules WHERE slow = 1 AND run_id >= ? "
+            "ORDER BY run_id DESC, duration DESC",
+            (runs[-1][0] if runs else 0,),
+        ).fetchall()
+        details = []
+        for run_id, module, duration in slow:
+            previous = conn.execute(
+                "SELECT duration FROM modules WHERE module = ? AND ok = 1 AND run_id < ? "
+                "ORDER BY run_id DESC LIMIT ?",
+                (module, run_id, _MEDIAN_WINDOW),
+            ).fetchall()
+            commands = conn.execute(
+                "SELECT command, duration FROM commands WHERE run_id = ? AND module = ? "
+                "ORDER BY duration DESC LIMIT 3",
+                (run_id, module),
+            ).fetchall()
+            details.append((run_id, module, duration, previous, commands))
+    conn.close()
+
+    border = "=" * 70
+    print(f"\n{border}\n  RECENT RUNS\n{border}")
+    print(f"  {'RUN':>5}  {'STARTED':<16}  {'STATUS':<8} {'TIME':>8}  ARGS")
+    for run_id, started, finished, ok, argv in runs:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(started))
+        status = "running" if finished is None else ("ok" if ok else "failed")
+        took = _format_duration(finished - started) if finished else "-"
+        print(f"  {run_id:>5}  {when:<16}  {status:<8} {took:>8}  {argv}")
+
+    print(f"\n{border}\n  REGRESSIONS (> {SLOW_FACTOR}x median)\n{border}")
+    if not details:
+        print("  None.")
+    for run_id, module, duration, previous, commands in details:
+        median = statistics.median(r[0] for r in previous) if previous else 0.0
+        print(
+            f"  run {run_id}: {module} took {_format_duration(duration)} "
+            f"(median {_format_duration(median)})"
+        )
+        for command, took in commands:
+            short = command if len(command) <= 60 else command[:57] + "..."
+            print(f"      {_format_duration(took):>7}  {short}")
+    print(border)
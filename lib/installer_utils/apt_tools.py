@@ -1,18 +1,489 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import socket
 import subprocess
-from typing import List
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+from .. import history, offline
+from ..constants import (
+    APT_ARCHIVES_DIR, APT_CACHE_PORT, APT_DEFAULT_SECONDS_PER_PACKAGE, APT_DEFAULT_THROUGHPUT,
+    APT_LISTS_DIR, APT_LISTS_STAMP, APT_LISTS_TTL_SECONDS, APT_PROXY_PROBE_TIMEOUT,
+    APT_SOURCE_PATHS, DOCKER_DEPS, FIREWALL_PACKAGES, PREFETCH_WORKERS, ROOTLESS_DOCKER_DEPS,
+    STANDARD_PACKAGES, STATE_DIR, VM_PACKAGES,
+)
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path, which
+from ..platform_utils import is_linux
 
-def _is_package_installed(pkg: str) -> bool:
-    """Checks if a package is installed using dpkg -s."""
+# --apt-ttl; how old the lists may be before apt update runs regardless
+_lists_ttl: float = APT_LISTS_TTL_SECONDS
+# Sources fingerprint of the apt update this run already did (--force refreshes once)
+_updated_for: Optional[str] = None
+
+# --fast-dpkg, and whether an install has left triggers for finish_fast_dpkg()
+_fast_dpkg: bool = False
+_triggers_deferred: bool = False
+# dpkg without fsync (unsafe-io) and with triggers (man-db, ldconfig, ...)
+# left pending instead of run after every apt call
+_FAST_DPKG_OPTIONS: str = (
+    " -o Dpkg::Options::=--force-unsafe-io -o DPkg::NoTriggers=true"
+    " -o DPkg::ConfigurePending=false -o DPkg::TriggersPending=false"
+)
+
+# --apt-proxy, and whether it answered (probed once, on first use)
+_proxy: Optional[str] = None
+_proxy_reachable: Optional[bool] = None
+
+def set_lists_ttl(seconds: float) -> None:
+    global _lists_ttl
+    _lists_ttl = seconds
+
+def set_fast_dpkg(enabled: bool) -> None:
+    global _fast_dpkg
+    _fast_dpkg = enabled
+
+def _dpkg_command(command: str) -> str:
+    """*command* (an apt install/remove) with the --fast-dpkg settings, if enabled."""
+    global _triggers_deferred
+    if not _fast_dpkg:
+        return command
+    _triggers_deferred = True
+    # eatmydata (if installed) also drops the fsyncs dpkg makes despite unsafe-io
+    prefix = "eatmydata " if which("eatmydata") else ""
+    return f"{prefix}{command}{_FAST_DPKG_OPTIONS}"
+
+def finish_fast_dpkg(exec_obj: Executor) -> None:
+    """
+    Runs the triggers --fast-dpkg installs left pending (once, however many
+    installs deferred them), then a single sync to make everything durable.
+    """
+    global _triggers_deferred
+    if not _triggers_deferred:
+        return
+    _triggers_deferred = False
+    log.info("--fast-dpkg: running the deferred dpkg triggers and syncing...")
+    ok = exec_obj.run(
+        "dpkg --triggers-only --pending && dpkg --configure --pending",
+        force_sudo=True, check=False,
+    ).returncode == 0
+    exec_obj.run("sync", force_sudo=True, check=False)
+    if ok:
+        log.success("--fast-dpkg: deferred triggers processed.")
+    else:
+        log.error("--fast-dpkg: processing the deferred triggers failed; "
+                  "run 'dpkg --configure --pending' by hand.")
+
+def set_proxy(url: str) -> None:
+    """Routes apt's downloads through the caching proxy *url*; raises ValueError."""
+    global _proxy, _proxy_reachable
+    parts = urlsplit(url if "://" in url else f"http://{url}")
+    try:
+        port = parts.port or APT_CACHE_PORT
+    except ValueError as e:
+        raise ValueError(f"Invalid proxy URL '{url}': {e}") from e
+    if parts.scheme != "http" or not parts.hostname:
+        raise ValueError(f"Invalid proxy URL '{url}' (expected http://host[:port]).")
+    host = f"[{parts.hostname}]" if ":" in parts.hostname else parts.hostname
+    _proxy, _proxy_reachable = f"http://{host}:{port}", None
+
+def proxy_reachable(url: str) -> bool:
+    """True if something accepts TCP connections at the proxy *url*."""
+    parts = urlsplit(url)
     try:
-        # Use subprocess.run directly as we don't need Executor for a simple check
-        subprocess.run(
-            ['dpkg', '-s', pkg], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        with socket.create_connection(
+            (parts.hostname, parts.port or APT_CACHE_PORT), timeout=APT_PROXY_PROBE_TIMEOUT
+        ):
+            return True
+    except OSError:
+        return False
+
+def _proxy_options() -> str:
+    """
+    apt options sending plain-HTTP downloads through --apt-proxy, or "" if
+    it isn't set or doesn't answer.  Nothing is written to apt.conf.d, so a
+    cache host that goes away never breaks apt on this one; HTTPS sources
+    (Docker, VS Code) go direct, since a proxy can only tunnel those.
+    """
+    global _proxy_reachable
+    if _proxy is None or offline.active():
+        return ""
+    if _proxy_reachable is None:
+        _proxy_reachable = proxy_reachable(_proxy)
+        if _proxy_reachable:
+            log.info(f"Fetching packages through the APT cache at {_proxy}.")
+        else:
+            log.warning(f"APT cache {_proxy} is not reachable; downloading directly.")
+    return f" -o Acquire::http::Proxy={_proxy}" if _proxy_reachable else ""
+
+def _sources_fingerprint() -> str:
+    """sha256 over the names and contents of every apt source list and keyring."""
+    digest = hashlib.sha256()
+    for top in APT_SOURCE_PATHS:
+        mapped = host_path(top)
+        if os.path.isdir(mapped):
+            files = sorted(
+                os.path.join(dirpath, name)
+                for dirpath, _, names in os.walk(mapped) for name in names
+            )
+        else:
+            files = [mapped] if os.path.isfile(mapped) else []
+        for path in files:
+            digest.update(f"{top}{path[len(mapped):]}\0".encode())
+            try:
+                with open(path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            except OSError:
+                digest.update(b"unreadable")
+    return digest.hexdigest()
+
+def _lists_age(fingerprint: str) -> Optional[float]:
+    """
+    Seconds since the lists were last refreshed for these sources; None if
+    the sources or keyrings changed since (or we never recorded an update).
+    """
+    try:
+        with open(host_path(APT_LISTS_STAMP)) as f:
+            stamp = json.load(f)
+        if stamp.get("fingerprint") != fingerprint:
+            return None
+        refreshed = float(stamp["time"])
+        # Lists rewritten since (someone else's apt update) count as a refresh
+        lists_mtime = os.path.getmtime(host_path(APT_LISTS_DIR))
+        if lists_mtime > float(stamp.get("lists_mtime", 0)):
+            refreshed = max(refreshed, lists_mtime)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return time.time() - refreshed
+
+def _write_stamp(fingerprint: str, refreshed: Optional[float] = None) -> None:
+    """Records an update of the lists for *fingerprint* at *refreshed* (default now)."""
+    try:
+        os.makedirs(host_path(STATE_DIR), exist_ok=True)
+        with open(host_path(APT_LISTS_STAMP), "w") as f:
+            json.dump({
+                "fingerprint": fingerprint,
+                "time": time.time() if refreshed is None else refreshed,
+                "lists_mtime": os.path.getmtime(host_path(APT_LISTS_DIR)),
+            }, f)
+    except OSError as e:
+        log.debug(f"Could not record the apt update in {APT_LISTS_STAMP}: {e}")
+
+def apt_update(exec_obj: Executor) -> None:
+    """
+    Runs apt update unless the lists are current: no source list or keyring
+    changed since our last update and it is younger than the TTL.  --force
+    ignores the TTL (once per run); an offline bundle ships its own lists.
+    """
+    global _updated_for
+    if offline.active():
+        log.info("Using the offline bundle's APT lists and packages.")
+        return
+
+    fingerprint = _sources_fingerprint()
+    if _updated_for == fingerprint:
+        log.info("APT lists already refreshed this run (sources unchanged).")
+        return
+    age = _lists_age(fingerprint)
+    if not exec_obj.force and age is not None and age < _lists_ttl:
+        log.info(
+            f"APT lists are current (refreshed {int(age // 60)} min ago, sources unchanged); "
+            "skipping apt update."
         )
-        return True
-    except subprocess.CalledProcessError:
+        return
+
+    log.info("Updating APT cache...")
+    # Use -qq for quiet update
+    exec_obj.run(f"apt update -y -qq{_proxy_options()}", force_sudo=True)
+    if not exec_obj.dry_run:
+        _updated_for = fingerprint
+        _write_stamp(fingerprint)
+
+# One line of `apt-get --print-uris`: 'URI' archive-file-name size Hash-Type:hex
+_PRINT_URI = re.compile(r"^'(?P<uri>[^']+)' (?P<name>\S+) (?P<size>\d+) (?P<hash>\S+:\S+)$")
+# apt's hash field names -> hashlib names
+_HASH_TYPES: Dict[str, str] = {
+    "SHA512": "sha512", "SHA256": "sha256", "SHA1": "sha1", "MD5Sum": "md5",
+}
+_DEB_TIMEOUT: int = 120
+_DEB_CHUNK: int = 1 << 20
+
+@dataclass
+class DebDownload:
+    uri: str
+    name: str  # file name under APT_ARCHIVES_DIR, as apt expects it
+    size: int
+    algorithm: str
+    digest: str
+
+def _parse_uris(output: str) -> List[DebDownload]:
+    """The .debs listed in `apt-get --print-uris` output."""
+    downloads: List[DebDownload] = []
+    for line in output.splitlines():
+        match = _PRINT_URI.match(line.strip())
+        if not match:
+            continue
+        kind, _, digest = match["hash"].partition(":")
+        if kind in _HASH_TYPES:
+            downloads.append(DebDownload(
+                match["uri"], match["name"], int(match["size"]), _HASH_TYPES[kind], digest.lower()
+            ))
+    return downloads
+
+def _deb_cached(path: str, deb: DebDownload) -> bool:
+    if not os.path.isfile(path) or os.path.getsize(path) != deb.size:
         return False
+    digest = hashlib.new(deb.algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_DEB_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest() == deb.digest
+
+def _download_deb(deb: DebDownload, proxy: Optional[str]) -> int:
+    """Downloads *deb* into apt's archive cache, verifying size and hash; returns bytes fetched."""
+    archives = host_path(APT_ARCHIVES_DIR)
+    handlers = [urllib.request.ProxyHandler({"http": proxy} if proxy else {})]
+    opener = urllib.request.build_opener(*handlers)
+    request = urllib.request.Request(deb.uri, headers={"User-Agent": "machine-setup"})  # noqa: S310
+    digest = hashlib.new(deb.algorithm)
+    fetched = 0
+    partial_dir = os.path.join(archives, "partial")
+    os.makedirs(partial_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=partial_dir, prefix=f".{deb.name}-", delete=False) as tmp:
+        tmp_path = tmp.name
+        try:
+            with opener.open(request, timeout=_DEB_TIMEOUT) as resp:  # nosec B310
+                for chunk in iter(lambda: resp.read(_DEB_CHUNK), b""):
+                    tmp.write(chunk)
+                    digest.update(chunk)
+                    fetched += len(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    if fetched != deb.size or digest.hexdigest() != deb.digest:
+        os.unlink(tmp_path)
+        raise ValueError(f"{deb.name}: size or {deb.algorithm} mismatch")
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, os.path.join(archives, deb.name))
+    return fetched
+
+# `apt-get -s` actions: "Inst pkg (version ...)", "Remv pkg [version]"
+_SIM_ACTION = re.compile(r"^(?P<action>Inst|Remv) (?P<package>\S+)")
+# apt-get's summary (LC_ALL=C), in SI units
+_SIZE_DELTA = re.compile(
+    r"^After this operation, (?P<size>[\d.,]+) (?P<unit>[kMGT]?B) "
+    r"(?:of additional )?disk space will be (?P<verb>used|freed)"
+)
+_SIZE_UNITS: Dict[str, int] = {
+    "B": 1, "kB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+}
+_UNKNOWN_PACKAGE = re.compile(r"^E: Unable to locate package (?P<package>\S+)", re.MULTILINE)
+# (bytes/s, s/package) from the run history, read once per run; see _rates()
+_measured_rates: Optional[Tuple[float, float]] = None
+
+@dataclass
+class AptPlan:
+    """What an apt transaction would do, from apt-get's own simulation."""
+    install: List[str] = field(default_factory=list)  # with dependencies
+    remove: List[str] = field(default_factory=list)
+    unknown: List[str] = field(default_factory=list)  # not in any apt list (yet)
+    downloads: List[DebDownload] = field(default_factory=list)
+    size_delta: int = 0  # bytes of disk space used; negative if freed
+    seconds: float = 0.0  # estimated download + install time
+    simulated: bool = False  # False if apt-get couldn't resolve the transaction
+
+    @property
+    def download_bytes(self) -> int:
+        return sum(deb.size for deb in self.downloads)
+
+    def summary(self) -> str:
+        """'12 to install, 0 to remove, 34.5 MiB to download, +120.3 MiB on disk, ~41s'"""
+        sign = "+" if self.size_delta >= 0 else "-"
+        return (
+            f"{len(self.install)} to install, {len(self.remove)} to remove, "
+            f"{self.download_bytes / 1024 / 1024:.1f} MiB to download, "
+            f"{sign}{abs(self.size_delta) / 1024 / 1024:.1f} MiB on disk, ~{self.seconds:.0f}s"
+            + (f" (unknown: {', '.join(self.unknown)})" if self.unknown else "")
+        )
+
+    def to_dict(self) -> Dict[str, object]:
+        plan = asdict(self)
+        plan["downloads"] = len(self.downloads)
+        plan["download_bytes"] = self.download_bytes
+        plan["seconds"] = round(self.seconds, 1)
+        return plan
+
+def _rates() -> Tuple[float, float]:
+    """
+    Mirror throughput (bytes/s) and install time per package, measured by
+    the last runs' prefetches and installs; the defaults until there are any.
+    """
+    global _measured_rates
+    if _measured_rates is None:
+        totals = history.recent_totals([
+            "apt_download_bytes", "apt_download_ms", "apt_install_packages", "apt_install_ms",
+        ])
+        throughput, per_package = APT_DEFAULT_THROUGHPUT, APT_DEFAULT_SECONDS_PER_PACKAGE
+        if totals.get("apt_download_bytes") and totals.get("apt_download_ms"):
+            throughput = totals["apt_download_bytes"] / (totals["apt_download_ms"] / 1000)
+        if totals.get("apt_install_packages") and totals.get("apt_install_ms"):
+            per_package = totals["apt_install_ms"] / 1000 / totals["apt_install_packages"]
+        _measured_rates = (throughput, per_package)
+    return _measured_rates
+
+def _size_delta(output: str) -> int:
+    for line in output.splitlines():
+        match = _SIZE_DELTA.match(line.strip())
+        if match:
+            size = float(match["size"].replace(",", "")) * _SIZE_UNITS[match["unit"]]
+            return int(size) if match["verb"] == "used" else -int(size)
+    return 0
+
+def plan_transaction(
+    exec_obj: Executor, packages: List[str], action: str = "install"
+) -> AptPlan:
+    """
+    Simulates ``apt-get <action> <packages>`` (``apt-get -s``, plus
+    ``--print-uris`` for installs) without touching the host: what would be
+    installed and removed, what would be downloaded, the disk space delta
+    and an estimated duration at this host's measured mirror throughput and
+    install rate.  Packages apt doesn't know yet (from a repo a module adds
+    itself) are left out of the simulation and listed in .unknown.
+    """
+    plan = AptPlan()
+    if exec_obj.dry_run or not is_linux:
+        return plan
+    env = {"LC_ALL": "C"}
+
+    def simulate(names: List[str]) -> "subprocess.CompletedProcess[str]":
+        return exec_obj.run(
+            " ".join(["apt-get", "-s", action] + names), env=env, check=False, run_quiet=True
+        )
+
+    sim = simulate(packages)
+    if sim.returncode != 0 and action == "install":
+        plan.unknown = [m["package"] for m in _UNKNOWN_PACKAGE.finditer(sim.stderr or "")]
+        known = [pkg for pkg in packages if pkg not in plan.unknown]
+        if plan.unknown and known:
+            packages = known
+            sim = simulate(packages)
+    if sim.returncode != 0:
+        log.debug(f"apt-get -s {action} failed: {(sim.stderr or '').strip()}")
+        return plan
+    plan.simulated = True
+    for line in (sim.stdout or "").splitlines():
+        match = _SIM_ACTION.match(line)
+        if match:
+            (plan.install if match["action"] == "Inst" else plan.remove).append(match["package"])
+    output = sim.stdout or ""
+    if action == "install" and plan.install:
+        uris = exec_obj.run(
+            f"apt-get install -y -q --print-uris{_proxy_options()} {' '.join(packages)}",
+            env=env, check=False, run_quiet=True,
+        )
+        plan.downloads = _parse_uris(uris.stdout or "")
+        output += "\n" + (uris.stdout or "")
+    plan.size_delta = _size_delta(output)
+    throughput, per_package = _rates()
+    plan.seconds = plan.download_bytes / throughput + len(plan.install) * per_package
+    return plan
+
+def prefetch_debs(exec_obj: Executor, downloads: List[DebDownload]) -> None:
+    """
+    Downloads *downloads* (a transaction's .debs, see plan_transaction())
+    concurrently into apt's archive cache, so the apt install that follows
+    only unpacks: apt itself fetches with little parallelism and only
+    unpacks after the last download.  Every file is checked against the
+    size and hash apt expects; anything that fails is left for apt to fetch.
+    """
+    if exec_obj.dry_run or offline.active() or not downloads:
+        return
+    archives = host_path(APT_ARCHIVES_DIR)
+    downloads = [
+        deb for deb in downloads if not _deb_cached(os.path.join(archives, deb.name), deb)
+    ]
+    if not downloads:
+        return
+    proxy = _proxy if _proxy_options() else None
+
+    def fetch(deb: DebDownload) -> int:
+        try:
+            return _download_deb(deb, proxy if deb.uri.startswith("http://") else None)
+        except Exception as e:
+            log.warning(f"Could not prefetch {deb.name} ({e}); apt will download it.")
+            return 0
+
+    total = sum(deb.size for deb in downloads)
+    log.info(
+        f"Downloading {len(downloads)} .deb file(s) ({total // 1024} KiB) "
+        f"with {PREFETCH_WORKERS} workers..."
+    )
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as pool:
+        fetched = sum(pool.map(fetch, downloads))
+    elapsed = time.monotonic() - start
+    history.count("downloaded_bytes", fetched)
+    if fetched:
+        # Mirror throughput for plan_transaction()'s estimates
+        history.count("apt_download_bytes", fetched)
+        history.count("apt_download_ms", int(elapsed * 1000))
+    log.info(f"Downloaded {fetched // 1024} KiB of packages in {elapsed:.1f}s.")
+
+# Distro packages of the planned modules (module key -> packages), merged
+# into the first apt_install of the run; see queue_planned_packages().
+_queue: Dict[str, List[str]] = {}
+# What that merged install covered (so dry runs and stubs don't install it twice)
+_merged: Set[str] = set()
+
+def planned_packages(
+    exec_obj: Executor, planned: List[str], args: argparse.Namespace
+) -> Dict[str, List[str]]:
+    """The distro packages each of the *planned* modules will install (the missing ones)."""
+    if not is_linux:
+        return {}
+    facts = exec_obj.facts
+    wanted: Dict[str, List[str]] = {
+        "packages": STANDARD_PACKAGES,
+        "firewall": FIREWALL_PACKAGES,
+        "docker": (
+            ([] if which("docker") else DOCKER_DEPS)
+            + ([] if args.do_docker_rootful else ROOTLESS_DOCKER_DEPS)
+        ),
+        "vm": VM_PACKAGES if facts.is_vm or args.do_vm_force else [],
+        "desktop": [] if which("gnome-tweaks") else ["gnome-tweaks"],
+    }
+    result: Dict[str, List[str]] = {}
+    for module, packages in wanted.items():
+        missing = [pkg for pkg in packages if not facts.is_installed(pkg)]
+        if module in planned and missing:
+            result[module] = missing
+    return result
+
+def queue_planned_packages(
+    exec_obj: Executor, planned: List[str], args: argparse.Namespace
+) -> None:
+    """
+    Queues the distro packages the *planned* modules will install, so the
+    first apt_install of the run (whichever module gets there first) installs
+    all of them in one transaction: one dependency resolution and one dpkg
+    trigger pass instead of one per module.  Packages from repos a module
+    adds itself (Docker CE, VS Code) are still installed by that module.
+    """
+    for module, missing in planned_packages(exec_obj, planned, args).items():
+        _queue.setdefault(module, []).extend(missing)
+
+def _take_queue() -> Dict[str, List[str]]:
+    queued = dict(_queue)
+    _queue.clear()
+    return queued
 
 def apt_install(exec_obj: Executor, packages: List[str]) -> None:
     """Installs a list of packages in a single command after checking for existing installations."""
@@ -20,12 +491,21 @@ def apt_install(exec_obj: Executor, packages: List[str]) -> None:
         log.warning("No packages specified for installation")
         return
 
+    # 0. The first install of the run also takes every planned module's packages
+    requested = packages
+    queued = _take_queue()
+    if queued:
+        log.info(
+            f"Installing the queued packages of {', '.join(queued)} in the same transaction."
+        )
+        packages = list(dict.fromkeys(packages + [p for q in queued.values() for p in q]))
+
     missing_packages: List[str] = []
     already_installed_count = 0
 
     # 1. Determine which packages are missing
     for pkg in packages:
-        if _is_package_installed(pkg):
+        if exec_obj.facts.is_installed(pkg) or pkg in _merged:
             log.info(f"{pkg} already installed (skipped)")
             already_installed_count += 1
         else:
@@ -35,57 +515,161 @@ def apt_install(exec_obj: Executor, packages: List[str]) -> None:
         log.success(f"All packages ({already_installed_count}) were already installed.")
         return
 
-    # 2. Update apt cache
-    log.info("Updating APT cache...")
-    # Use -qq for quiet update
-    exec_obj.run("apt update -y -qq", force_sudo=True)
-    
-    # 3. Install all missing packages in one go
-    packages_to_install_str = " ".join(missing_packages)
-    
-    log.info(f"Installing {len(missing_packages)} package(s): {packages_to_install_str}")
-    
-    install_cmd = f"apt install -y {packages_to_install_str}"
-    
-    if exec_obj.quiet:
-        install_cmd += " -qq"
+    # 2. Update apt cache (skipped if the lists are still current)
+    apt_update(exec_obj)
+
+    # 3. Simulate the transaction: what it pulls in, downloads and costs
+    plan = plan_transaction(exec_obj, missing_packages)
+    if plan.simulated:
+        log.info(f"APT plan: {plan.summary()}")
     
-    exec_obj.run(install_cmd, force_sudo=True)
+    # 4. Download the .debs concurrently, then install all missing packages in one go
+    prefetch_debs(exec_obj, plan.downloads)
+
+    def install(names: List[str]) -> None:
+        log.info(f"Installing {len(names)} package(s): {' '.join(names)}")
+        install_cmd = _dpkg_command(f"apt install -y{_proxy_options()} {' '.join(names)}")
+        if exec_obj.quiet:
+            install_cmd += " -qq"
+        exec_obj.run(install_cmd, force_sudo=True)
+
+    start = time.monotonic()
+    installed = len(plan.install) or len(missing_packages)
+    try:
+        install(missing_packages)
+    except subprocess.CalledProcessError:
+        if not queued:
+            raise
+        # One bad package of another module mustn't fail this one: install only
+        # ours and leave the queued modules to install (and fail on) their own
+        missing_packages = [pkg for pkg in missing_packages if pkg in requested]
+        others = [module for module in queued if module != history.current_module()]
+        log.warning(
+            "The merged install failed; installing only this module's packages"
+            + (f" ({', '.join(others)} will install their own)." if others else ".")
+        )
+        queued = {}
+        exec_obj.facts.refresh("packages")
+        if not missing_packages:
+            return
+        start = time.monotonic()
+        installed = len(missing_packages)
+        install(missing_packages)
+    # Install rate for plan_transaction()'s estimates
+    history.count("apt_install_packages", installed)
+    history.count("apt_install_ms", int((time.monotonic() - start) * 1000))
+    exec_obj.facts.refresh("packages")
+    if queued:
+        _merged.update(missing_packages)
     
-    log.success(f"Successfully installed packages: {packages_to_install_str}")
+    log.success(f"Successfully installed packages: {' '.join(missing_packages)}")
 
 def apt_autoremove(exec_obj: Executor) -> None:
-    """Runs apt autoremove."""
+    """Runs apt autoremove, unless a simulation shows there is nothing to remove."""
     log.info("Running apt autoremove...")
-    autoremove_cmd = "apt autoremove -y"
+    plan = plan_transaction(exec_obj, [], "autoremove")
+    if plan.simulated and not plan.remove:
+        log.success("Nothing to autoremove (skipped).")
+        return
+    autoremove_cmd = _dpkg_command("apt autoremove -y")
     if exec_obj.quiet:
         autoremove_cmd += " -qq"
     exec_obj.run(autoremove_cmd, force_sudo=True)
+    exec_obj.facts.refresh("packages")
+
+# One-line source options -> deb822 fields (sources.list(5)); the rest are
+# the option name capitalised, e.g. allow-insecure -> Allow-Insecure.
+_DEB822_FIELDS: Dict[str, str] = {
+    "arch": "Architectures",
+    "lang": "Languages",
+    "target": "Targets",
+    "pdiffs": "PDiffs",
+    "by-hash": "By-Hash",
+    "inrelease-path": "InRelease-Path",
+}
+
+def deb822_stanza(repo_line: str) -> str:
+    """
+    The deb822 form of a one-line source, e.g.
+    ``deb [arch=amd64 signed-by=/k.gpg] https://host/repo stable main``.
+    """
+    options: List[str] = []
+    line = repo_line.strip()
+    if "[" in line:
+        head, _, rest = line.partition("[")
+        opts, _, tail = rest.partition("]")
+        options = opts.split()
+        line = f"{head} {tail}"
+    words = line.split()
+    if len(words) < 3:
+        raise ValueError(f"Not an APT source line: '{repo_line}'")
+    fields = [
+        ("Types", words[0]),
+        ("URIs", words[1]),
+        ("Suites", words[2]),
+    ]
+    if words[3:]:
+        fields.append(("Components", " ".join(words[3:])))
+    for option in options:
+        key, _, value = option.partition("=")
+        name = _DEB822_FIELDS.get(key) or "-".join(p.capitalize() for p in key.split("-"))
+        fields.append((name, value.replace(",", " ")))
+    return "".join(f"{name}: {value}\n" for name, value in fields)
+
+def _refresh_source(exec_obj: Executor, sources_file: str, before: str) -> None:
+    """
+    Fetches the indexes of *sources_file* alone, leaving every other list as
+    it is.  If those were current (for fingerprint *before*), they stay
+    current: the stamp moves to the new fingerprint but keeps their age.
+    """
+    global _updated_for
+    if offline.active():
+        return
+    log.info(f"Updating the APT lists of {sources_file} only...")
+    exec_obj.run(
+        f"apt-get update -qq{_proxy_options()}"
+        f" -o Dir::Etc::sourcelist={sources_file}"
+        " -o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0",
+        force_sudo=True,
+    )
+    if exec_obj.dry_run:
+        return
+    fingerprint = _sources_fingerprint()
+    if _updated_for == before:
+        _updated_for = fingerprint
+    age = _lists_age(before)
+    if age is not None:
+        _write_stamp(fingerprint, refreshed=time.time() - age)
 
-def ensure_apt_repo(exec_obj: Executor, list_file: str, repo_line: str) -> None:
-    """Adds an apt repository line to a file if not already present, and deduplicates."""
+def ensure_apt_repo(exec_obj: Executor, sources_file: str, repo_line: str) -> None:
+    """
+    Writes the one-line source *repo_line* to *sources_file* (a deb822
+    ``.sources`` file we own) and refreshes just that source's lists.  A
+    leftover ``.list`` of the same name (older releases wrote those) is
+    removed so apt doesn't see the source twice.
+    """
+    content = deb822_stanza(repo_line)
+    legacy_list = os.path.splitext(sources_file)[0] + ".list"
+    has_legacy = os.path.isfile(host_path(legacy_list))
 
-    existing_lines = []
     try:
-        with open(list_file, 'r') as f:
-            existing_lines = [line.strip() for line in f if line.strip()]
+        with open(host_path(sources_file)) as f:
+            current: Optional[str] = f.read()
     except FileNotFoundError:
-        pass
+        current = None
 
-    if repo_line in existing_lines:
-        log.success(f"APT repository already present in {list_file}")
+    if current == content and not has_legacy:
+        log.success(f"APT repository already present in {sources_file}")
         return
 
-    all_lines = existing_lines + [repo_line]
-    
-    # Deduplicate while preserving order (using dict keys)
-    unique_lines = list(dict.fromkeys(all_lines))
-    content = "\n".join(unique_lines) + "\n"
-    
-    log.info(f"Adding/Deduplicating APT repository in: {list_file}")
+    log.info(f"Writing APT repository to: {sources_file}")
+    if exec_obj.dry_run:
+        log.info(f"[DRY-RUN] Would write {sources_file}:\n{content}")
+        return
 
-    # Use tee to write the content with privilege
-    cmd = f"echo \"{content}\" | tee \"{list_file}\" > /dev/null"
-    exec_obj.run(cmd, force_sudo=True)
-    
-    exec_obj.run("apt update -qq", force_sudo=True)
\ No newline at end of file
+    before = _sources_fingerprint()
+    exec_obj.write_file(sources_file, content, 0o644)
+    if has_legacy:
+        log.info(f"Removing {legacy_list} (replaced by {sources_file}).")
+        os.remove(host_path(legacy_list))
+    _refresh_source(exec_obj, sources_file, before)
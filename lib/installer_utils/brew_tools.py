@@ -16,11 +16,11 @@ Design notes
 """
 
 import os
-import shutil
 from typing import Optional
 
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path, which
 
 # Ordered by likelihood: Apple Silicon first, then Intel, then Linuxbrew.
 _BREW_CANDIDATE_PATHS: list[str] = [
@@ -35,11 +35,12 @@ def find_brew() -> Optional[str]:
     Return the absolute path to the ``brew`` binary, or ``None`` if Homebrew
     is not installed.  Checks ``PATH`` first, then known install locations.
     """
-    in_path = shutil.which("brew")
+    in_path = which("brew")
     if in_path:
         return in_path
     for candidate in _BREW_CANDIDATE_PATHS:
-        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+        mapped = host_path(candidate)
+        if os.path.isfile(mapped) and os.access(mapped, os.X_OK):
             return candidate
     return None
 
@@ -1,11 +1,13 @@
 import os
 import subprocess
-from typing import Optional
+from typing import Callable, Optional
+from .. import gates, history, offline
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path
 from ..constants import GIT_BIN_PATH
+from ..prefetch import git_mirror
 from .repo_utils import _display_key_and_url_for_repo
-import time # For retry sleep
 
 def clone_or_update_repo(exec_obj: Executor,
                          repo_url: str,
@@ -18,7 +20,7 @@ def clone_or_update_repo(exec_obj: Executor,
     Clones or updates a Git repository, handling SSH deploy keys if specified.
     
     NOTE: This is the low-level function that performs the actual shell execution.
-    For private repos that require interactive key setup/retry, use 
+    For private repos whose deploy key may still need authorising, use
     clone_or_update_private_repo_with_key_check().
     
     :param exec_obj: The Executor instance.
@@ -43,7 +45,7 @@ def clone_or_update_repo(exec_obj: Executor,
         # network path (e.g. Tailscale half-up) or an unauthorised key hangs
         # this clone/fetch indefinitely with zero feedback, since output is
         # captured rather than streamed. Bounding it lets the existing
-        # retry/prompt logic in clone_or_update_private_repo_with_key_check
+        # deploy-key gate in clone_or_update_private_repo_with_key_check
         # actually kick in instead of the process just sitting there.
         # FIX: Use double quotes for the path to prevent premature string termination in bash -c
         ssh_command = (
@@ -54,8 +56,11 @@ def clone_or_update_repo(exec_obj: Executor,
         env_prefix = f"GIT_SSH_COMMAND='{ssh_command}' "
         log.debug(f"Using GIT_SSH_COMMAND prefix: {env_prefix}")
     
+    # Prefetched bare mirror (public repos only); lets clone/fetch run from local disk.
+    mirror = git_mirror(repo_url)
+
     # 3. Check if repo exists and handle update/integrity
-    if os.path.isdir(os.path.join(dest_dir, ".git")):
+    if os.path.isdir(host_path(os.path.join(dest_dir, ".git"))):
         try:
             # INTEGRITY CHECK: Use the resolved path constant (GIT_BIN_PATH)
             exec_obj.run(
@@ -66,7 +71,14 @@ def clone_or_update_repo(exec_obj: Executor,
             
             # FETCH: Prepend the env_prefix to the command string
             fetch_cmd = f"{env_prefix} {GIT_BIN_PATH} -C '{dest_dir}' fetch --all --prune"
+            if mirror:
+                # Mirror is root-owned; safe.directory avoids git's dubious-ownership refusal.
+                fetch_cmd = (
+                    f"{GIT_BIN_PATH} -c safe.directory='{mirror}' -C '{dest_dir}' "
+                    f"fetch --prune '{mirror}' '+refs/heads/*:refs/remotes/origin/*'"
+                )
             exec_obj.run(fetch_cmd, user=user)
+            history.count("repos_updated")
             log.success(f"Repository updated: {dest_dir}")
             
         except Exception:
@@ -77,26 +89,76 @@ def clone_or_update_repo(exec_obj: Executor,
             exec_obj.run(f"rm -rf {dest_dir}", force_sudo=True)
         
     # 4. Clone if missing or just removed
-    if not os.path.isdir(os.path.join(dest_dir, ".git")):
+    if not os.path.isdir(host_path(os.path.join(dest_dir, ".git"))):
         log.info(f"Cloning {repo_url} -> {dest_dir}")
         
         # Assemble the raw clone command string
         clone_options = ""
         if extra_git_flags:
             clone_options = extra_git_flags
+        git_bin = GIT_BIN_PATH
+        clone_source = repo_url
+        if mirror:
+            git_bin = f"{GIT_BIN_PATH} -c safe.directory='{mirror}'"
+            if offline.active():
+                # No network: clone the bundled mirror itself, then point origin upstream
+                clone_source = mirror
+            else:
+                clone_options = f"--reference-if-able '{mirror}' --dissociate {clone_options}"
         
         # FINAL COMMAND STRING: GIT_SSH_COMMAND='...' /path/to/git clone ...
-        final_cmd = f"{env_prefix} {GIT_BIN_PATH} clone {clone_options} '{repo_url}' '{dest_dir}'"
+        final_cmd = f"{env_prefix} {git_bin} clone {clone_options} '{clone_source}' '{dest_dir}'"
         
         exec_obj.run(final_cmd, user=user)
+        if clone_source != repo_url:
+            exec_obj.run(
+                [GIT_BIN_PATH, "-C", dest_dir, "remote", "set-url", "origin", repo_url], user=user
+            )
+        history.count("repos_updated")
         log.success(f"Repository cloned: {dest_dir}")
 
     # Apply group ownership to the repo dir only (not the parent — avoids clobbering .ssh etc.)
-    if group and os.path.isdir(dest_dir):
+    if group and os.path.isdir(host_path(dest_dir)):
         exec_obj.run(f"chgrp -R {group} {dest_dir} || true", force_sudo=True)
         exec_obj.run(f"chmod -R g+w {dest_dir}", force_sudo=True)
         exec_obj.run(f"chmod -R -s {dest_dir} || true", force_sudo=True)
 
+def _is_ssh_error(e: subprocess.CalledProcessError) -> bool:
+    # Treat any git/SSH failure (auth or network) as potentially fixable by adding the key.
+    # Timeout ("Connection timed out") and auth ("Permission denied") both exit 128.
+    return e.returncode == 128 and any(
+        marker in (e.stderr or "")
+        for marker in [
+            "Permission denied",
+            "Connection timed out",
+            "connect to host",
+            "Host is unreachable",
+            "No route to host",
+            "Network is unreachable",
+        ]
+    )
+
+
+def _deploy_key_probe_command(repo_url: str, ssh_key_path: str) -> str:
+    """A cheap check (git ls-remote over the deploy key) that the key is authorised."""
+    ssh_command = (
+        f"ssh -i \"{ssh_key_path}\" -o IdentitiesOnly=yes "
+        "-o BatchMode=yes -o ConnectTimeout=10"
+    )
+    return f"GIT_SSH_COMMAND='{ssh_command}' {GIT_BIN_PATH} ls-remote '{repo_url}' HEAD"
+
+
+def _deploy_key_probe(
+    exec_obj: Executor, repo_url: str, ssh_key_path: str, user: str
+) -> Callable[[], bool]:
+    cmd = _deploy_key_probe_command(repo_url, ssh_key_path)
+
+    def probe() -> bool:
+        return exec_obj.run(cmd, user=user, check=False, run_quiet=True).returncode == 0
+
+    return probe
+
+
 def clone_or_update_private_repo_with_key_check(exec_obj: Executor,
                                                repo_url: str,
                                                dest_dir: str,
@@ -104,74 +166,63 @@ def clone_or_update_private_repo_with_key_check(exec_obj: Executor,
                                                repo_name: str,
                                                extra_git_flags: Optional[str] = "",
                                                user: str = "root",
-                                               group: Optional[str] = None) -> None:
+                                               group: Optional[str] = None,
+                                               then: Optional[Callable[[], None]] = None,
+                                               instructions: Optional[Callable[[], None]] = None
+                                               ) -> bool:
     """
-    Attempts to clone a private repo. If it fails due to SSH permission,
-    it prompts the user to add the deploy key and retries the clone once.
+    Clones/updates a private repo, then runs *then* (the steps that depend on it).
+
+    If the clone fails because the deploy key isn't authorised yet, it doesn't
+    block: a gate is opened (see lib/gates.py) that prints *instructions*
+    (default: the key and deploy URL) at the next checkpoint, polls the key in
+    the background, and re-runs the clone plus *then* once it works.
+
+    Returns True if the work ran now, False if it was deferred behind a gate.
+    With --force there is no gate; the clone error is raised as before.
     """
-    
-    MAX_CLONE_ATTEMPTS = 2 
-    clone_succeeded = False
-    
-    for attempt in range(MAX_CLONE_ATTEMPTS):
-        try:
-            log.info(
-                f"Attempting to clone/update repository "
-                f"(Attempt {attempt + 1}/{MAX_CLONE_ATTEMPTS})..."
-            )
-            clone_or_update_repo(
-                exec_obj,
-                repo_url,
-                dest_dir,
-                ssh_key_path=ssh_key_path,
-                extra_git_flags=extra_git_flags,
-                user=user,
-                group=group,
-            )
-            clone_succeeded = True
-            break # Exit loop on success
-            
-        except subprocess.CalledProcessError as e:
-            # Treat any git/SSH failure (auth or network) as potentially fixable by adding the key.
-            # Timeout ("Connection timed out") and auth ("Permission denied") both exit 128.
-            is_ssh_error = e.returncode == 128 and any(
-                marker in (e.stderr or "")
-                for marker in [
-                    "Permission denied",
-                    "Connection timed out",
-                    "connect to host",
-                    "Host is unreachable",
-                    "No route to host",
-                    "Network is unreachable",
-                ]
-            )
+    def clone() -> None:
+        clone_or_update_repo(
+            exec_obj,
+            repo_url,
+            dest_dir,
+            ssh_key_path=ssh_key_path,
+            extra_git_flags=extra_git_flags,
+            user=user,
+            group=group,
+        )
 
-            if attempt == 0 and is_ssh_error:
-                log.warning("Initial clone attempt failed due to possible missing deploy key.")
-                
-                # --- INTERACTIVE PROMPT TRIGGERED ONLY ON FIRST FAILURE ---
-                if not exec_obj.force: # Skip if --force is used
-                    ssh_dir = os.path.dirname(ssh_key_path)
-                    _display_key_and_url_for_repo(
-                        exec_obj, 
-                        ssh_dir, 
-                        repo_name, 
-                        repo_url
-                    )
-                else:
-                    log.warning("Skipping interactive deploy key prompt due to --force flag.")
-                    
-            elif attempt == MAX_CLONE_ATTEMPTS - 1:
-                log.error("Final clone attempt failed. Abandoning repository setup.")
-                raise # Re-raise the exception to stop the script
-            
-            else:
-                # Wait before the final retry after the user has been prompted
-                log.info("Waiting 5 seconds before re-trying clone after user input...")
-                time.sleep(5)
-                
-    if not clone_succeeded:
-        raise RuntimeError(f"Failed to clone repository {repo_name} after multiple attempts.")
+    def work() -> None:
+        clone()
+        if then is not None:
+            then()
+
+    log.info(f"Attempting to clone/update repository {repo_name}...")
+    try:
+        clone()
+    except subprocess.CalledProcessError as e:
+        if not _is_ssh_error(e):
+            raise
+        if exec_obj.force:
+            log.error("Clone failed (--force: no deploy key gate). Abandoning repository setup.")
+            raise
+
+        log.warning(f"Clone of {repo_name} failed due to possible missing deploy key.")
+        ssh_dir = os.path.dirname(ssh_key_path)
+        gates.open_gate(
+            repo_name,
+            instructions or (
+                lambda: _display_key_and_url_for_repo(exec_obj, ssh_dir, repo_name, repo_url)
+            ),
+            _deploy_key_probe(exec_obj, repo_url, ssh_key_path, user),
+            work,
+            probe_command=(_deploy_key_probe_command(repo_url, ssh_key_path), user),
+        )
+        return False
+
+    if then is not None:
+        then()
+    return True
 
 
 def _configure_repo_ssh_key(exec_obj: Executor, user: str, repo_dir: str, key_path: str) -> None:
@@ -0,0 +1,35 @@
+import socket
+
+from ..constants import APT_CACHE_PACKAGE, APT_CACHE_PORT
+from ..executor import Executor
+from ..logger import log
+from .apt_tools import apt_install, proxy_reachable
+
+
+def setup_apt_cache(exec_obj: Executor) -> None:
+    """
+    Turns this host into the APT cache for the others: apt-cacher-ng on
+    APT_CACHE_PORT, caching every .deb and index fetched through it.  Other
+    hosts use it with --apt-proxy (only while it answers).
+    """
+    log.info("Setting up the APT cache (apt-cacher-ng)...")
+
+    # Answer the install-time question non-interactively: no CONNECT tunnels
+    # (HTTPS repos can't be cached anyway, and clients fetch those directly)
+    exec_obj.run(
+        f"echo '{APT_CACHE_PACKAGE} {APT_CACHE_PACKAGE}/tunnelenable boolean false' "
+        "| debconf-set-selections",
+        force_sudo=True,
+    )
+    apt_install(exec_obj, [APT_CACHE_PACKAGE])
+    exec_obj.run(f"systemctl enable --now {APT_CACHE_PACKAGE}", force_sudo=True)
+
+    local = f"http://127.0.0.1:{APT_CACHE_PORT}"
+    if exec_obj.dry_run or proxy_reachable(local):
+        log.success(
+            f"APT cache is listening on port {APT_CACHE_PORT}; on other hosts use "
+            f"--apt-proxy http://{socket.gethostname()}:{APT_CACHE_PORT}"
+        )
+    else:
+        log.warning(f"{APT_CACHE_PACKAGE} is not answering on {local} yet; "
+                    f"check 'systemctl status {APT_CACHE_PACKAGE}'.")
@@ -1,33 +1,63 @@
-import shutil
 import platform
 import os
 import time
-from typing import List, Dict
+from typing import Dict, List, Optional
 import subprocess
 
+from .. import dpkg_status
 from ..executor import Executor
+from ..facts import Facts
 from ..logger import log
-from ..constants import DOCKER_DEPS, DOCKER_PKGS, ROOTLESS_DOCKER_DEPS
+from ..paths import host_path, which
+from ..constants import DOCKER_DEPS, DOCKER_GPG_URL, DOCKER_PKGS, ROOTLESS_DOCKER_DEPS
+from ..prefetch import fetch_command
 from .apt_tools import apt_install, ensure_apt_repo
 from .user_mgmt import add_user_to_group, require_user
 
-def _get_os_release() -> Dict[str, str]:
-    """
-    Parses /etc/os-release into a dictionary natively.
-    Replaces brittle shell 'grep/cut/tr' with robust Python string matching.
-    """
-    info = {}
-    try:
-        if os.path.exists("/etc/os-release"):
-            with open("/etc/os-release") as f:
-                for line in f:
-                    if "=" in line:
-                        key, value = line.rstrip().split("=", 1)
-                        # Remove surrounding quotes often found in these files
-                        info[key] = value.strip('"')
-    except Exception as e:
-        log.error(f"Failed to read /etc/os-release: {e}")
-    return info
+DOCKER_KEYRINGS_DIR: str = "/etc/apt/keyrings"
+DOCKER_GPG_PATH: str = os.path.join(DOCKER_KEYRINGS_DIR, "docker.gpg")
+DOCKER_APT_LIST: str = "/etc/apt/sources.list.d/docker.sources"
+OLD_DOCKER_PACKAGES: List[str] = [
+    "docker.io", "docker-compose", "docker-compose-v2", "docker-doc",
+    "podman-docker", "containerd", "runc",
+]
+
+# Docker's repo lags behind new Debian releases. Fall back to the last
+# known supported codename if the detected one isn't published yet.
+DEBIAN_DOCKER_FALLBACK: Dict[str, str] = {
+    "trixie": "bookworm",
+    "forky": "trixie",  # Debian 14, future-proofing
+}
+
+def _docker_repo_codename(facts: Facts) -> str:
+    codename = facts.codename
+    if facts.os_id == "debian":
+        return DEBIAN_DOCKER_FALLBACK.get(codename, codename)
+    return codename
+
+def docker_repo_line(facts: Facts) -> Optional[str]:
+    """The expected Docker source line for this host, or None if the OS is unknown."""
+    os_id = facts.os_id
+    codename = _docker_repo_codename(facts)
+    if not os_id or not codename:
+        return None
+
+    arch = platform.machine()
+    ARCH_MAP = {"x86_64": "amd64", "aarch64": "arm64"}
+    display_arch = ARCH_MAP.get(arch, arch)
+    return (
+        f"deb [arch={display_arch} signed-by={DOCKER_GPG_PATH}]"
+        f" https://download.docker.com/linux/{os_id} {codename} stable"
+    )
+
+def ensure_docker_apt_repo(exec_obj: Executor) -> None:
+    """Ensures docker.sources carries the repository (also the agent's reconcile step)."""
+    repo_line = docker_repo_line(exec_obj.facts)
+    if repo_line is None:
+        log.warning("Could not detect OS ID or Codename; not touching the Docker APT repo.")
+        return
+    log.info(f"Using APT repository line: {repo_line}")
+    ensure_apt_repo(exec_obj, DOCKER_APT_LIST, repo_line)
 
 def _remove_old_docker(exec_obj: Executor) -> None:
     """
@@ -36,17 +66,9 @@ def _remove_old_docker(exec_obj: Executor) -> None:
     """
     log.info("Checking for and removing old/conflicting Docker packages...")
     
-    # Comprehensive query command to find packages that need removal
-    query_cmd = (
-        "dpkg --get-selections docker.io docker-compose docker-compose-v2 docker-doc "
-        "podman-docker containerd runc | cut -f1"
-    )
-    
     try:
-        # Execute the query command as root to get the list of packages to remove
-        # run_quiet=True suppresses the execution logging here
-        result = exec_obj.run(query_cmd, force_sudo=True, check=False, run_quiet=True)
-        packages_to_remove = result.stdout.strip().split()
+        # Read from dpkg's status database rather than `dpkg --get-selections`
+        packages_to_remove = dpkg_status.present(OLD_DOCKER_PACKAGES)
         
         if not packages_to_remove:
             log.success("No old Docker or conflicting packages found to remove.")
@@ -62,6 +84,7 @@ def _remove_old_docker(exec_obj: Executor) -> None:
         # Execute the removal command
         # check=False: dpkg may list packages that apt can't find; we continue regardless.
         exec_obj.run(remove_cmd, force_sudo=True, check=True)
+        exec_obj.facts.refresh("packages")
         log.success("Old Docker packages successfully removed.")
 
     except Exception as e:
@@ -91,7 +114,7 @@ def install_docker_and_add_users(
         log.warning("Docker Engine installation is not supported on macOS via this orchestrator.")
         return
     
-    if shutil.which("docker"):
+    if which("docker"):
         log.success("Docker binary detected, skipping installation steps.")
         _verify_docker_installation(exec_obj)
         
@@ -103,14 +126,10 @@ def install_docker_and_add_users(
         # DOCKER_DEPS includes ca-certificates and lsb-release
         apt_install(exec_obj, DOCKER_DEPS)
 
-        # 1. Detect OS details using Python dictionary matching
-        os_info = _get_os_release()
-        os_id = os_info.get("ID")  # e.g., 'ubuntu' or 'debian'
-        # Docker's Ubuntu install docs prefer UBUNTU_CODENAME over VERSION_CODENAME
-        # (falling back to the latter): unofficial derivatives like Mint or Pop!_OS
-        # report their own VERSION_CODENAME but still carry UBUNTU_CODENAME for the
-        # underlying Ubuntu release Docker's repo actually publishes packages for.
-        codename = os_info.get("UBUNTU_CODENAME") or os_info.get("VERSION_CODENAME")
+        # 1. Detect OS details from the shared facts snapshot
+        os_id = exec_obj.facts.os_id  # e.g., 'ubuntu' or 'debian'
+        # Prefers UBUNTU_CODENAME, which Docker's repo actually publishes packages for
+        codename = exec_obj.facts.codename
 
         if not os_id or not codename:
             log.critical(
@@ -120,51 +139,29 @@ def install_docker_and_add_users(
 
         log.info(f"Detected OS: {os_id}, Codename: {codename}")
 
-        # Docker's repo lags behind new Debian releases. Fall back to the last
-        # known supported codename if the detected one isn't published yet.
-        DEBIAN_DOCKER_FALLBACK = {
-            "trixie": "bookworm",
-            "forky": "trixie",  # Debian 14, future-proofing
-        }
-        if os_id == "debian" and codename in DEBIAN_DOCKER_FALLBACK:
-            fallback = DEBIAN_DOCKER_FALLBACK[codename]
+        repo_codename = _docker_repo_codename(exec_obj.facts)
+        if repo_codename != codename:
             log.warning(
                 f"Docker repo has no packages for Debian '{codename}' yet. "
-                f"Using '{fallback}' repo (compatible binaries)."
+                f"Using '{repo_codename}' repo (compatible binaries)."
             )
-            codename = fallback
 
-        keyrings_dir = "/etc/apt/keyrings"
-        docker_gpg_path = os.path.join(keyrings_dir, "docker.gpg")
-        list_file = "/etc/apt/sources.list.d/docker.list"
-        
-        exec_obj.run(f"mkdir -p {keyrings_dir}", force_sudo=True)
+        exec_obj.run(f"mkdir -p {DOCKER_KEYRINGS_DIR}", force_sudo=True)
         
-        if not os.path.exists(docker_gpg_path):
+        if not os.path.exists(host_path(DOCKER_GPG_PATH)):
             log.info(f"Downloading and adding Docker GPG key for {os_id}.")
             curl_cmd = (
-                f"curl -fsSL https://download.docker.com/linux/{os_id}/gpg "
-                f"| gpg --dearmor -o {docker_gpg_path}"
+                f"{fetch_command(DOCKER_GPG_URL.format(os_id=os_id))} "
+                f"| gpg --dearmor -o {DOCKER_GPG_PATH}"
             )
             exec_obj.run(curl_cmd, force_sudo=True)
             # Ensure proper read permissions for apt
-            exec_obj.run(f"chmod a+r {docker_gpg_path}", force_sudo=True)
+            exec_obj.run(f"chmod a+r {DOCKER_GPG_PATH}", force_sudo=True)
         else:
             log.info("Docker GPG key already exists.")
 
-        arch = platform.machine()
-        
-        ARCH_MAP = {"x86_64": "amd64", "aarch64": "arm64"}
-        display_arch = ARCH_MAP.get(arch, arch)
-
         # 2. Interpolate the correct ID, codename and arch into the repository line
-        repo_line = (
-            f"deb [arch={display_arch} signed-by={docker_gpg_path}]"
-            f" https://download.docker.com/linux/{os_id} {codename} stable"
-        )
-        
-        log.info(f"Using APT repository line: {repo_line}")
-        ensure_apt_repo(exec_obj, list_file, repo_line)
+        ensure_docker_apt_repo(exec_obj)
 
         apt_install(exec_obj, DOCKER_PKGS)
 
@@ -175,6 +172,7 @@ def install_docker_and_add_users(
 
 
     exec_obj.run("groupadd -f docker", force_sudo=True)
+    exec_obj.facts.refresh("groups")
 
     if rootless:
         apt_install(exec_obj, ROOTLESS_DOCKER_DEPS)
@@ -188,19 +186,6 @@ def install_docker_and_add_users(
     log.success("Docker installation complete.")
 
 
-def _get_uid(user: str) -> int:
-    return int(subprocess.run(
-        ['id', '-u', user], capture_output=True, text=True, check=True
-    ).stdout.strip())
-
-
-def _get_homedir(user: str) -> str:
-    result = subprocess.run(
-        ['getent', 'passwd', user], capture_output=True, text=True, check=True
-    )
-    return result.stdout.strip().split(':')[5]
-
-
 def _ensure_subid_range(exec_obj: Executor, path: str, user: str) -> None:
     """
     Ensures /etc/subuid or /etc/subgid has a 65536-wide range for user.
@@ -209,7 +194,7 @@ def _ensure_subid_range(exec_obj: Executor, path: str, user: str) -> None:
     guidance in Docker's get.docker.com/rootless install script.
     """
     try:
-        with open(path) as f:
+        with open(host_path(path)) as f:
             lines = f.read().splitlines()
     except FileNotFoundError:
         lines = []
@@ -231,7 +216,9 @@ def _ensure_subid_range(exec_obj: Executor, path: str, user: str) -> None:
     next_start = max(next_start, 100000)
 
     log.info(f"Adding subordinate ID range {next_start}:65536 for '{user}' in {path}.")
-    exec_obj.run(f"echo '{user}:{next_start}:65536' | tee -a {path} > /dev/null", force_sudo=True)
+    exec_obj.write_file(path, "".join(f"{line}\n" for line in lines + [
+        f"{user}:{next_start}:65536"
+    ]), 0o644)
 
 
 def _machinectl_shell(exec_obj: Executor, user: str, uid: int, inner_cmd: str) -> None:
@@ -276,13 +263,13 @@ def _setup_rootless_docker(exec_obj: Executor, user: str) -> None:
     log.info(f"Enabling lingering for '{user}' so their user services survive logout/boot.")
     exec_obj.run(f"loginctl enable-linger {user}", force_sudo=True)
 
-    uid = _get_uid(user)
+    uid = exec_obj.facts.uid(user)
     runtime_dir = f"/run/user/{uid}"
 
     # Lingering triggers systemd-logind to create the runtime dir; give it a
     # moment to appear rather than sleeping blindly.
     for _ in range(10):
-        if os.path.isdir(runtime_dir) or exec_obj.dry_run:
+        if os.path.isdir(host_path(runtime_dir)) or exec_obj.dry_run:
             break
         time.sleep(1)
     else:
@@ -306,14 +293,14 @@ def _add_rootless_env_to_shell_rc(exec_obj: Executor, user: str, uid: int) -> No
     export_line = f'export DOCKER_HOST="unix:///run/user/{uid}/docker.sock"'
 
     try:
-        bashrc = os.path.join(_get_homedir(user), ".bashrc")
-    except subprocess.CalledProcessError:
+        bashrc = os.path.join(exec_obj.facts.home(user), ".bashrc")
+    except KeyError:
         log.warning(f"Could not determine homedir for '{user}'; skipping .bashrc update.")
         return
 
     existing = ""
-    if os.path.exists(bashrc):
-        with open(bashrc) as f:
+    if os.path.exists(host_path(bashrc)):
+        with open(host_path(bashrc)) as f:
             existing = f.read()
 
     if marker in existing:
@@ -322,8 +309,7 @@ def _add_rootless_env_to_shell_rc(exec_obj: Executor, user: str, uid: int) -> No
 
     log.info(f"Adding DOCKER_HOST export to {bashrc} for '{user}'.")
     block = f"\n{marker}\n{export_line}\n"
-    exec_obj.run(f"printf '%s' '{block}' | tee -a {bashrc} > /dev/null", force_sudo=True)
-    exec_obj.run(f"chown {user}:{user} {bashrc}", force_sudo=True)
+    exec_obj.write_file(bashrc, existing + block, 0o644, owner=f"{user}:{user}")
 
 
 def _verify_rootless_docker(exec_obj: Executor, user: str, runtime_dir: str) -> None:
@@ -384,21 +370,21 @@ def run_docker_compose(exec_obj: Executor, user: str, cwd: str, command: str) ->
     Executes a docker compose command in a specific directory as the specified user, 
     favoring the modern 'docker compose' syntax.
     """
-    if not shutil.which("docker"):
+    if not which("docker"):
         log.error("Docker not installed. Cannot run docker compose.")
         raise FileNotFoundError("Docker executable not found.")
         
     log.info(f"Executing Docker Compose command '{command}' in {cwd} as user '{user}'...")
     
     # 1. Prioritize the modern 'docker compose' syntax.
-    compose_path = shutil.which("docker")
+    compose_path = which("docker")
     if compose_path:
         # Use 'docker compose' syntax
         cmd_list = [compose_path, 'compose'] + command.split()
         log.debug(f"Using modern docker compose syntax: {cmd_list}")
     else:
         # 2. Fallback to legacy 'docker-compose' binary path.
-        legacy_path = shutil.which("docker-compose")
+        legacy_path = which("docker-compose")
         if legacy_path:
             cmd_list = [legacy_path] + command.split()
             log.warning("Falling back to legacy 'docker-compose' binary.")
@@ -441,7 +427,7 @@ def are_docker_services_running(
     
     try:
         # We assume the modern 'docker compose' syntax is available
-        compose_path = shutil.which("docker") 
+        compose_path = which("docker") 
         if not compose_path:
             log.error("Docker executable not found for status check.")
             return False
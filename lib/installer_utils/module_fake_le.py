@@ -4,6 +4,7 @@ import sys
 from typing import List, Optional
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path
 from ..constants import ROOT_SRC_CHECKOUT
 from pathlib import Path
 from .module_docker import (
@@ -71,15 +72,15 @@ def setup_fake_le(exec_obj: Executor, args: argparse.Namespace) -> None:
     log.info("Starting **Fake-LE Orchestration**...")
     
     # Check dependencies exist
-    if not os.path.isdir(HWGA_DIR):
+    if not os.path.isdir(host_path(HWGA_DIR)):
         log.critical(f"HWGA repository not found at {HWGA_DIR}. Aborting Fake-LE setup.")
         sys.exit(1)
         
-    if not Path(CERT_GEN_SCRIPT).is_file(): # Use Path for file check
+    if not Path(host_path(CERT_GEN_SCRIPT)).is_file(): # Use Path for file check
         log.critical(f"Cert generation script not found at {CERT_GEN_SCRIPT}. Aborting.")
         sys.exit(1)
         
-    if args.do_fake_le_ca_install and not Path(CA_INSTALLER_SCRIPT).is_file():
+    if args.do_fake_le_ca_install and not Path(host_path(CA_INSTALLER_SCRIPT)).is_file():
         log.critical(f"CA installer script not found at {CA_INSTALLER_SCRIPT}. Aborting.")
         sys.exit(1)
         
@@ -1,5 +1,5 @@
 import os
-import tempfile
+from .. import terminal
 from ..executor import Executor
 from ..logger import log
 from ..constants import FIREWALL_SCRIPT_DEST, FIREWALL_SERVICE_NAME, FIREWALL_PACKAGES, TOOLS_DIR
@@ -233,6 +233,32 @@ RemainAfterExit=yes
 WantedBy=multi-user.target
 """
 
+FIREWALL_SERVICE_PATH = f"/etc/systemd/system/{FIREWALL_SERVICE_NAME}"
+
+def _install_script(exec_obj: Executor) -> None:
+    log.info(f"Writing firewall management script to {FIREWALL_SCRIPT_DEST}")
+    exec_obj.write_file(FIREWALL_SCRIPT_DEST, FIREWALL_SCRIPT_CONTENT, 0o755, owner="root:root")
+
+def _install_service(exec_obj: Executor) -> None:
+    log.info(f"Installing systemd service at {FIREWALL_SERVICE_PATH}")
+    exec_obj.write_file(FIREWALL_SERVICE_PATH, SERVICE_CONTENT, 0o644)
+    exec_obj.run("systemctl daemon-reload", force_sudo=True)
+    exec_obj.run(f"systemctl enable {FIREWALL_SERVICE_NAME}", force_sudo=True)
+
+def reconcile_firewall(exec_obj: Executor) -> None:
+    """
+    Non-interactive reconcile step for the agent: restores the managed script
+    and unit, and re-applies the rules only if the service was already active.
+    """
+    _install_script(exec_obj)
+    _install_service(exec_obj)
+    state = exec_obj.run(
+        f"systemctl is-active {FIREWALL_SERVICE_NAME}", check=False, run_quiet=True
+    )
+    if state.stdout.strip() == "active":
+        log.info("Firewall service is active; re-applying the managed rules.")
+        exec_obj.run(f"systemctl restart {FIREWALL_SERVICE_NAME}", force_sudo=True)
+
 def setup_firewall(exec_obj: Executor) -> None:
     """Installs required packages, scripts, and service. Prompts for application."""
     log.info("Starting **Firewall** setup...")
@@ -242,13 +268,7 @@ def setup_firewall(exec_obj: Executor) -> None:
     apt_install(exec_obj, FIREWALL_PACKAGES)
 
     # 2. Install the Management Script
-    log.info(f"Writing firewall management script to {FIREWALL_SCRIPT_DEST}")
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.sh', delete=False) as tmp:
-        tmp.write(FIREWALL_SCRIPT_CONTENT)
-        tmp_path = tmp.name
-    exec_obj.run(f"mv {tmp_path} {FIREWALL_SCRIPT_DEST}", force_sudo=True)
-    exec_obj.run(f"chmod +x {FIREWALL_SCRIPT_DEST}", force_sudo=True)
-    exec_obj.run(f"chown root:root {FIREWALL_SCRIPT_DEST}", force_sudo=True)
+    _install_script(exec_obj)
 
     # 3. Install the firewall-rules helper tool
     helper_src = os.path.join(TOOLS_DIR, "firewall-rules.py")
@@ -264,15 +284,7 @@ def setup_firewall(exec_obj: Executor) -> None:
         log.warning(f"Diagnostic tool source not found at {helper_src}. Skipping installation.")
 
     # 4. Install the Systemd Service
-    service_path = f"/etc/systemd/system/{FIREWALL_SERVICE_NAME}"
-    log.info(f"Installing systemd service at {service_path}")
-    
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.service', delete=False) as tmp:
-        tmp.write(SERVICE_CONTENT)
-        tmp_service = tmp.name
-    exec_obj.run(f"mv {tmp_service} {service_path}", force_sudo=True)
-    exec_obj.run("systemctl daemon-reload", force_sudo=True)
-    exec_obj.run(f"systemctl enable {FIREWALL_SERVICE_NAME}", force_sudo=True)
+    _install_service(exec_obj)
 
     # 5. Interactive Confirmation to Apply
     if exec_obj.dry_run:
@@ -284,7 +296,9 @@ def setup_firewall(exec_obj: Executor) -> None:
     log.warning("Applying these rules now may affect active network connections.")
     print("!"*70 + "\n")
 
-    confirm = input("Would you like to apply the firewall rules immediately? (y/N): ").lower()
+    confirm = terminal.ask(
+        "Would you like to apply the firewall rules immediately? (y/N): "
+    ).lower()
     if confirm == 'y':
         log.info("Applying firewall rules via systemd...")
         exec_obj.run(f"systemctl start {FIREWALL_SERVICE_NAME}", force_sudo=True)
@@ -1,6 +1,10 @@
+import functools
 import os
+from typing import List
+from .. import gates, journal
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path
 from ..constants import HWGA_REPOS, ROOT_SRC_CHECKOUT, SYSTEM_REPOS
 from .user_mgmt import users_to_groups_if_needed, create_if_needed_ssh_dir
 from .git_tools import (
@@ -12,6 +16,20 @@ from .git_tools import (
 from .repo_utils import _create_if_needed_ssh_key, _dotenv_sync_if_needed
 
 
+def _repo_groups(user: str) -> List[str]:
+    return ["docker", "staff"] if user == "adam" else ["docker"]
+
+
+def setup_no2id_accounts(exec_obj: Executor) -> None:
+    """
+    The users and groups of every NO2ID repo.  Run by the parent before the
+    delegated child starts, so it never races another module on useradd or
+    /etc/group (setup_no2id then finds them in place).
+    """
+    for config in HWGA_REPOS.values():
+        users_to_groups_if_needed(exec_obj, config["user"], _repo_groups(config["user"]))
+
+
 def setup_no2id(exec_obj: Executor) -> None:
     """
     Setup no2id-docker user, groups, SSH keys, and clone/update the NO2ID repos.
@@ -29,16 +47,17 @@ def setup_no2id(exec_obj: Executor) -> None:
         user = config['user']
         dest_dir = config['dest']
         repo_url = config['url']
-        installer = config['installer']
         extra_flags = config.get('extra_flags', "")
+
+        # Sub-step journalling: --resume restarts from the first repo not yet done
+        if journal.step_done("no2id", repo_name):
+            log.success(f"Resuming: {repo_name} already completed in the previous run; skipping.")
+            continue
         
         log.info(f"Processing repository: {repo_name} for user: {user}")
 
         # 1. User/Group setup (Idempotent)
-        groups = ["docker"]
-        if user == "adam":
-            groups.append("staff")
-        users_to_groups_if_needed(exec_obj, user, groups)
+        users_to_groups_if_needed(exec_obj, user, _repo_groups(user))
 
         # 2. SSH key setup (Idempotent check and generation + Permissions enforcement)
         ssh_dir = create_if_needed_ssh_dir(exec_obj, user)
@@ -49,7 +68,9 @@ def setup_no2id(exec_obj: Executor) -> None:
         # Ensure the .ssh directory itself has strict permissions before use
         set_ssh_perms(exec_obj, user, ssh_dir)
         
-        # 3. Clone/Update Repo (Handles interactive key prompt and retry on failure)
+        # 3. Clone/Update Repo. If the deploy key isn't authorised yet this opens a
+        # gate and moves on to the next repo; the rest of this repo's setup runs
+        # once the key works.
         ssh_key_path = os.path.join(ssh_dir, repo_name)
         
         clone_or_update_private_repo_with_key_check(
@@ -61,40 +82,55 @@ def setup_no2id(exec_obj: Executor) -> None:
             extra_git_flags=extra_flags,
             user=user,
             group=config.get('group'),
+            then=functools.partial(_finish_repo, exec_obj, repo_name, ssh_key_path),
         )
-        
-        # --- NEW STEP: Configure local Git SSH key for subsequent pulls/fetches ---
-        # This resolves the 'Permission denied' error for subsequent 'git pull' operations 
-        # performed by the user inside the repository.
-        _configure_repo_ssh_key(exec_obj, user, dest_dir, ssh_key_path)
-        
-        # 4. Fix permissions
-        set_homedir_perms_recursively(exec_obj, user, dest_dir)
-        
-        # --- NEW STEP: Generate .env file if flagged in constants ---
-        _dotenv_sync_if_needed(exec_obj, repo_name, user, dest_dir)
+        gates.checkpoint()
 
-        # 5. Run installer script (as the user)
-        installer_path = os.path.join(dest_dir, installer)
-        
-        # --- LOGIC: Skip installer requiring arguments ---
-        if repo_name == "fake-le" and installer == "fake-le-for-no2id-docker-installer":
-            log.info(
-                f"Skipping installer {installer} for {repo_name}. "
-                "Handled by the --fake-le module."
-            )
-            continue # Skip execution for this specific module
-        
-        # Execute all other installers
-        if os.path.exists(installer_path) and os.access(installer_path, os.X_OK):
-            log.info(f"Running installer {installer} for {repo_name} as user {user}...")
-            exec_obj.run(f"'{installer_path}'", user=user) 
-        elif installer:
-            log.warning(f"Installer {installer} for {repo_name} not executable, skipping.")
+    # Barrier: this runs in a delegated child; pending keys go to the parent run,
+    # which re-runs this module once one works.
+    if not gates.hand_off():
+        return
 
     log.success("NO2ID setup complete.")
 
 
+def _finish_repo(exec_obj: Executor, repo_name: str, ssh_key_path: str) -> None:
+    """Post-clone setup for one HWGA repo: git SSH config, perms, .env, installer."""
+    config = HWGA_REPOS[repo_name]
+    user = config['user']
+    dest_dir = config['dest']
+    installer = config['installer']
+
+    # --- NEW STEP: Configure local Git SSH key for subsequent pulls/fetches ---
+    # This resolves the 'Permission denied' error for subsequent 'git pull' operations 
+    # performed by the user inside the repository.
+    _configure_repo_ssh_key(exec_obj, user, dest_dir, ssh_key_path)
+    
+    # 4. Fix permissions
+    set_homedir_perms_recursively(exec_obj, user, dest_dir)
+    
+    # --- NEW STEP: Generate .env file if flagged in constants ---
+    _dotenv_sync_if_needed(exec_obj, repo_name, user, dest_dir)
+
+    # 5. Run installer script (as the user)
+    installer_path = os.path.join(dest_dir, installer)
+    
+    # --- LOGIC: Skip installer requiring arguments ---
+    if repo_name == "fake-le" and installer == "fake-le-for-no2id-docker-installer":
+        log.info(
+            f"Skipping installer {installer} for {repo_name}. "
+            "Handled by the --fake-le module."
+        )
+    # Execute all other installers
+    elif os.access(host_path(installer_path), os.X_OK):
+        log.info(f"Running installer {installer} for {repo_name} as user {user}...")
+        exec_obj.run(f"'{installer_path}'", user=user) 
+    elif installer:
+        log.warning(f"Installer {installer} for {repo_name} not executable, skipping.")
+
+    journal.mark_step(exec_obj, "no2id", repo_name)
+
+
 def install_system_repos(exec_obj: Executor) -> None:
     """Installs and runs installers for system-level GitHub repos (from SYSTEM_REPOS)."""
     log.info("Starting installation of system-level repositories...")
@@ -111,6 +147,10 @@ def install_system_repos(exec_obj: Executor) -> None:
         repo_url = config['url']
         dest_dir = os.path.join(base_dir, repo_name)
 
+        if journal.step_done("cloud_init", repo_name):
+            log.success(f"Resuming: {repo_name} already completed in the previous run; skipping.")
+            continue
+
         # Note: These are public/system repos, user=None (runs as root), so use low-level clone
         from .git_tools import clone_or_update_repo # Use low-level clone
         clone_or_update_repo(exec_obj, repo_url, dest_dir)
@@ -121,7 +161,7 @@ def install_system_repos(exec_obj: Executor) -> None:
         exec_obj.run(f"chmod -s {dest_dir}", force_sudo=True)
 
         install_path = os.path.join(dest_dir, installer)
-        if os.path.exists(install_path) and os.access(install_path, os.X_OK):
+        if os.access(host_path(install_path), os.X_OK):
             log.info(f"Running {installer} for {repo_name}...")
             # Run inside the repo directory (as root)
             exec_obj.run(
@@ -131,5 +171,7 @@ def install_system_repos(exec_obj: Executor) -> None:
             log.success(f"Installer completed for {repo_name}.")
         else:
             log.warning(f"Installer {install_path} missing or not executable, skipping.")
+
+        journal.mark_step(exec_obj, "cloud_init", repo_name)
             
     log.success("System repository installation finished.")
\ No newline at end of file
@@ -43,7 +43,6 @@ CLI flags (see setup_machine.py for full list)
 
 import argparse
 import os
-import shutil
 import socket
 import random
 import textwrap
@@ -52,6 +51,8 @@ from typing import Optional, List
 
 from ..executor import Executor
 from ..logger import log
+from .. import offline, paths
+from ..paths import which
 from ..platform_utils import is_mac, is_linux, get_real_user
 from ..constants import (
     OLLAMA_STACK_DIR,
@@ -64,8 +65,11 @@ from ..constants import (
     WEBUI_PORT_SEARCH_MAX,
     OLLAMA_DEFAULT_MODEL,
     OLLAMA_PERMA_MOUNTS,
+    OLLAMA_INSTALL_URL,
+    OPEN_WEBUI_IMAGE,
     TOOLS_DIR,
 )
+from ..prefetch import fetch_command
 from .user_mgmt import add_user_to_group
 from .module_docker import run_docker_compose, are_docker_services_running
 from .brew_tools import (
@@ -138,11 +142,12 @@ def _find_ollama_bin() -> Optional[str]:
     locations (important when running as root where Homebrew's prefix may
     not be in PATH).
     """
-    in_path = shutil.which("ollama")
+    in_path = which("ollama")
     if in_path:
         return in_path
     for candidate in _OLLAMA_CANDIDATE_PATHS:
-        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+        mapped = paths.host_path(candidate)
+        if os.path.isfile(mapped) and os.access(mapped, os.X_OK):
             return candidate
     return None
 
@@ -175,7 +180,7 @@ def _install_ollama_linux(exec_obj: Executor) -> None:
     """Install Ollama on Linux via the official install script."""
     log.info("Installing Ollama via official install script…")
     exec_obj.run(
-        "curl -fsSL https://ollama.com/install.sh | sh",
+        f"{fetch_command(OLLAMA_INSTALL_URL)} | sh",
         force_sudo=True,
     )
     log.success("Ollama installed.")
@@ -264,6 +269,9 @@ def pull_ollama_model(exec_obj: Executor, model: str) -> None:
     except Exception:
         log.debug("ollama list failed; attempting pull anyway.")  # noqa: S110
 
+    if offline.load_model(exec_obj, model):
+        return
+
     log.info(f"Pulling Ollama model: {model}  (this may take a while)…")
     exec_obj.run(
         [ollama_bin, "pull", model],
@@ -304,7 +312,7 @@ def _expand_perma_mounts(real_user: str, extra_path: Optional[str] = None) -> Li
 
     for rel in OLLAMA_PERMA_MOUNTS:
         host_path = home / rel
-        if host_path.exists():
+        if os.path.exists(paths.host_path(str(host_path))):
             container_path = f"/workspace/{rel}"
             mounts.append(f"{host_path}:{container_path}:ro")
             log.info(f"Perma-mount: {host_path} → {container_path} (ro)")
@@ -357,7 +365,7 @@ def _write_compose_file(
 
         services:
           open-webui:
-            image: ghcr.io/open-webui/open-webui:main
+            image: {OPEN_WEBUI_IMAGE}
             container_name: open-webui
             restart: unless-stopped
             ports:
@@ -378,9 +386,9 @@ def _write_compose_file(
             name: open-webui-data
     """)
 
-    with open(compose_path, "w") as fh:
+    with open(paths.host_path(compose_path), "w") as fh:
         fh.write(content)
-    os.chmod(compose_path, 0o644)
+    os.chmod(paths.host_path(compose_path), 0o644)
     log.success(f"docker-compose.yml written → {compose_path}")
 
 
@@ -395,7 +403,7 @@ def _write_env_file(
     """Write (or skip) the .env file alongside docker-compose.yml."""
     env_path = os.path.join(stack_dir, ".env")
 
-    if os.path.exists(env_path) and not force:
+    if os.path.exists(paths.host_path(env_path)) and not force:
         log.success(f".env already exists at {env_path} — skipping (--force to overwrite).")
         return
 
@@ -411,9 +419,9 @@ def _write_env_file(
         GOOGLE_PSE_ENGINE_ID={google_cx}
     """)
 
-    with open(env_path, "w") as fh:
+    with open(paths.host_path(env_path), "w") as fh:
         fh.write(content)
-    os.chmod(env_path, 0o600)
+    os.chmod(paths.host_path(env_path), 0o600)
     log.success(f".env written → {env_path}  (mode 600)")
 
 
@@ -435,8 +443,8 @@ def setup_open_webui(
     *compose_user* is the OS user under which ``docker compose`` runs.
     On Linux this is ``"root"``; on macOS it is the real (non-root) user.
     """
-    os.makedirs(stack_dir, exist_ok=True)
-    os.chmod(stack_dir, 0o755)  # nosec B103  # noqa: S103
+    os.makedirs(paths.host_path(stack_dir), exist_ok=True)
+    os.chmod(paths.host_path(stack_dir), 0o755)  # nosec B103  # noqa: S103
 
     extra_volumes = _expand_perma_mounts(real_user=real_user, extra_path=extra_mount)
 
@@ -466,7 +474,8 @@ def setup_open_webui(
         return
 
     log.info("Starting Open WebUI via Docker Compose…")
-    run_docker_compose(exec_obj, compose_user, stack_dir, "up -d --pull always --wait")
+    pull = "never" if offline.load_image(exec_obj, OPEN_WEBUI_IMAGE, compose_user) else "always"
+    run_docker_compose(exec_obj, compose_user, stack_dir, f"up -d --pull {pull} --wait")
     log.success("Open WebUI stack started.")
     _print_access_info(webui_port)
 
@@ -503,8 +512,8 @@ def install_open_terminal_helper(exec_obj: Executor) -> None:
         return
 
     import shutil as _shutil
-    _shutil.copy2(src, dst)
-    os.chmod(dst, 0o755)  # nosec B103  # noqa: S103
+    _shutil.copy2(src, paths.host_path(dst))
+    os.chmod(paths.host_path(dst), 0o755)  # nosec B103  # noqa: S103
     log.success(f"Installed: {dst}")
 
 def open_terminal_with_path(exec_obj: Executor, host_path: str) -> None:
@@ -550,7 +559,7 @@ def open_terminal_with_path(exec_obj: Executor, host_path: str) -> None:
         # --network host is not supported on macOS containers.
         network_flags = []
 
-    cmd = base_cmd + network_flags + ["ghcr.io/open-webui/open-webui:main", "bash"]
+    cmd = base_cmd + network_flags + [OPEN_WEBUI_IMAGE, "bash"]
     exec_obj.run(cmd, force_sudo=is_linux, interactive=True)
 
 
@@ -682,6 +691,8 @@ def setup_ollama(exec_obj: Executor, args: argparse.Namespace) -> None:
             check=False,
             run_quiet=True,
         )
+        # add_user_to_group checks the facts: they must see the new account
+        exec_obj.facts.refresh("users", "groups")
         add_user_to_group(exec_obj, ollama_system_user, "docker")
     else:
         # macOS: docker runs under the real user account via Docker Desktop.
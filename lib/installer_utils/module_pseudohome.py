@@ -1,8 +1,9 @@
 import os
 import platform
-import time
+from .. import gates
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path
 from .user_mgmt import users_to_groups_if_needed, create_if_needed_ssh_dir
 from .git_tools import (
     clone_or_update_private_repo_with_key_check,
@@ -53,10 +54,18 @@ def _show_wolfcraig_copy_hint(exec_obj: Executor, user: str, ssh_dir: str, repo_
         )
     print(f"\n  {cmd}\n", flush=True)
     print("=" * 70 + "\n", flush=True)
-    for i in range(10, 0, -1):
-        print(f"  Continuing in {i}s...  ", end="\r", flush=True)
-        time.sleep(1)
-    print(flush=True)
+
+
+def _restore_home_perms(exec_obj: Executor, user: str, ssh_dir: str) -> None:
+    # Always re-enforce .ssh and home dir ownership — guard against any upstream group leak.
+    # /home/adam must never carry the docker group; adam:adam only.
+    exec_obj.run(f"chown {user}:{user} /home/{user}", force_sudo=True)
+    set_ssh_perms(exec_obj, user, ssh_dir)
+
+
+def setup_pseudohome_accounts(exec_obj: Executor) -> None:
+    """'adam's groups; like setup_no2id_accounts, run by the parent first."""
+    users_to_groups_if_needed(exec_obj, PSEUDOHOME_USER, ["docker", "staff"])
 
 
 def setup_pseudohome(exec_obj: Executor) -> None:
@@ -71,16 +80,13 @@ def setup_pseudohome(exec_obj: Executor) -> None:
     dest_dir = PSEUDOHOME_DEST_DIR
 
     # 1. User/Group setup
-    users_to_groups_if_needed(exec_obj, user, ["docker", "staff"])
+    setup_pseudohome_accounts(exec_obj)
 
     # 2. SSH key setup (Idempotent check and generation + Permissions enforcement)
     ssh_dir = create_if_needed_ssh_dir(exec_obj, user)
 
     # This function now guarantees the key exists and has strict permissions
-    key_is_new = _create_if_needed_ssh_key(exec_obj, user, ssh_dir, repo_name)
-
-    if key_is_new:
-        _show_wolfcraig_copy_hint(exec_obj, user, ssh_dir, repo_name)
+    _create_if_needed_ssh_key(exec_obj, user, ssh_dir, repo_name)
 
     # Ensure the .ssh directory itself has strict permissions before use
     set_ssh_perms(exec_obj, user, ssh_dir)
@@ -92,7 +98,7 @@ def setup_pseudohome(exec_obj: Executor) -> None:
             "Tailscale not connected — cannot reach git.amyl.org.uk. Aborting pseudohome setup."
         )
 
-    # 4. SSH connectivity probe — remediates known_hosts / key perms, prompts if key missing
+    # 4. SSH connectivity probe — remediates known_hosts / key perms
     ssh_key_path = os.path.join(ssh_dir, repo_name)
     log.info("Probing SSH connectivity to git.amyl.org.uk...")
     ssh_ok = probe_and_fix_ssh(
@@ -105,9 +111,28 @@ def setup_pseudohome(exec_obj: Executor) -> None:
         log.warning(
             "Cannot reach git.amyl.org.uk — the pseudohome deploy key may not be authorised yet."
         )
+
+    def instructions() -> None:
+        _show_wolfcraig_copy_hint(exec_obj, user, ssh_dir, repo_name)
         _display_key_and_url_for_repo(exec_obj, ssh_dir, repo_name, PSEUDOHOME_REPO_URL)
 
+    def finish() -> None:
+        # 6. Fix permissions on repo dir; home dir chown is non-recursive.
+        exec_obj.run(f"chown {user}:{user} {os.path.dirname(dest_dir)}", force_sudo=True)
+        set_homedir_perms_recursively(exec_obj, user, dest_dir)
+        _restore_home_perms(exec_obj, user, ssh_dir)
+
+        # 7. Run installer script (as the user)
+        installer_path = os.path.join(dest_dir, PSEUDOHOME_INSTALLER)
+        if os.access(host_path(installer_path), os.X_OK):
+            log.info("Running pseudohome installer script...")
+            exec_obj.run([installer_path], user=user)
+        else:
+            log.warning(f"Installer {PSEUDOHOME_INSTALLER} not executable, skipping.")
+
     # 5. Clone/Update Repo — always re-enforce .ssh perms even if clone fails.
+    # An unauthorised key opens a gate: the wolfcraig hint is printed and the
+    # clone (plus the steps after it) resumes once the key works.
     try:
         clone_or_update_private_repo_with_key_check(
             exec_obj,
@@ -117,23 +142,15 @@ def setup_pseudohome(exec_obj: Executor) -> None:
             repo_name=repo_name,
             extra_git_flags="--recursive",
             user=user,
+            then=finish,
+            instructions=instructions,
         )
-
-        # 6. Fix permissions on repo dir; home dir chown is non-recursive.
-        exec_obj.run(f"chown {user}:{user} {os.path.dirname(dest_dir)}", force_sudo=True)
-        set_homedir_perms_recursively(exec_obj, user, dest_dir)
     finally:
-        # Always re-enforce .ssh and home dir ownership — guard against any upstream group leak.
-        # /home/adam must never carry the docker group; adam:adam only.
-        exec_obj.run(f"chown {user}:{user} /home/{user}", force_sudo=True)
-        set_ssh_perms(exec_obj, user, ssh_dir)
-
-    # 7. Run installer script (as the user)
-    installer_path = os.path.join(dest_dir, PSEUDOHOME_INSTALLER)
-    if os.path.exists(installer_path) and os.access(installer_path, os.X_OK):
-        log.info("Running pseudohome installer script...")
-        exec_obj.run([installer_path], user=user)
-    else:
-        log.warning(f"Installer {PSEUDOHOME_INSTALLER} not executable, skipping.")
+        _restore_home_perms(exec_obj, user, ssh_dir)
+
+    # Barrier: this runs in a delegated child; a pending key goes to the parent run,
+    # which re-runs this module once it works.
+    if not gates.hand_off():
+        return
 
     log.success(f"Pseudohome setup complete for {user}.")
@@ -6,6 +6,8 @@ from .git_tools import clone_or_update_repo
 
 WOLFCRAIG_REPO = "/usr/local/src/wolfcraig"
 GHOST_DOCKER_REPO = "/opt/ghost-docker"
+WOLFCRAIG_REPO_URL = "https://github.com/adamamyl/wolfcraig.git"
+GHOST_DOCKER_REPO_URL = "https://github.com/adamamyl/ghost-docker.git"
 
 
 def setup_wolfcraig(exec_obj: Executor) -> None:
@@ -14,12 +16,12 @@ def setup_wolfcraig(exec_obj: Executor) -> None:
     log.info("Cloning/updating wolfcraig repositories...")
     clone_or_update_repo(
         exec_obj,
-        "https://github.com/adamamyl/wolfcraig.git",
+        WOLFCRAIG_REPO_URL,
         WOLFCRAIG_REPO,
     )
     clone_or_update_repo(
         exec_obj,
-        "https://github.com/adamamyl/ghost-docker.git",
+        GHOST_DOCKER_REPO_URL,
         GHOST_DOCKER_REPO,
     )
 
@@ -1,6 +1,7 @@
 import os
 from ..executor import Executor
 from ..logger import log # <-- ADD THIS IMPORT
+from ..paths import host_path
 from .apt_tools import apt_install
 from ..constants import STANDARD_PACKAGES, SYSTEM_REPOS, ROOT_SRC_CHECKOUT
 from .git_tools import clone_or_update_repo
@@ -27,7 +28,7 @@ def install_update_all_packages(exec_obj: Executor) -> None:
     clone_or_update_repo(exec_obj, repo_url, dest_dir)
     
     install_path = os.path.join(dest_dir, installer)
-    if os.path.exists(install_path) and os.access(install_path, os.X_OK):
+    if os.path.exists(host_path(install_path)) and os.access(host_path(install_path), os.X_OK):
         exec_obj.run(
             f"pushd '{dest_dir}' >/dev/null && './{installer}' && popd >/dev/null",
             force_sudo=True,
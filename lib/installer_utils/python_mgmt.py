@@ -1,8 +1,8 @@
 import os
-import shutil
 from typing import List
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path, which
 from ..constants import VENVDIR, REPO_ROOT
 from .apt_tools import apt_install
 
@@ -10,19 +10,19 @@ from .apt_tools import apt_install
 def install_python_venv(exec_obj: Executor) -> None:
     """Installs Python3, python3-venv, and creates/updates the virtual environment."""
     
-    if not os.path.isdir("/opt"):
+    if not os.path.isdir(host_path("/opt")):
         log.critical("/opt does not exist. Please create it before running.")
         raise FileNotFoundError("/opt directory missing.")
         
-    if not os.access("/opt", os.W_OK):
+    if not os.access(host_path("/opt"), os.W_OK):
         log.critical("/opt is not writable. Run as root or adjust permissions.")
         
-    python_bin = shutil.which("python3")
+    python_bin = which("python3")
     
-    if not python_bin or not shutil.which("venv"):
+    if not python_bin or not which("venv"):
         log.info("Installing Python 3 and venv packages...")
         apt_install(exec_obj, ["python3", "python3-venv", "python3-pip"])
-        python_bin = shutil.which("python3")
+        python_bin = which("python3")
         if not python_bin:
              log.critical("Failed to install python3. Cannot proceed.")
              raise RuntimeError("Python 3 installation failed.")
@@ -30,7 +30,7 @@ def install_python_venv(exec_obj: Executor) -> None:
         log.success("Python 3 and venv already installed.")
     
     venv_tool_cmd: List[str]
-    venv_tool = shutil.which("uv")
+    venv_tool = which("uv")
     
     if venv_tool:
         log.info("Using 'uv' for virtual environment management.")
@@ -44,7 +44,7 @@ def install_python_venv(exec_obj: Executor) -> None:
         venv_pip = os.path.join(VENVDIR, "bin", "pip")
         install_cmd = [venv_pip, 'install', '-r', os.path.join(REPO_ROOT, "requirements.txt")]
 
-    if not os.path.isdir(VENVDIR):
+    if not os.path.isdir(host_path(VENVDIR)):
         log.info(f"Creating Python virtual environment at {VENVDIR}")
         exec_obj.run(venv_tool_cmd, force_sudo=True)
         
@@ -56,7 +56,7 @@ def install_python_venv(exec_obj: Executor) -> None:
         log.success(f"Virtual environment created and dependencies installed at {VENVDIR}")
         
     else:
-        if not os.access(VENVDIR, os.W_OK):
+        if not os.access(host_path(VENVDIR), os.W_OK):
             log.critical(f"Virtual environment exists at {VENVDIR} but is not writable.")
             raise PermissionError(f"VENVDIR {VENVDIR} not writable.")
         log.success(f"Python virtual environment already exists at {VENVDIR} and is writable.")
@@ -3,6 +3,7 @@ import platform
 import re
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path
 from ..constants import HWGA_REPOS, TOOLS_DIR
 
 
@@ -30,7 +31,7 @@ def _create_if_needed_ssh_key(exec_obj: Executor, user: str, ssh_dir: str, key_n
     """
     key_file = os.path.join(ssh_dir, key_name)
     key_file_pub = f"{key_file}.pub"
-    key_exists = os.path.isfile(key_file)
+    key_exists = os.path.isfile(host_path(key_file))
     key_is_new = False
 
     # 1. GENERATION: Skip if the private key file already exists.
@@ -62,7 +63,7 @@ def _create_if_needed_ssh_key(exec_obj: Executor, user: str, ssh_dir: str, key_n
         key_is_new = True
 
     # --- 3. PERMISSION ENFORCEMENT (ALWAYS RUNS IF KEY FILE EXISTS) ---
-    if os.path.isfile(key_file):
+    if os.path.isfile(host_path(key_file)):
         log.info(f"Enforcing strict permissions and ownership on {key_name} keys...")
 
         # Set ownership for both private and public keys
@@ -83,8 +84,10 @@ def _create_if_needed_ssh_key(exec_obj: Executor, user: str, ssh_dir: str, key_n
 def _display_key_and_url_for_repo(
     exec_obj: Executor, ssh_dir: str, repo_name: str, repo_url: str
 ) -> None:
-    # ... (function body remains the same) ...
-    
+    """
+    Prints the deploy URL and public key for *repo_name*. Doesn't wait for the
+    key to be added: the caller's deploy-key gate polls for that.
+    """
     deploy_url = _convert_ssh_to_deploy_url(repo_url)
     
     # FIX: Define key_file_pub before use
@@ -97,7 +100,7 @@ def _display_key_and_url_for_repo(
     print("="*70 + "\n", flush=True)
     
     try:
-        with open(key_file_pub, 'r') as f:
+        with open(host_path(key_file_pub), 'r') as f:
             pub_key = f.read().strip()
             print("\n" + "="*50, flush=True)
             print(pub_key, flush=True)
@@ -106,17 +109,6 @@ def _display_key_and_url_for_repo(
     except FileNotFoundError:
         log.error(f"Public key file not found at {key_file_pub}")
         raise
-        
-    import sys
-    import time
-    if sys.stdin.isatty():
-        input("Press Enter once the deploy key has been successfully added to the Git host...")
-    else:
-        log.warning(
-            "Non-interactive context (cloud-init?): cannot prompt. "
-            "Add the public key above to the Git host. Waiting 30 seconds before retrying..."
-        )
-        time.sleep(30)
 
 # --- NEW DOTENV SYNC UTILITY ---
 def _dotenv_sync_if_needed(exec_obj: Executor, repo_name: str, user: str, repo_dir: str) -> None:
@@ -139,7 +131,7 @@ def _dotenv_sync_if_needed(exec_obj: Executor, repo_name: str, user: str, repo_d
     output_file = os.path.join(repo_dir, ".env")
 
     # If the .env file already exists, we skip generation unless forced.
-    if os.path.exists(output_file) and not exec_obj.force:
+    if os.path.exists(host_path(output_file)) and not exec_obj.force:
         log.success(f".env file already exists in {repo_dir}. Skipping synchronization.")
         return
 
@@ -1,11 +1,10 @@
 """SSH connectivity probe with auto-remediation."""
 
 import os
-import pwd
 import re
-import subprocess
 from ..executor import Executor
 from ..logger import log
+from ..paths import chown, host_path
 
 _SAFE_HOSTNAME_RE = re.compile(r"^[a-zA-Z0-9]([a-zA-Z0-9\-\.]{0,253}[a-zA-Z0-9])?$")
 
@@ -25,9 +24,9 @@ def _validate_host(host: str) -> None:
         raise ValueError(f"Unsafe hostname rejected: {host!r}")
 
 
-def _user_homedir(ssh_user: str) -> str:
-    """Resolve homedir from passwd — portable across /home, /Users, etc."""
-    return pwd.getpwnam(ssh_user).pw_dir
+def _user_homedir(exec_obj: Executor, ssh_user: str) -> str:
+    """Resolve homedir from passwd (via facts) — portable across /home, /Users, etc."""
+    return exec_obj.facts.home(ssh_user)
 
 
 def _ssh_probe(
@@ -64,43 +63,42 @@ def _ssh_probe(
     return True, stderr
 
 
-def _append_to_known_hosts(ssh_user: str, known_hosts: str, host: str) -> None:
+def _append_to_known_hosts(
+    exec_obj: Executor, ssh_user: str, known_hosts: str, host: str
+) -> None:
     """Runs ssh-keyscan and appends output to known_hosts directly (runs as root)."""
     try:
-        scan = subprocess.run(
-            ["ssh-keyscan", "-H", host],
-            capture_output=True,
-            text=True,
-            timeout=15,
+        scan = exec_obj.run(
+            ["timeout", "15", "ssh-keyscan", "-H", host], check=False, run_quiet=True
         )
         if not scan.stdout.strip():
             log.warning(f"ssh-keyscan returned no output for {host}.")
             return
         # Write directly as root; fix ownership and perms after
-        with open(known_hosts, "a") as f:
+        with open(host_path(known_hosts), "a") as f:
             f.write(scan.stdout)
-        pw = pwd.getpwnam(ssh_user)
-        os.chown(known_hosts, pw.pw_uid, pw.pw_gid)
-        os.chmod(known_hosts, 0o600)
+        chown(known_hosts, exec_obj.facts.uid(ssh_user), exec_obj.facts.gid(ssh_user))
+        os.chmod(host_path(known_hosts), 0o600)
         log.success(f"Added {host} to {known_hosts}.")
     except Exception as e:
         log.warning(f"ssh-keyscan failed: {e}")
 
 
-def _seed_known_hosts(ssh_user: str, known_hosts: str, host: str, entries: list[str]) -> None:
+def _seed_known_hosts(
+    exec_obj: Executor, ssh_user: str, known_hosts: str, host: str, entries: list[str]
+) -> None:
     """Writes baked-in known_hosts entries for host if not already present."""
     existing = ""
-    if os.path.exists(known_hosts):
-        with open(known_hosts) as f:
+    if os.path.exists(host_path(known_hosts)):
+        with open(host_path(known_hosts)) as f:
             existing = f.read()
     new_lines = [e for e in entries if e not in existing]
     if not new_lines:
         return
-    with open(known_hosts, "a") as f:
+    with open(host_path(known_hosts), "a") as f:
         f.write("\n".join(new_lines) + "\n")
-    pw = pwd.getpwnam(ssh_user)
-    os.chown(known_hosts, pw.pw_uid, pw.pw_gid)
-    os.chmod(known_hosts, 0o600)
+    chown(known_hosts, exec_obj.facts.uid(ssh_user), exec_obj.facts.gid(ssh_user))
+    os.chmod(host_path(known_hosts), 0o600)
     log.info(f"Seeded {len(new_lines)} baked-in host key(s) for {host} into known_hosts.")
 
 
@@ -123,13 +121,13 @@ def probe_and_fix_ssh(
       5. Verbose retry with full diagnostics before returning False
     """
     _validate_host(host)
-    home = _user_homedir(ssh_user)
+    home = _user_homedir(exec_obj, ssh_user)
     known_hosts = os.path.join(home, ".ssh", "known_hosts")
 
     # Pre-seed known_hosts with baked-in entries so Tailscale-only hosts don't
     # trigger interactive fingerprint prompts on first connection.
     if host in _BAKED_KNOWN_HOSTS:
-        _seed_known_hosts(ssh_user, known_hosts, host, _BAKED_KNOWN_HOSTS[host])
+        _seed_known_hosts(exec_obj, ssh_user, known_hosts, host, _BAKED_KNOWN_HOSTS[host])
 
     ok, stderr = _ssh_probe(exec_obj, host, ssh_user, key_path)
     if ok:
@@ -161,17 +159,17 @@ def probe_and_fix_ssh(
 
     # Remediation B: populate/refresh known_hosts (written as root, chowned to user)
     log.info(f"Running ssh-keyscan -H {host}...")
-    _append_to_known_hosts(ssh_user, known_hosts, host)
+    _append_to_known_hosts(exec_obj, ssh_user, known_hosts, host)
 
     # Remediation C: fix .ssh dir (700) and private key (600) permissions
     ssh_dir = os.path.dirname(key_path)
-    if os.path.isdir(ssh_dir):
-        dir_mode = oct(os.stat(ssh_dir).st_mode & 0o777)
+    if os.path.isdir(host_path(ssh_dir)):
+        dir_mode = oct(os.stat(host_path(ssh_dir)).st_mode & 0o777)
         if dir_mode != "0o700":
             log.warning(f"{ssh_dir} has perms {dir_mode}; correcting to 700...")
             exec_obj.run(["chmod", "700", ssh_dir], force_sudo=True)
-    if os.path.isfile(key_path):
-        key_mode = oct(os.stat(key_path).st_mode & 0o777)
+    if os.path.isfile(host_path(key_path)):
+        key_mode = oct(os.stat(host_path(key_path)).st_mode & 0o777)
         if key_mode != "0o600":
             log.warning(f"Key {key_path} has perms {key_mode}; correcting to 600...")
             exec_obj.run(["chmod", "600", key_path], force_sudo=True)
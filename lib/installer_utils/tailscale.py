@@ -1,24 +1,26 @@
-import shutil
+from ..constants import TAILSCALE_INSTALL_URL
 from ..executor import Executor
 from ..logger import log
+from ..paths import which
+from ..prefetch import fetch_command
 import subprocess  # Added for specific error handling
 import time  # Added for sleep in retry logic
 
 
 def install_tailscale(exec_obj: Executor) -> None:
     """Installs Tailscale using their official curl | sh script."""
-    if shutil.which("tailscale"):
+    if which("tailscale"):
         log.success("Tailscale already installed.")
         return
 
     log.info("Installing Tailscale...")
-    exec_obj.run("curl -fsSL https://tailscale.com/install.sh | sh", force_sudo=True)
+    exec_obj.run(f"{fetch_command(TAILSCALE_INSTALL_URL)} | sh", force_sudo=True)
     log.success("Tailscale installation finished.")
 
 
 def ensure_tailscale_strict(exec_obj: Executor) -> None:
     """Enables Tailscale SSH."""
-    if not shutil.which("tailscale"):
+    if not which("tailscale"):
         log.warning("Tailscale not installed, skipping strict setup.")
         return
 
@@ -37,7 +39,7 @@ def ensure_tailscale_connected(exec_obj: Executor) -> bool:
     Uses 'tailscale ip -4' as a robust status check.
     Returns True if connected or successfully connected, False otherwise.
     """
-    if not shutil.which("tailscale"):
+    if not which("tailscale"):
         log.warning("Tailscale not installed. Cannot ensure tailnet connection.")
         return False
 
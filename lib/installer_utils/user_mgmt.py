@@ -1,22 +1,20 @@
 import os
-import subprocess
-import tempfile
 from typing import List, Optional, Set
+from .. import terminal
 from ..executor import Executor
 from ..logger import log
-from ..constants import USER_GITHUB_KEY_MAP # Required for key mapping
+from ..paths import host_path
+from ..constants import GITHUB_KEYS_URL, USER_GITHUB_KEY_MAP # Required for key mapping
+from ..prefetch import fetch_command
 
 # --- User and Group Management ---
 
-def _uid_gid_available(uid: int) -> bool:
+def _uid_gid_available(exec_obj: Executor, uid: int) -> bool:
     """Checks whether a uid/gid number is not already claimed by another user/group."""
-    uid_taken = subprocess.run(
-        ['getent', 'passwd', str(uid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    ).returncode == 0
-    gid_taken = subprocess.run(
-        ['getent', 'group', str(uid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    ).returncode == 0
-    return not uid_taken and not gid_taken
+    return not exec_obj.facts.uid_taken(uid) and not exec_obj.facts.gid_taken(uid)
+
+# Accounts the user declined to create: prompted for once per run
+_declined: Set[str] = set()
 
 def require_user(
     exec_obj: Executor,
@@ -34,35 +32,35 @@ def require_user(
     If prompt_before_create is True and we're not running with --force,
     asks for interactive confirmation before creating the account.
     """
-    try:
-        # id check is idempotent
-        subprocess.run(
-            ['id', user], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        )
-        return True
-    except subprocess.CalledProcessError:
-        if prompt_before_create and not exec_obj.force and not exec_obj.dry_run:
-            confirm = input(f"User '{user}' does not exist. Create it now? (y/N): ").lower()
-            if confirm != 'y':
-                log.warning(f"Skipping creation of user '{user}' at user's request.")
-                return False
-
-        useradd_cmd = ['useradd', '-m']
-        if uid is not None:
-            if _uid_gid_available(uid):
-                useradd_cmd += ['-u', str(uid), '-U']
-            else:
-                log.warning(
-                    f"uid/gid {uid} already in use (e.g. by another service); "
-                    f"creating '{user}' with the next available uid/gid instead. "
-                    "Not renumbering existing accounts."
-                )
-        useradd_cmd.append(user)
-
-        log.info(f"Creating user '{user}'...")
-        exec_obj.run(" ".join(useradd_cmd), force_sudo=True)
-        log.success(f"Created user '{user}'")
+    if exec_obj.facts.user_exists(user):
         return True
+    if prompt_before_create and user in _declined:
+        return False
+
+    if prompt_before_create and not exec_obj.force and not exec_obj.dry_run:
+        confirm = terminal.ask(f"User '{user}' does not exist. Create it now? (y/N): ").lower()
+        if confirm != 'y':
+            log.warning(f"Skipping creation of user '{user}' at user's request.")
+            _declined.add(user)
+            return False
+
+    useradd_cmd = ['useradd', '-m']
+    if uid is not None:
+        if _uid_gid_available(exec_obj, uid):
+            useradd_cmd += ['-u', str(uid), '-U']
+        else:
+            log.warning(
+                f"uid/gid {uid} already in use (e.g. by another service); "
+                f"creating '{user}' with the next available uid/gid instead. "
+                "Not renumbering existing accounts."
+            )
+    useradd_cmd.append(user)
+
+    log.info(f"Creating user '{user}'...")
+    exec_obj.run(" ".join(useradd_cmd), force_sudo=True)
+    exec_obj.facts.refresh("users", "groups")
+    log.success(f"Created user '{user}'")
+    return True
 
 ADAM_UID: int = 1000
 
@@ -81,28 +79,18 @@ def add_user_to_group(exec_obj: Executor, user: str, group: str) -> None:
         log.warning(f"User '{user}' does not exist, cannot add to group '{group}'")
         return
 
-    # Check/create group (getent is idempotent check)
-    try:
-        subprocess.run(
-            ['getent', 'group', group],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-    except subprocess.CalledProcessError:
+    # Check/create group
+    if not exec_obj.facts.group_exists(group):
         log.info(f"Creating group '{group}'...")
         exec_obj.run(f"groupadd -f {group}", force_sudo=True)
     
-    # Check if user is already in the group (id -nG is idempotent check)
-    try:
-        result = subprocess.run(['id', '-nG', user], capture_output=True, text=True, check=True)
-        if group in result.stdout.split():
-            log.info(f"User '{user}' already in group '{group}'")
-            return
-    except subprocess.CalledProcessError:
-        log.warning(f"Failed to check groups for user {user}. Attempting to add anyway.")
+    # Check if user is already in the group
+    if group in exec_obj.facts.user_groups(user):
+        log.info(f"User '{user}' already in group '{group}'")
+        return
 
     exec_obj.run(f"usermod -aG {group} {user}", force_sudo=True)
+    exec_obj.facts.refresh("groups")
     log.success(f"Added user '{user}' to group '{group}'")
 
 def users_to_groups_if_needed(exec_obj: Executor, user: str, groups: List[str]) -> None:
@@ -115,11 +103,8 @@ def create_if_needed_ssh_dir(exec_obj: Executor, user: str) -> str:
     """Creates the user's .ssh directory with correct permissions and ownership (Idempotent)."""
     
     try:
-        homedir_result = subprocess.run(
-            ['getent', 'passwd', user], capture_output=True, text=True, check=True
-        )
-        homedir = homedir_result.stdout.strip().split(':')[5]
-    except Exception as e:
+        homedir = exec_obj.facts.home(user)
+    except KeyError as e:
         log.error(f"Failed to get homedir for {user}: {e}")
         raise
         
@@ -140,8 +125,8 @@ def _merge_and_deduplicate_keys(existing_keys_path: str, new_keys_content: str)
     
     # 1. Read existing keys (if file exists)
     existing_keys: Set[str] = set()
-    if os.path.exists(existing_keys_path):
-        with open(existing_keys_path, 'r') as f:
+    if os.path.exists(host_path(existing_keys_path)):
+        with open(host_path(existing_keys_path), 'r') as f:
             for line in f:
                 stripped = line.strip()
                 # Store non-comment keys in the set
@@ -186,14 +171,14 @@ def install_mapped_ssh_keys(exec_obj: Executor, user: str) -> None:
     
     # Download keys from all mapped GitHub accounts
     for account in accounts:
-        url = f"https://github.com/{account}.keys"
+        url = GITHUB_KEYS_URL.format(account=account)
         log.info(f"Downloading keys from {url}...")
         
         # Use curl to download content to memory
         try:
             # We use check=False to continue fetching even if one account URL fails (e.g., 404)
             # We are relying on -f (fail silently) and -s (silent) from curl
-            result = exec_obj.run(f"curl -fsSL \"{url}\"", check=False, run_quiet=True)
+            result = exec_obj.run(fetch_command(url), check=False, run_quiet=True)
             if result.returncode == 0 and result.stdout.strip():
                 all_downloaded_keys += result.stdout.strip() + "\n"
             else:
@@ -217,9 +202,9 @@ def install_mapped_ssh_keys(exec_obj: Executor, user: str) -> None:
 
     # --- Idempotency Check: Write only if content has changed ---
     current_content = ""
-    if os.path.exists(auth_keys):
+    if os.path.exists(host_path(auth_keys)):
         # Read current content for comparison
-        with open(auth_keys, 'r') as f:
+        with open(host_path(auth_keys), 'r') as f:
             current_content = f.read()
             
     # Check if content has changed (ignoring surrounding whitespace/trailing newlines)
@@ -228,16 +213,7 @@ def install_mapped_ssh_keys(exec_obj: Executor, user: str) -> None:
         return
         
     log.info(f"Writing updated and deduplicated authorized_keys for {user}...")
-    
-    with tempfile.NamedTemporaryFile(mode='w', prefix='authorized_keys_', delete=False) as tmp:
-        tmp.write(final_content)
-        temp_final_file = tmp.name
-
-    exec_obj.run(f"mv \"{temp_final_file}\" \"{auth_keys}\"", force_sudo=True)
-    
-    # Fix permissions/ownership (Idempotent fix)
-    exec_obj.run(f"chmod 600 {auth_keys}", force_sudo=True)
-    exec_obj.run(f"chown {user}:{user} {auth_keys}", force_sudo=True)
+    exec_obj.write_file(auth_keys, final_content, 0o600, owner=f"{user}:{user}")
     log.success(f"Installed/Updated SSH keys for {user}, duplicates removed.")
 
 
@@ -247,29 +223,32 @@ def install_root_ssh_keys(exec_obj: Executor) -> None:
 
 # --- Sudoers ---
 
-def setup_sudoers_staff(exec_obj: Executor, file: str = "/etc/sudoers.d/staff") -> None:
+SUDOERS_STAFF_FILE: str = "/etc/sudoers.d/staff"
+SUDOERS_STAFF_CONTENT: str = "%staff ALL=(ALL:ALL) NOPASSWD: ALL"
+
+def setup_sudoers_staff(exec_obj: Executor, file: str = SUDOERS_STAFF_FILE) -> None:
     """Installs the NOPASSWD sudoers file for the 'staff' group (Idempotent)."""
-    content = "%staff ALL=(ALL:ALL) NOPASSWD: ALL"
+    content = SUDOERS_STAFF_CONTENT
     
-    # Check if the file exists and contains the exact content
-    if os.path.exists(file):
+    # Check if the file exists with the exact content and mode (what --check compares)
+    if os.path.exists(host_path(file)):
         try:
-            with open(file, 'r') as f:
-                if content.strip() in f.read().strip():
-                    log.success(f"Sudoers file {file} already contains the correct content.")
-                else:
+            with open(host_path(file), 'r') as f:
+                mode = os.fstat(f.fileno()).st_mode & 0o777
+                if content.strip() not in f.read().strip():
                     log.info(f"Sudoers file {file} exists but content differs. Overwriting.")
                     # Fall through to write logic
+                elif mode != 0o440:
+                    log.info(f"Sudoers file {file} has mode {oct(mode)}, not 0o440. Rewriting.")
+                    # Fall through to write logic
+                else:
+                    log.success(f"Sudoers file {file} already contains the correct content.")
+                    return
         except Exception:
              log.warning(f"Could not read {file}. Overwriting to ensure correctness.")
              # Fall through to write logic
     
     log.info(f"Installing sudoers file: {file}")
     
-    # Write the content using tee (handles privilege)
-    cmd_write = f"echo \"{content}\" | tee {file} > /dev/null"
-    exec_obj.run(cmd_write, force_sudo=True)
-    
-    # Fix permissions
-    exec_obj.run(f"chmod 440 {file}", force_sudo=True)
+    exec_obj.write_file(file, content + "\n", 0o440)
     log.success(f"Sudoers file {file} installed and permissions set to 440")
\ No newline at end of file
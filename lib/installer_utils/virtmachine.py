@@ -1,12 +1,16 @@
-import shutil
 import os
-import subprocess
 from typing import Optional, Tuple
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path
 from ..constants import VM_PACKAGES, DEFAULT_VM_USER
 from .apt_tools import apt_install
 
+FSTAB_FILE: str = "/etc/fstab"
+FSTAB_LINE_VIRTIO: str = (
+    "share /mnt/utm 9p trans=virtio,version=9p2000.L,rw,_netdev,nofail,auto 0 0"
+)
+
 # --- New Helper Function for ID Detection ---
 
 def _get_current_bindfs_ids(
@@ -40,6 +44,25 @@ def _get_current_bindfs_ids(
         return None, None
 
 
+def ensure_fstab_virtio(exec_obj: Executor) -> None:
+    """Ensures the 9p share's fstab entry exists (also the agent's reconcile step)."""
+    entry_exists = False
+    try:
+        with open(host_path(FSTAB_FILE), 'r') as f:
+            if any(FSTAB_LINE_VIRTIO.strip() == line.strip() for line in f):
+                entry_exists = True
+    except FileNotFoundError:
+        log.error(f"{FSTAB_FILE} not found. Cannot check/append fstab entry.")
+        raise
+
+    if entry_exists:
+        log.success("Initial fstab entry (9p) already present.")
+    else:
+        log.info(f"Adding initial fstab entry: {FSTAB_LINE_VIRTIO}")
+        exec_obj.run(f"echo \"{FSTAB_LINE_VIRTIO}\" >> {FSTAB_FILE}", force_sudo=True)
+        log.success("Initial fstab entry added.")
+
+
 # --- Main Function ---
 
 def setup_virtmachine(
@@ -48,17 +71,8 @@ def setup_virtmachine(
     """Handles VM guest package installation, fstab setup, and bindfs remapping."""
     log.info("Starting virtual machine setup...")
     
-    vm_type_check = shutil.which("systemd-detect-virt")
-    vm_type = ""
-    
-    # 1. Detect VM Type
-    # ... (VM detection logic remains the same, relies on --force if needed) ...
-    if vm_type_check:
-        try:
-            result = exec_obj.run("systemd-detect-virt 2>&1", check=False, run_quiet=True)
-            vm_type = result.stdout.strip()
-        except Exception:
-            log.debug("systemd-detect-virt unavailable; VM type unknown.")
+    # 1. Detect VM Type (systemd-detect-virt, from the facts snapshot)
+    vm_type = exec_obj.facts.virt
 
     log.debug(f"systemd-detect-virt reported: '{vm_type}'")
             
@@ -79,7 +93,7 @@ def setup_virtmachine(
     USER_MOUNT = f"/home/{vm_user}/utm"
     
     # 2. Create base mount directory
-    if not os.path.isdir(UTM_MOUNT):
+    if not os.path.isdir(host_path(UTM_MOUNT)):
         exec_obj.run(f"mkdir -p {UTM_MOUNT}", force_sudo=True)
         exec_obj.run(f"chown {vm_user}:{vm_user} {UTM_MOUNT}", force_sudo=True)
         log.success(f"Created UTM mount point: {UTM_MOUNT}")
@@ -107,25 +121,8 @@ def setup_virtmachine(
         )
         exec_obj.run("systemctl disable --now NetworkManager.service NetworkManager-wait-online.service", force_sudo=True)
 
-    # 5. Ensure fstab entry for the *initial* mount exists (unchanged)
-    FSTAB_LINE_VIRTIO = "share /mnt/utm 9p trans=virtio,version=9p2000.L,rw,_netdev,nofail,auto 0 0"
-    FSTAB_FILE = "/etc/fstab"
-    
-    entry_exists = False
-    try:
-        with open(FSTAB_FILE, 'r') as f:
-            if any(FSTAB_LINE_VIRTIO.strip() == line.strip() for line in f):
-                entry_exists = True
-    except FileNotFoundError:
-        log.error(f"{FSTAB_FILE} not found. Cannot check/append fstab entry.")
-        raise
-
-    if entry_exists:
-        log.success("Initial fstab entry (9p) already present.")
-    else:
-        log.info(f"Adding initial fstab entry: {FSTAB_LINE_VIRTIO}")
-        exec_obj.run(f"echo \"{FSTAB_LINE_VIRTIO}\" >> {FSTAB_FILE}", force_sudo=True)
-        log.success("Initial fstab entry added.")
+    # 5. Ensure fstab entry for the *initial* mount exists
+    ensure_fstab_virtio(exec_obj)
 
     # ------------------------------------------------------------------
     # 6. Bindfs Setup: Systemd Reload, Mount Check, and Remap Setup
@@ -151,12 +148,8 @@ def setup_virtmachine(
     mismatched_uid, mismatched_gid = _get_current_bindfs_ids(exec_obj, UTM_MOUNT)
 
     # Get the target user's local UID/GID (adam:adam is typically 1000:1000)
-    target_uid = subprocess.run(
-        ['id', '-u', vm_user], capture_output=True, text=True, check=True
-    ).stdout.strip()
-    target_gid = subprocess.run(
-        ['id', '-g', vm_user], capture_output=True, text=True, check=True
-    ).stdout.strip()
+    target_uid = exec_obj.facts.uid(vm_user)
+    target_gid = exec_obj.facts.gid(vm_user)
 
     # 6c. Create user mount point
     exec_obj.run(f"mkdir -p {USER_MOUNT}", force_sudo=True)
@@ -180,7 +173,7 @@ def setup_virtmachine(
     # Check/add bindfs fstab entry (similar idempotency logic)
     bindfs_entry_exists = False
     try:
-        with open(FSTAB_FILE, 'r') as f:
+        with open(host_path(FSTAB_FILE), 'r') as f:
             if any(FSTAB_LINE_BINDFS.strip() == line.strip() for line in f):
                 bindfs_entry_exists = True
     except Exception:
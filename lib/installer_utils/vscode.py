@@ -1,12 +1,14 @@
-import shutil
 import os
 from ..executor import Executor
 from ..logger import log
+from ..paths import host_path, which
+from ..constants import VSCODE_GPG_URL
+from ..prefetch import fetch_command
 from .apt_tools import apt_install, ensure_apt_repo
 
 def install_vscode(exec_obj: Executor) -> None:
     """Installs VSCode using the Microsoft APT repository, ensuring idempotency."""
-    if shutil.which("code"):
+    if which("code"):
         log.success("VSCode already installed.")
         return
 
@@ -14,16 +16,13 @@ def install_vscode(exec_obj: Executor) -> None:
     
     keyrings_dir = "/etc/apt/keyrings"
     gpg_path = os.path.join(keyrings_dir, "microsoft.gpg")
-    list_file = "/etc/apt/sources.list.d/vscode.list"
+    sources_file = "/etc/apt/sources.list.d/vscode.sources"
 
     exec_obj.run(f"mkdir -p {keyrings_dir}", force_sudo=True)
     
-    if not os.path.exists(gpg_path):
+    if not os.path.exists(host_path(gpg_path)):
         log.info("Adding Microsoft GPG key for VSCode.")
-        curl_cmd = (
-            "wget -qO- https://packages.microsoft.com/keys/microsoft.asc "
-            f"| gpg --dearmor | tee {gpg_path}"
-        )
+        curl_cmd = f"{fetch_command(VSCODE_GPG_URL)} | gpg --dearmor | tee {gpg_path}"
         exec_obj.run(curl_cmd, force_sudo=True)
     else:
         log.info("VSCode GPG key already exists.")
@@ -32,7 +31,7 @@ def install_vscode(exec_obj: Executor) -> None:
         f"deb [arch=amd64 signed-by={gpg_path}] "
         "https://packages.microsoft.com/repos/code stable main"
     )
-    ensure_apt_repo(exec_obj, list_file, repo_line)
+    ensure_apt_repo(exec_obj, sources_file, repo_line)
 
     apt_install(exec_obj, ["code"])
     log.success("VSCode installation complete.")
\ No newline at end of file
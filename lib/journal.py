@@ -0,0 +1,150 @@
+"""
+journal.py
+==========
+Run journal backing ``--resume``.  Every run records, per module, its
+status (running / done / failed), a hash of its inputs and the sub-steps
+it has completed.  ``--resume`` then skips modules that finished with the
+same inputs and restarts a failed module from its last completed sub-step.
+
+The journal lives at JOURNAL_FILE and every update is a locked
+read-modify-write, so ``--run-cmd`` children (e.g. ``setup_no2id``) can
+record sub-steps into the same file their parent is tracking.
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from .bundle import read_repo_file
+from .constants import JOURNAL_FILE, STATE_DIR
+from .executor import Executor
+from .paths import host_path
+
+# Flags that control *how* the orchestrator runs rather than *what* a module
+# does; changing them must not invalidate completed modules.
+_NON_INPUT_ARGS = {
+    "resume", "dry_run", "quiet", "verbose", "debug", "force", "no_prefetch",
+    "no_autoremove", "check", "check_output", "agent", "agent_debounce",
+    "fleet_inventory", "fleet_concurrency", "fleet_hosts",
+    "run_cmd", "run_args", "facts_file", "history", "history_context", "prefetched",
+    "gate_file", "root",
+    "report", "budget", "snapshot_export", "offline_bundle", "from_bundle", "apt_ttl",
+    "apt_proxy", "fast_dpkg",
+}
+
+DONE = "done"
+FAILED = "failed"
+RUNNING = "running"
+
+
+def input_hash(module: str, args: argparse.Namespace) -> str:
+    """
+    Hashes what a module's outcome depends on: the relevant CLI arguments
+    and the orchestrator's configuration (lib/constants.py).
+    """
+    relevant = {k: v for k, v in sorted(vars(args).items()) if k not in _NON_INPUT_ARGS}
+    h = hashlib.sha256(module.encode())
+    h.update(json.dumps(relevant, sort_keys=True, default=str).encode())
+    h.update(read_repo_file("lib/constants.py"))
+    return h.hexdigest()[:16]
+
+
+@contextmanager
+def _locked() -> Iterator[Dict[str, Any]]:
+    """Yields the journal for modification and writes it back atomically."""
+    state_dir, journal_file = host_path(STATE_DIR), host_path(JOURNAL_FILE)
+    os.makedirs(state_dir, exist_ok=True)
+    with open(journal_file + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = _read()
+        yield data
+        with tempfile.NamedTemporaryFile(
+            "w", dir=state_dir, prefix=".journal-", delete=False
+        ) as tmp:
+            json.dump(data, tmp, indent=2)
+            tmp_path = tmp.name
+        os.replace(tmp_path, journal_file)
+
+
+def _read() -> Dict[str, Any]:
+    try:
+        with open(host_path(JOURNAL_FILE)) as f:
+            data: Dict[str, Any] = json.load(f)
+            return data
+    except (FileNotFoundError, ValueError):
+        return {"modules": {}}
+
+
+def exists() -> bool:
+    return os.path.isfile(host_path(JOURNAL_FILE))
+
+
+def begin_run(exec_obj: Executor, resume: bool) -> None:
+    """Starts a new journal, or keeps the previous one when resuming."""
+    if exec_obj.dry_run:
+        return
+    with _locked() as data:
+        if not resume:
+            data.clear()
+            data["modules"] = {}
+        data["started"] = time.time()
+
+
+def is_done(module: str, digest: str) -> bool:
+    """True if *module* completed in the journalled run with the same inputs."""
+    entry = _read()["modules"].get(module, {})
+    return bool(entry.get("status") == DONE and entry.get("input_hash") == digest)
+
+
+def start_module(exec_obj: Executor, module: str, digest: str) -> None:
+    """
+    Marks *module* as running.  Completed sub-steps are kept only if the
+    inputs are unchanged, so a resumed module picks up where it failed.
+    """
+    if exec_obj.dry_run:
+        return
+    with _locked() as data:
+        previous = data["modules"].get(module, {})
+        steps: List[str] = previous.get("steps", []) if previous.get("input_hash") == digest else []
+        data["modules"][module] = {
+            "status": RUNNING,
+            "input_hash": digest,
+            "steps": steps,
+            "started": time.time(),
+        }
+
+
+def finish_module(exec_obj: Executor, module: str, ok: bool) -> None:
+    if exec_obj.dry_run:
+        return
+    with _locked() as data:
+        entry = data["modules"].setdefault(module, {})
+        entry["status"] = DONE if ok else FAILED
+        entry["finished"] = time.time()
+
+
+def step_done(module: str, step: str) -> bool:
+    """True if *step* of the currently running *module* was already completed."""
+    entry = _read()["modules"].get(module, {})
+    return bool(entry.get("status") == RUNNING and step in entry.get("steps", []))
+
+
+def mark_step(exec_obj: Executor, module: str, step: str) -> None:
+    """Records a completed sub-step of *module*."""
+    if exec_obj.dry_run:
+        return
+    with _locked() as data:
+        steps = data["modules"].setdefault(module, {}).setdefault("steps", [])
+        if step not in steps:
+            steps.append(step)
+
+
+def summary() -> Dict[str, str]:
+    """Module -> status of the journalled run (for logging)."""
+    return {name: entry.get("status", "?") for name, entry in _read()["modules"].items()}
@@ -1,6 +1,8 @@
 import logging
 import sys
-from typing import Any
+from typing import Any, TextIO
+
+from . import terminal
 
 SUCCESS = 25
 logging.addLevelName(SUCCESS, "SUCCESS")
@@ -33,6 +35,14 @@ EMOJI_ERR = "❌"
 EMOJI_DEBUG = "🔎"
 EMOJI_PACKAGE = "📦" # Used for module start banners
 
+class TerminalHandler(logging.StreamHandler):  # type: ignore[type-arg]
+    """StreamHandler that writes under the process-local output lock (see terminal.py)."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        with terminal.owner():
+            super().emit(record)
+
+
 class CustomFormatter(logging.Formatter):
     """Custom Formatter that adds colors and emojis based on log level."""
     
@@ -51,15 +61,20 @@ class CustomFormatter(logging.Formatter):
         return formatter.format(record)
 
 
-def configure_logger(quiet: bool = False, verbose: bool = False) -> CustomLogger:
-    """Sets up the global logger with custom formatting and handles quiet/verbose flags."""
+def configure_logger(
+    quiet: bool = False, verbose: bool = False, stream: TextIO = sys.stdout
+) -> CustomLogger:
+    """
+    Sets up the global logger with custom formatting and handles quiet/verbose
+    flags.  *stream* is sys.stderr when stdout carries machine-readable output.
+    """
     
     logger = logging.getLogger("MachineSetup")
     assert isinstance(logger, CustomLogger)  # noqa: S101
     logger.setLevel(logging.DEBUG)
     logger.propagate = False
 
-    handler = logging.StreamHandler(sys.stdout)
+    handler = TerminalHandler(stream)
     handler.setFormatter(CustomFormatter())
 
     if quiet:
@@ -99,11 +114,12 @@ def log_module_start(module_name: str, exec_obj: Any) -> None:
     # Fill the remaining space with BANNER_CHARs for the header and footer
     outer_line = BANNER_CHAR * WIDTH
 
-    # Print the result
-    print("\n" + outer_line)
-    # Print the inner line centered within the total width
-    print(f"{BOLD}{CYAN}{inner_line.center(WIDTH, BANNER_CHAR)}{RESET}")
-    print(outer_line + "\n")
+    # Print the result (as one block, even with concurrent modules)
+    with terminal.owner():
+        print("\n" + outer_line)
+        # Print the inner line centered within the total width
+        print(f"{BOLD}{CYAN}{inner_line.center(WIDTH, BANNER_CHAR)}{RESET}", flush=True)
+        print(outer_line + "\n", flush=True)
 
 
 log: CustomLogger = logging.getLogger("MachineSetup")  # type: ignore[assignment]
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+metrics.py
+==========
+Prometheus textfiles for node_exporter's textfile collector
+(METRICS_TEXTFILE_DIR), so provisioning and reconcile performance can be
+graphed across the fleet.
+
+* ``machine_setup.prom`` — written at the end of every real run, from the
+  run's history record: per-module duration, success and command count,
+  bytes downloaded, packages installed, repos updated and the last
+  successful run.
+* ``machine_setup_agent.prom`` — rewritten by ``--agent`` after each
+  reconcile pass.
+
+Files are replaced atomically (node_exporter may read at any moment) and
+only written if the collector directory exists.  Like the history,
+metrics are best-effort and never fail a run.
+"""
+
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from . import history
+from .constants import METRICS_TEXTFILE_DIR
+from .executor import Executor
+from .logger import log
+from .paths import host_path
+
+RUN_TEXTFILE: str = "machine_setup.prom"
+AGENT_TEXTFILE: str = "machine_setup_agent.prom"
+
+_PREFIX = "machine_setup"
+
+# (name, type, help)
+_Family = Tuple[str, str, str]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    # Full precision: timestamps don't survive %g
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Exposition:
+    """Collects samples and renders them in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._families: Dict[_Family, List[Tuple[Dict[str, str], float]]] = {}
+
+    def add(self, name: str, kind: str, help_text: str, value: float,
+            **labels: str) -> None:
+        self._families.setdefault((name, kind, help_text), []).append((labels, value))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for (name, kind, help_text), samples in self._families.items():
+            # node_exporter parses the Prometheus text format, where a
+            # counter's TYPE/HELP carry the same _total name as its samples
+            full = f"{_PREFIX}_{name}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{full}{label_text} {_number(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _write_textfile(name: str, text: str) -> None:
+    directory = host_path(METRICS_TEXTFILE_DIR)
+    if not os.path.isdir(directory):
+        log.debug(f"Metrics: {METRICS_TEXTFILE_DIR} doesn't exist; not writing {name}.")
+        return
+    try:
+        # Same directory so the rename is atomic; node_exporter ignores non-.prom files
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, prefix=f".{name}-", delete=False
+        ) as tmp:
+            tmp.write(text)
+            tmp_path = tmp.name
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except OSError as e:
+        log.debug(f"Metrics: could not write {name}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Run metrics
+# ---------------------------------------------------------------------------
+
+def write_run_metrics(exec_obj: Executor, packages_before: Dict[str, str]) -> None:
+    """
+    Exports the run that just ended (no-op for runs that weren't recorded).
+    *packages_before* is the package list from before any module ran.
+    """
+    record = history.run_record()
+    if record is None:
+        return
+    exec_obj.facts.refresh("packages")
+    packages_after = exec_obj.facts.packages
+
+    exp = _Exposition()
+    finished = record.finished or time.time()
+    exp.add("run_timestamp_seconds", "gauge",
+            "When the last run finished.", finished)
+    exp.add("run_duration_seconds", "gauge",
+            "Wall-clock duration of the last run.", finished - record.started)
+    exp.add("run_success", "gauge",
+            "1 if the last run completed, 0 if a module failed.", float(bool(record.ok)))
+    if record.last_success is not None:
+        exp.add("last_success_timestamp_seconds", "gauge",
+                "When the last successful run finished.", record.last_success)
+
+    for m in record.modules:
+        exp.add("module_duration_seconds", "gauge",
+                "Duration of each module in the last run.", m.duration, module=m.module)
+        exp.add("module_success", "gauge",
+                "1 if the module succeeded in the last run.", float(m.ok), module=m.module)
+        exp.add("module_commands", "gauge",
+                "Subprocesses each module ran in the last run.", m.commands, module=m.module)
+
+    exp.add("commands", "gauge",
+            "Subprocesses run by the last run (including delegated modules).", record.commands)
+    exp.add("downloaded_bytes", "gauge",
+            "Bytes downloaded by the last run's prefetch phase.",
+            record.counters.get("downloaded_bytes", 0))
+    exp.add("packages_installed", "gauge",
+            "Packages newly installed by the last run.",
+            len(packages_after.keys() - packages_before.keys()))
+    exp.add("repos_updated", "gauge",
+            "Git checkouts cloned or fetched by the last run.",
+            record.counters.get("repos_updated", 0))
+
+    _write_textfile(RUN_TEXTFILE, exp.render())
+
+
+# ---------------------------------------------------------------------------
+# Agent metrics
+# ---------------------------------------------------------------------------
+
+RECONCILE_RESULTS: Tuple[str, ...] = ("clean", "reconciled", "failed")
+
+
+@dataclass
+class ReconcileStats:
+    """Per-module reconcile outcomes accumulated by a running agent."""
+
+    counts: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    last_duration: Dict[str, float] = field(default_factory=dict)
+    last_reconciled: Dict[str, float] = field(default_factory=dict)
+    drift_items: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, module: str, result: str, duration: float, drift_items: int) -> None:
+        self.counts[(module, result)] = self.counts.get((module, result), 0) + 1
+        self.last_duration[module] = duration
+        self.drift_items[module] = drift_items
+        if result == "reconciled":
+            self.last_reconciled[module] = time.time()
+
+
+def write_agent_metrics(stats: ReconcileStats, modules: List[str],
+                        started: Optional[float] = None) -> None:
+    """Exports the agent's reconcile counters for *modules*."""
+    exp = _Exposition()
+    if started is not None:
+        exp.add("agent_start_timestamp_seconds", "gauge",
+                "When the agent started.", started)
+    for module in modules:
+        for result in RECONCILE_RESULTS:
+            exp.add("agent_reconciles", "counter",
+                    "Drift checks by module and result (clean, reconciled, failed).",
+                    stats.counts.get((module, result), 0), module=module, result=result)
+    for module, duration in sorted(stats.last_duration.items()):
+        exp.add("agent_reconcile_duration_seconds", "gauge",
+                "Duration of each module's most recent check/reconcile.", duration,
+                module=module)
+    for module, items in sorted(stats.drift_items.items()):
+        exp.add("agent_drift_items", "gauge",
+                "Drift items found by each module's most recent check.", items, module=module)
+    for module, when in sorted(stats.last_reconciled.items()):
+        exp.add("agent_last_reconcile_timestamp_seconds", "gauge",
+                "When each module was last reconciled.", when, module=module)
+    _write_textfile(AGENT_TEXTFILE, exp.render())
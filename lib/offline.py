@@ -0,0 +1,492 @@
+"""
+offline.py
+==========
+Offline provisioning bundles for slow or metered links.
+
+``--offline-bundle FILE`` (with the usual module flags) collects every
+artifact those modules need into one archive: GPG keys and install
+scripts, git bundles of the public and deploy-key repos, the ``.deb``
+closure of their apt packages plus the apt lists that resolve it, Docker
+images (``docker save``) and Ollama model blobs.  ``--from-bundle FILE``
+then provisions from it without touching the network:
+
+* file artifacts are streamed straight out of the archive
+  (``fetch_command``), never copied to disk,
+* git bundles become the prefetch phase's bare mirrors, which clones and
+  fetches then use instead of the remote,
+* ``.deb`` files go into apt's archive cache and the bundled lists replace
+  ``apt update``,
+* images and models are loaded when the module that needs them runs.
+
+Archive layout
+--------------
+::
+
+    header    MAGIC, version, entry count, index offset, manifest offset/length
+    blobs     each 4 KiB-aligned (so copy_file_range can reflink them)
+    index     one record per entry, sorted by key:
+              sha256("kind\\0source"), offset, length, sha256(content)
+    manifest  JSON: the OS it was built on and every entry's kind/source/module
+
+The archive is mmap'd and lookups binary-search the fixed-size index
+records in place; content is hashed straight from the mapping and copied
+out with ``os.copy_file_range`` (kernel-side, no userspace copy).  Every
+blob is verified against its sha256 before it is used.
+
+Installers that download their own payload (Tailscale's and Ollama's
+install.sh) still need the network.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import platform
+import shlex
+import shutil
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import prefetch
+from .constants import APT_ARCHIVES_DIR, APT_LISTS_DIR, HWGA_REPOS
+from .executor import Executor
+from .logger import log
+from .paths import host_path, which
+from .prefetch import Artifact
+
+MAGIC: bytes = b"MSOFFL\x00\x01"
+VERSION: int = 1
+# magic, version, count, index offset, manifest offset, manifest length
+_HEADER = struct.Struct("<8sIIQQQ")
+# key, offset, length, content sha256
+_RECORD = struct.Struct("<32sQQ32s")
+_ALIGN: int = 4096
+
+# Where the Linux service keeps models (the first existing one is used)
+OLLAMA_MODEL_DIRS: List[str] = ["/usr/share/ollama/.ollama/models", "/root/.ollama/models"]
+# Modules whose repos need deploy keys (never in the prefetch cache)
+_PRIVATE_MODULES: Set[str] = {"no2id"}
+
+
+@dataclass(frozen=True)
+class Entry:
+    offset: int
+    length: int
+    sha256: bytes
+
+
+def _key(kind: str, source: str) -> bytes:
+    return hashlib.sha256(f"{kind}\0{source}".encode()).digest()
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+class OfflineBundle:
+    """A read-only, memory-mapped offline bundle."""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        # Kept open for as long as the mapping (copy_file_range reads from it)
+        self._file = open(self.path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self._count, self._index_offset, manifest_offset, manifest_length = (
+                _HEADER.unpack_from(self._mm, 0)
+            )
+        except (ValueError, OSError, struct.error) as e:
+            self._file.close()
+            raise ValueError(f"{path} is not an offline bundle: {e}") from e
+        if magic != MAGIC or version != VERSION:
+            self._file.close()
+            raise ValueError(f"{path} is not an offline bundle (version {VERSION}).")
+        self.manifest: Dict[str, Any] = json.loads(
+            self._mm[manifest_offset:manifest_offset + manifest_length]
+        )
+        self._verified: Set[int] = set()
+
+    def _record_key(self, i: int) -> bytes:
+        start = self._index_offset + i * _RECORD.size
+        return self._mm[start:start + 32]
+
+    def find(self, kind: str, source: str) -> Optional[Entry]:
+        """The entry for (*kind*, *source*): a binary search over the mapped index."""
+        key = _key(kind, source)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self._count or self._record_key(lo) != key:
+            return None
+        _, offset, length, digest = _RECORD.unpack_from(
+            self._mm, self._index_offset + lo * _RECORD.size
+        )
+        return Entry(offset, length, digest)
+
+    def sources(self, kind: str) -> List[str]:
+        return [e["source"] for e in self.manifest["entries"] if e["kind"] == kind]
+
+    def verify(self, entry: Entry) -> bool:
+        """Checks *entry*'s content against its sha256 (hashed from the mapping, once)."""
+        if entry.offset in self._verified:
+            return True
+        view = memoryview(self._mm)[entry.offset:entry.offset + entry.length]
+        try:
+            ok = hashlib.sha256(view).digest() == entry.sha256
+        finally:
+            view.release()
+        if ok:
+            self._verified.add(entry.offset)
+        return ok
+
+    def extract(self, entry: Entry, dest: str) -> None:
+        """Copies *entry* to *dest* in the kernel (reflinked where the filesystem can)."""
+        with open(dest, "wb") as out:
+            offset, left = entry.offset, entry.length
+            while left:
+                try:
+                    copied = os.copy_file_range(self._file.fileno(), out.fileno(), left, offset)
+                except OSError:
+                    # e.g. across filesystems on older kernels
+                    copied = os.sendfile(out.fileno(), self._file.fileno(), offset, left)
+                if copied == 0:
+                    raise OSError(f"{self.path} is truncated")
+                offset += copied
+                left -= copied
+
+    def stream_command(self, entry: Entry) -> str:
+        """A shell snippet that writes *entry* to stdout, read straight from the archive."""
+        return f"tail -c +{entry.offset + 1} {shlex.quote(self.path)} | head -c {entry.length}"
+
+
+_BUNDLE: Optional[OfflineBundle] = None
+# In a delegated child of an offline run that can't read the bundle: its path
+_UNREADABLE: Optional[str] = None
+
+
+def use(path: str) -> OfflineBundle:
+    """Switches this run to offline mode, reading artifacts from the bundle at *path*."""
+    global _BUNDLE
+    _BUNDLE = OfflineBundle(path)
+    return _BUNDLE
+
+
+def attach(path: str) -> None:
+    """
+    In a delegated child of a ``--from-bundle`` run: offline too.  The
+    bundle is usually root-only, so if this user can't open it the child
+    stays offline and works from the mirrors the parent restored (handed
+    over with ``--prefetched``).
+    """
+    global _UNREADABLE
+    try:
+        use(path)
+    except (OSError, ValueError) as e:
+        log.debug(f"Offline bundle not readable here ({e}); using the restored mirrors only.")
+        _UNREADABLE = path
+
+
+def active() -> bool:
+    """True when running from a bundle (apt update and remote git are skipped)."""
+    return _BUNDLE is not None or _UNREADABLE is not None
+
+
+def context_arg() -> Optional[str]:
+    """The ``--from-bundle`` value for a delegated child, if this run is offline."""
+    return _BUNDLE.path if _BUNDLE is not None else _UNREADABLE
+
+
+def _verified(kind: str, source: str) -> Optional[Entry]:
+    if _BUNDLE is None:
+        return None
+    entry = _BUNDLE.find(kind, source)
+    if entry is None:
+        return None
+    if not _BUNDLE.verify(entry):
+        log.error(f"Offline bundle: {kind} {source} failed its sha256 check; not using it.")
+        return None
+    return entry
+
+
+def file_command(url: str) -> Optional[str]:
+    """The bundled copy of *url* as a stdout stream, or None (see prefetch.fetch_command)."""
+    entry = _verified("file", url)
+    if _BUNDLE is None or entry is None:
+        return None
+    return _BUNDLE.stream_command(entry)
+
+
+def load_image(exec_obj: Executor, image: str, user: Optional[str] = None) -> bool:
+    """Loads *image* from the bundle into (*user*'s) Docker; False if it isn't bundled."""
+    entry = _verified("image", image)
+    if _BUNDLE is None or entry is None:
+        return False
+    with tempfile.TemporaryDirectory(prefix="machine-setup-image-") as tmp:
+        archive = os.path.join(tmp, "image.tar")
+        _BUNDLE.extract(entry, archive)
+        if user:
+            # The docker CLI runs as the (possibly rootless) stack user
+            shutil.chown(tmp, user)
+            shutil.chown(archive, user)
+        exec_obj.run(["docker", "load", "-i", archive], user=user, force_sudo=user is None)
+    log.success(f"Loaded image {image} from the offline bundle.")
+    return True
+
+
+def load_model(exec_obj: Executor, model: str) -> bool:
+    """Unpacks *model*'s manifest and blobs into Ollama's store; False if it isn't bundled."""
+    entry = _verified("model", model)
+    if _BUNDLE is None or entry is None:
+        return False
+    models_dir = next(
+        (d for d in OLLAMA_MODEL_DIRS if os.path.isdir(host_path(d))), OLLAMA_MODEL_DIRS[0]
+    )
+    exec_obj.run(f"mkdir -p {models_dir}", force_sudo=True)
+    exec_obj.run(f"{_BUNDLE.stream_command(entry)} | tar -x -C {models_dir}", force_sudo=True)
+    if exec_obj.facts.user_exists("ollama") and models_dir.startswith("/usr/share/ollama"):
+        exec_obj.run(f"chown -R ollama:ollama {models_dir}", force_sudo=True)
+    log.success(f"Installed model {model} from the offline bundle.")
+    return True
+
+
+def restore(exec_obj: Executor, artifacts: List[Artifact]) -> None:
+    """
+    The offline prefetch phase: git mirrors, the apt archive cache and apt
+    lists are laid down from the bundle (files, images and models are read
+    on demand).
+    """
+    assert _BUNDLE is not None  # noqa: S101
+    bundle = _BUNDLE
+    info = bundle.manifest
+    facts = exec_obj.facts
+    if (info["os_id"], info["codename"]) != (facts.os_id, facts.codename):
+        message = (
+            f"Offline bundle was built on {info['os_id']} {info['codename']}, "
+            f"this host is {facts.os_id} {facts.codename}"
+        )
+        if not exec_obj.force:
+            raise ValueError(f"{message} (use --force to use it anyway).")
+        log.warning(f"{message}; its packages may not install.")
+
+    if exec_obj.dry_run:
+        log.info(f"[DRY-RUN] Would restore {len(info['entries'])} artifact(s) from {bundle.path}")
+        return
+
+    missing = [a.source for a in artifacts if a.kind in ("file", "git", "image", "model")
+               and bundle.find(a.kind, a.source) is None]
+    if missing:
+        log.warning(f"Not in the offline bundle (will need the network): {', '.join(missing)}")
+
+    start = time.monotonic()
+    restored = 0
+    for url in bundle.sources("git"):
+        entry = _verified("git", url)
+        mirror = prefetch.git_mirror_path(url)
+        if entry is None or os.path.isdir(host_path(mirror)):
+            prefetch.mark_fresh(url)
+            continue
+        os.makedirs(host_path(os.path.dirname(mirror)), exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="machine-setup-git-") as tmp:
+            git_bundle = os.path.join(tmp, "repo.bundle")
+            bundle.extract(entry, git_bundle)
+            exec_obj.run(["git", "clone", "--mirror", "--quiet", git_bundle, mirror],
+                         run_quiet=True)
+        exec_obj.run(["git", "-C", mirror, "remote", "set-url", "origin", url], run_quiet=True)
+        prefetch.mark_fresh(url)
+        restored += 1
+
+    debs = bundle.sources("deb")
+    for name in debs:
+        entry = _verified("deb", name)
+        dest = host_path(os.path.join(APT_ARCHIVES_DIR, name))
+        if entry is not None and not os.path.isfile(dest):
+            bundle.extract(entry, dest)
+            restored += 1
+    lists = _verified("apt-lists", APT_LISTS_DIR)
+    if lists is not None:
+        exec_obj.run(f"{bundle.stream_command(lists)} | tar -x -C {APT_LISTS_DIR}",
+                     force_sudo=True)
+        restored += 1
+
+    log.success(
+        f"Offline bundle: {restored} artifact(s) restored ({len(debs)} packages cached) "
+        f"in {time.monotonic() - start:.1f}s."
+    )
+
+
+# ---------------------------------------------------------------------------
+# Building
+# ---------------------------------------------------------------------------
+
+def _deb_closure(exec_obj: Executor, packages: List[str]) -> List[str]:
+    """*packages* plus everything they depend on (a fresh host may have none of it)."""
+    result = exec_obj.run(
+        ["apt-cache", "depends", "--recurse", "--no-recommends", "--no-suggests",
+         "--no-conflicts", "--no-breaks", "--no-replaces", "--no-enhances"] + packages,
+        check=False, run_quiet=True,
+    )
+    # Dependency lines are indented; virtual packages appear as <name>
+    names = {line.strip() for line in result.stdout.splitlines() if line and not line[0].isspace()}
+    return sorted(n for n in names if not n.startswith("<"))
+
+
+def _stage_model(exec_obj: Executor, model: str, dest: str) -> bool:
+    """Tars *model*'s manifest and blobs (relative to the models dir) into *dest*."""
+    name, _, tag = model.partition(":")
+    if "/" not in name:
+        name = f"library/{name}"
+    manifest_rel = os.path.join("manifests", "registry.ollama.ai", name, tag or "latest")
+    for models_dir in OLLAMA_MODEL_DIRS:
+        manifest_path = os.path.join(models_dir, manifest_rel)
+        if os.path.isfile(manifest_path):
+            break
+    else:
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    layers = [manifest["config"]] + manifest.get("layers", [])
+    members = [manifest_rel] + [
+        os.path.join("blobs", layer["digest"].replace(":", "-")) for layer in layers
+    ]
+    exec_obj.run(["tar", "-cf", dest, "-C", models_dir] + members, run_quiet=True)
+    return True
+
+
+def _stage(exec_obj: Executor, artifacts: List[Artifact], staging: str
+           ) -> List[Dict[str, str]]:
+    """Fetches each artifact into *staging*; returns the staged kind/source/module/path."""
+    staged: List[Dict[str, str]] = []
+
+    def add(artifact: Artifact, path: str, source: Optional[str] = None) -> None:
+        staged.append({"kind": artifact.kind, "source": source or artifact.source,
+                       "module": artifact.module, "path": path})
+
+    # Files and public repos go through the normal prefetch cache first
+    prefetch.prefetch(exec_obj, [a for a in artifacts if a.kind in ("file", "git")
+                                 and a.module not in _PRIVATE_MODULES])
+    local_checkouts = {str(c["url"]): str(c["dest"]) for c in HWGA_REPOS.values()}
+
+    for i, artifact in enumerate(artifacts):
+        path = os.path.join(staging, f"{i:04d}")
+        try:
+            if artifact.kind == "file":
+                cached = prefetch.cached_file(artifact.source)
+                if cached:
+                    add(artifact, cached)
+            elif artifact.kind == "git":
+                repo = prefetch.git_mirror(artifact.source)
+                checkout = local_checkouts.get(artifact.source)
+                if not repo and checkout and os.path.isdir(os.path.join(checkout, ".git")):
+                    repo = checkout  # deploy-key repo: bundle the local checkout
+                if repo:
+                    exec_obj.run(["git", "-c", f"safe.directory={repo}", "-C", repo,
+                                  "bundle", "create", path, "--all"], run_quiet=True)
+                    add(artifact, path)
+            elif artifact.kind == "image" and which("docker"):
+                exec_obj.run(["docker", "pull", "--quiet", artifact.source],
+                             force_sudo=True, run_quiet=True)
+                exec_obj.run(["docker", "save", "-o", path, artifact.source],
+                             force_sudo=True, run_quiet=True)
+                add(artifact, path)
+            elif artifact.kind == "model":
+                if _stage_model(exec_obj, artifact.source, path):
+                    add(artifact, path)
+            elif artifact.kind == "apt-lists":
+                exec_obj.run(["tar", "-cf", path, "-C", artifact.source,
+                              "--exclude=lock", "--exclude=partial", "."], run_quiet=True)
+                add(artifact, path)
+        except Exception as e:
+            log.warning(f"Bundle: could not stage {artifact.kind} {artifact.source}: {e}")
+
+    debs = [a for a in artifacts if a.kind == "deb"]
+    if debs:
+        deb_dir = os.path.join(staging, "debs")
+        os.makedirs(deb_dir)
+        closure = _deb_closure(exec_obj, [a.source for a in debs])
+        log.info(f"Bundle: downloading {len(closure)} packages (with dependencies)...")
+        exec_obj.run(["apt-get", "download", "-q"] + closure, cwd=deb_dir, check=False,
+                     run_quiet=True)
+        for name in sorted(os.listdir(deb_dir)):
+            if name.endswith(".deb"):
+                add(Artifact("deb", name, "packages"), os.path.join(deb_dir, name))
+    return staged
+
+
+def _align(f: Any) -> None:
+    pad = -f.tell() % _ALIGN
+    if pad:
+        f.write(b"\0" * pad)
+
+
+def build(exec_obj: Executor, path: str, artifacts: List[Artifact]) -> bool:
+    """Builds the offline bundle for *artifacts* at *path*; False if nothing was staged."""
+    if exec_obj.dry_run:
+        for artifact in artifacts:
+            log.info(f"[DRY-RUN] Bundle {artifact.kind}: {artifact.source}")
+        return True
+
+    with tempfile.TemporaryDirectory(prefix="machine-setup-bundle-") as staging:
+        staged = _stage(exec_obj, artifacts, staging)
+        if not staged:
+            log.error("Nothing could be staged for the offline bundle.")
+            return False
+
+        records: List[Tuple[bytes, int, int, bytes]] = []
+        entries: List[Dict[str, Any]] = []
+        # Holds deploy-key repos: written to a temp file that is 0600 from
+        # creation, then renamed into place (never readable by others)
+        out = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(path)), prefix=".bundle-", delete=False
+        )
+        try:
+            with out:
+                out.write(b"\0" * _HEADER.size)
+                for item in staged:
+                    _align(out)
+                    offset = out.tell()
+                    h = hashlib.sha256()
+                    with open(item["path"], "rb") as src:
+                        for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                            h.update(chunk)
+                            out.write(chunk)
+                    length = out.tell() - offset
+                    records.append((_key(item["kind"], item["source"]), offset, length, h.digest()))
+                    entries.append({"kind": item["kind"], "source": item["source"],
+                                    "module": item["module"], "size": length})
+
+                records.sort()
+                _align(out)
+                index_offset = out.tell()
+                for record in records:
+                    out.write(_RECORD.pack(*record))
+                manifest = json.dumps({
+                    "created": time.time(),
+                    "os_id": exec_obj.facts.os_id,
+                    "codename": exec_obj.facts.codename,
+                    "arch": platform.machine(),
+                    "entries": entries,
+                }).encode()
+                manifest_offset = out.tell()
+                out.write(manifest)
+                out.seek(0)
+                out.write(_HEADER.pack(MAGIC, VERSION, len(records), index_offset,
+                                       manifest_offset, len(manifest)))
+            os.replace(out.name, path)
+        finally:
+            if os.path.exists(out.name):
+                os.unlink(out.name)
+
+    kinds: Dict[str, int] = {}
+    for item in staged:
+        kinds[item["kind"]] = kinds.get(item["kind"], 0) + 1
+    summary = ", ".join(f"{count} {kind}" for kind, count in kinds.items())
+    log.success(f"Offline bundle written to {path}: {summary} "
+                f"({os.path.getsize(path) / 1024 / 1024:.1f} MiB).")
+    return True
@@ -0,0 +1,64 @@
+"""
+paths.py
+========
+Host path resolution.  Modules read, write and probe host files through
+``host_path()`` rather than opening absolute paths directly, so
+``--root PATH`` can point a whole run at a scratch directory: with a root
+of ``/tmp/t``, ``host_path("/etc/fstab")`` is ``/tmp/t/etc/fstab``.
+
+Paths that end up inside shell commands are left as host paths; under
+``--root`` those commands go to the stub backend (see stubs.py) and are
+recorded, not run.
+
+Deliberately imports nothing from lib/ so constants.py and facts.py can use it.
+"""
+
+import os
+import shutil
+from typing import Optional
+
+_ROOT: str = "/"
+
+
+def set_root(path: str) -> None:
+    """Redirects every host path into *path* (``/`` restores the real host)."""
+    global _ROOT
+    _ROOT = os.path.abspath(path)
+
+
+def root() -> str:
+    return _ROOT
+
+
+def is_alternate() -> bool:
+    """True when running against an alternate root rather than the real host."""
+    return _ROOT != "/"
+
+
+def host_path(path: str) -> str:
+    """Maps an absolute host path into the current root (identity on the real host)."""
+    if _ROOT == "/" or not os.path.isabs(path):
+        return path
+    return os.path.join(_ROOT, path.lstrip("/"))
+
+
+def which(name: str) -> Optional[str]:
+    """
+    shutil.which() against the current root.  Returns the host path
+    (e.g. ``/usr/bin/docker``) so it can be used in commands either way.
+    """
+    if _ROOT == "/":
+        return shutil.which(name)
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        candidate = os.path.join(directory, name)
+        mapped = host_path(candidate)
+        if os.path.isfile(mapped) and os.access(mapped, os.X_OK):
+            return candidate
+    return None
+
+
+def chown(path: str, uid: int, gid: int) -> None:
+    """os.chown() on a host path; a no-op under an alternate root when not run as root."""
+    if _ROOT != "/" and os.geteuid() != 0:
+        return
+    os.chown(host_path(path), uid, gid)
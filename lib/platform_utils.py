@@ -1,9 +1,9 @@
 import platform
 import os
 import pwd
-import shutil
 from typing import Any, Dict
 from .logger import log
+from .paths import which
 
 OS: str = platform.system().lower()
 is_mac: bool = OS == "darwin"
@@ -29,7 +29,7 @@ def is_ubuntu_desktop() -> bool:
     if not DISPLAY_VAR:
         return False
     
-    return shutil.which("gnome-shell") is not None
+    return which("gnome-shell") is not None
 
 def get_real_user() -> str:
     """
@@ -0,0 +1,369 @@
+"""
+prefetch.py
+===========
+Up-front download phase.  Works out every remote artifact the selected
+modules will need, fetches them all concurrently into PREFETCH_CACHE_DIR
+before any module mutates the host, and lets modules read them back from
+local disk during the apply phase.
+
+Artifact kinds
+--------------
+* ``file``  — GPG keys, install scripts, GitHub ``.keys``.  Cached under
+  ``files/`` and re-validated with ``If-Modified-Since`` on later runs.
+* ``git``   — public repos.  Kept as bare mirrors under ``git/``; clones use
+  ``--reference-if-able`` + ``--dissociate`` and updates fetch from the
+  mirror, so the apply phase never waits on the network for them.
+* ``image`` — Docker images, pulled into Docker's own store (only when
+  Docker is already installed).
+* ``model`` — Ollama models, pulled into Ollama's own store (only when
+  Ollama is already installed).
+* ``deb``   — the distro packages the planned modules will install, resolved
+  in one ``apt-get --print-uris`` pass and downloaded into apt's archive
+  cache (see apt_tools.prefetch_debs); packages from repos a module adds
+  itself (Docker CE, VS Code) are downloaded when that module installs them.
+
+Private (deploy-key) repos are not prefetched: their keys may not be
+authorised yet and they are cloned as their owning user.
+"""
+
+import argparse
+import email.utils
+import hashlib
+import os
+import shlex
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from .constants import (
+    APT_LISTS_DIR,
+    DOCKER_GPG_URL,
+    DOCKER_PKGS,
+    FIREWALL_PACKAGES,
+    GITHUB_KEYS_URL,
+    HWGA_REPOS,
+    OLLAMA_DEFAULT_MODEL,
+    OLLAMA_INSTALL_URL,
+    OPEN_WEBUI_IMAGE,
+    PERSONAL_GITHUB_REPOS,
+    PREFETCH_CACHE_DIR,
+    PREFETCH_WORKERS,
+    ROOTLESS_DOCKER_DEPS,
+    STANDARD_PACKAGES,
+    SYSTEM_REPOS,
+    TAILSCALE_INSTALL_URL,
+    USER_GITHUB_KEY_MAP,
+    VM_PACKAGES,
+    VSCODE_GPG_URL,
+)
+from . import history
+from .executor import Executor
+from .logger import log
+
+_FILES_DIR: str = os.path.join(PREFETCH_CACHE_DIR, "files")
+_GIT_DIR: str = os.path.join(PREFETCH_CACHE_DIR, "git")
+_DOWNLOAD_TIMEOUT: int = 60
+
+# Sources refreshed by *this* run's prefetch phase.  Only these are served
+# from the cache: a copy left over from an earlier run (e.g. a since-revoked
+# GitHub key, or a mirror behind upstream) must never be used silently.
+_FRESH: Set[str] = set()
+
+
+@dataclass(frozen=True)
+class Artifact:
+    """A single remote dependency of a module."""
+
+    kind: str  # "file" | "git" | "image" | "model" (offline bundles: "deb" | "apt-lists")
+    source: str  # URL, image reference or model name
+    module: str
+
+
+# ---------------------------------------------------------------------------
+# Cache lookups (used by modules during the apply phase)
+# ---------------------------------------------------------------------------
+
+def _cache_key(source: str) -> str:
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def file_cache_path(url: str) -> str:
+    """Returns where *url* is (or would be) cached on disk."""
+    basename = os.path.basename(url.rstrip("/")) or "index"
+    return os.path.join(_FILES_DIR, f"{_cache_key(url)}-{basename}")
+
+
+def git_mirror_path(url: str) -> str:
+    """Returns where the bare mirror for *url* is (or would be) kept."""
+    name = os.path.basename(url.rstrip("/"))
+    if not name.endswith(".git"):
+        name += ".git"
+    return os.path.join(_GIT_DIR, f"{_cache_key(url)}-{name}")
+
+
+def cached_file(url: str) -> Optional[str]:
+    """Returns the cached copy of *url* if the prefetch phase fetched it."""
+    path = file_cache_path(url)
+    return path if url in _FRESH and os.path.isfile(path) else None
+
+
+def git_mirror(url: str) -> Optional[str]:
+    """Returns the local bare mirror of *url* if the prefetch phase created it."""
+    path = git_mirror_path(url)
+    return path if url in _FRESH and os.path.isdir(path) else None
+
+
+def mark_fresh(source: str) -> None:
+    """Lets modules use the cached copy of *source* (restored from an offline bundle)."""
+    _FRESH.add(source)
+
+
+def fresh_sources() -> List[str]:
+    """What this run may use from the cache, for a delegated child (``--prefetched``)."""
+    return sorted(_FRESH)
+
+
+def fetch_command(url: str) -> str:
+    """
+    Returns a shell snippet that writes the content of *url* to stdout:
+    the offline bundle's copy or ``cat`` of the cached copy when available,
+    otherwise ``curl``.  Drop-in replacement for ``curl -fsSL <url>`` in
+    piped commands.
+    """
+    from . import offline
+
+    bundled = offline.file_command(url)
+    if bundled:
+        log.debug(f"Using the offline bundle's copy of {url}")
+        return bundled
+    cached = cached_file(url)
+    if cached:
+        log.debug(f"Using prefetched copy of {url}: {cached}")
+        return f"cat {shlex.quote(cached)}"
+    return f"curl -fsSL {shlex.quote(url)}"
+
+
+# ---------------------------------------------------------------------------
+# Manifest: what each selected module will need
+# ---------------------------------------------------------------------------
+
+def collect_artifacts(
+    exec_obj: Executor, tasks: Dict[str, bool], args: argparse.Namespace,
+    offline: bool = False,
+) -> List[Artifact]:
+    """
+    Builds the de-duplicated artifact list for the selected modules.  With
+    *offline* (building a bundle for another host) nothing is skipped for
+    being installed here, and deploy-key repos and apt packages are added.
+    """
+    from .installer_utils.module_wolfcraig import GHOST_DOCKER_REPO_URL, WOLFCRAIG_REPO_URL
+    from .platform_utils import is_linux
+
+    def missing(binary: str) -> bool:
+        return offline or not shutil.which(binary)
+
+    artifacts: List[Artifact] = []
+
+    if tasks.get("root_ssh_keys"):
+        for user in ("root", "adam"):
+            for account in USER_GITHUB_KEY_MAP.get(user, "").split():
+                artifacts.append(
+                    Artifact("file", GITHUB_KEYS_URL.format(account=account), "root_ssh_keys")
+                )
+
+    if tasks.get("packages"):
+        artifacts.append(
+            Artifact("git", SYSTEM_REPOS["update-all-the-packages"]["url"], "packages")
+        )
+
+    if tasks.get("cloud_init"):
+        for config in SYSTEM_REPOS.values():
+            artifacts.append(Artifact("git", config["url"], "cloud_init"))
+
+    if tasks.get("tailscale") and missing("tailscale"):
+        artifacts.append(Artifact("file", TAILSCALE_INSTALL_URL, "tailscale"))
+
+    if tasks.get("docker") and missing("docker"):
+        os_id = exec_obj.facts.os_id
+        if os_id:
+            artifacts.append(Artifact("file", DOCKER_GPG_URL.format(os_id=os_id), "docker"))
+
+    if tasks.get("wolfcraig"):
+        artifacts.append(Artifact("git", WOLFCRAIG_REPO_URL, "wolfcraig"))
+        artifacts.append(Artifact("git", GHOST_DOCKER_REPO_URL, "wolfcraig"))
+
+    for key, config in PERSONAL_GITHUB_REPOS.items():
+        task_key = key.replace("-", "_")
+        if tasks.get("personal_repos") or tasks.get(task_key):
+            artifacts.append(Artifact("git", config["url"], "personal_repos"))
+
+    if tasks.get("ollama"):
+        if is_linux and missing("ollama"):
+            artifacts.append(Artifact("file", OLLAMA_INSTALL_URL, "ollama"))
+        artifacts.append(Artifact("image", OPEN_WEBUI_IMAGE, "ollama"))
+        model = getattr(args, "ollama_model", None) or OLLAMA_DEFAULT_MODEL
+        artifacts.append(Artifact("model", model, "ollama"))
+
+    if exec_obj.facts.desktop and missing("code"):
+        artifacts.append(Artifact("file", VSCODE_GPG_URL, "desktop"))
+
+    if not offline:
+        from .installer_utils.apt_tools import planned_packages
+
+        planned = [key for key, enabled in tasks.items() if enabled]
+        planned += ["vm"] if getattr(args, "do_vm", False) else []
+        planned += ["desktop"] if exec_obj.facts.desktop else []
+        for module, names in planned_packages(exec_obj, planned, args).items():
+            artifacts += [Artifact("deb", name, module) for name in names]
+    else:
+        if tasks.get("no2id"):
+            for config in HWGA_REPOS.values():
+                artifacts.append(Artifact("git", str(config["url"]), "no2id"))
+        apt_packages = {
+            "packages": STANDARD_PACKAGES,
+            "docker": DOCKER_PKGS + ROOTLESS_DOCKER_DEPS,
+            "firewall": FIREWALL_PACKAGES,
+            "vm": VM_PACKAGES,
+        }
+        selected = dict(tasks, vm=bool(getattr(args, "do_vm", False)))
+        for module, names in apt_packages.items():
+            if selected.get(module):
+                artifacts += [Artifact("deb", name, module) for name in names]
+        if any(a.kind == "deb" for a in artifacts):
+            artifacts.append(Artifact("apt-lists", APT_LISTS_DIR, "packages"))
+
+    # De-duplicate by source while preserving order (e.g. a repo needed by two modules)
+    unique: Dict[str, Artifact] = {}
+    for artifact in artifacts:
+        unique.setdefault(artifact.source, artifact)
+    return list(unique.values())
+
+
+# ---------------------------------------------------------------------------
+# Fetchers
+# ---------------------------------------------------------------------------
+
+def _fetch_file(exec_obj: Executor, url: str) -> int:
+    """Downloads *url* into the cache (conditional GET). Returns bytes downloaded."""
+    dest = file_cache_path(url)
+    request = urllib.request.Request(url, headers={"User-Agent": "machine-setup"})  # noqa: S310
+    if os.path.isfile(dest):
+        mtime = os.path.getmtime(dest)
+        request.add_header("If-Modified-Since", email.utils.formatdate(mtime, usegmt=True))
+
+    try:
+        with urllib.request.urlopen(request, timeout=_DOWNLOAD_TIMEOUT) as resp:  # nosec B310  # noqa: S310
+            data: bytes = resp.read()
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            log.info(f"Prefetch: {url} unchanged (cached).")
+            _FRESH.add(url)
+            return 0
+        raise
+
+    with tempfile.NamedTemporaryFile(dir=_FILES_DIR, delete=False) as tmp:
+        tmp.write(data)
+        tmp_path = tmp.name
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, dest)
+    _FRESH.add(url)
+    log.info(f"Prefetch: {url} ({len(data)} bytes)")
+    return len(data)
+
+
+def _fetch_git(exec_obj: Executor, url: str) -> int:
+    """Creates or refreshes a bare mirror of *url*."""
+    mirror = git_mirror_path(url)
+    if os.path.isdir(mirror):
+        exec_obj.run(["git", "-C", mirror, "remote", "update", "--prune"], run_quiet=True)
+    else:
+        exec_obj.run(["git", "clone", "--mirror", "--quiet", url, mirror], run_quiet=True)
+    _FRESH.add(url)
+    log.info(f"Prefetch: mirrored {url}")
+    return 0
+
+
+def _fetch_image(exec_obj: Executor, image: str) -> int:
+    if not shutil.which("docker"):
+        log.debug(f"Prefetch: docker not installed yet; {image} will be pulled later.")
+        return 0
+    exec_obj.run(["docker", "pull", "--quiet", image], force_sudo=True, run_quiet=True)
+    log.info(f"Prefetch: pulled image {image}")
+    return 0
+
+
+def _fetch_model(exec_obj: Executor, model: str) -> int:
+    from .installer_utils.module_ollama import _find_ollama_bin
+
+    ollama_bin = _find_ollama_bin()
+    if not ollama_bin:
+        log.debug(f"Prefetch: ollama not installed yet; {model} will be pulled later.")
+        return 0
+    exec_obj.run([ollama_bin, "pull", model], run_quiet=True)
+    log.info(f"Prefetch: pulled model {model}")
+    return 0
+
+
+_FETCHERS = {
+    "file": _fetch_file,
+    "git": _fetch_git,
+    "image": _fetch_image,
+    "model": _fetch_model,
+}
+
+
+def _fetch_one(exec_obj: Executor, artifact: Artifact) -> int:
+    try:
+        return _FETCHERS[artifact.kind](exec_obj, artifact.source)
+    except Exception as e:
+        # Never fatal: the module falls back to fetching it itself.
+        log.warning(f"Prefetch failed for {artifact.source} ({artifact.module}): {e}")
+        return 0
+
+
+def _fetch_debs(exec_obj: Executor, artifacts: List[Artifact]) -> int:
+    """Downloads the .debs of the *artifacts* packages as one transaction would."""
+    from .installer_utils.apt_tools import plan_transaction, prefetch_debs
+
+    try:
+        # Against the current lists: a .deb they no longer match is left to apt
+        plan = plan_transaction(exec_obj, [a.source for a in artifacts])
+        prefetch_debs(exec_obj, plan.downloads)
+    except Exception as e:
+        log.warning(f"Prefetch failed for the distro packages: {e}")
+    return 0  # prefetch_debs() counts its own downloaded_bytes
+
+
+def prefetch(exec_obj: Executor, artifacts: List[Artifact]) -> None:
+    """Fetches every artifact concurrently into the local cache."""
+    if not artifacts:
+        log.info("Prefetch: nothing to download for the selected modules.")
+        return
+
+    if exec_obj.dry_run:
+        for artifact in artifacts:
+            log.info(f"[DRY-RUN] Prefetch {artifact.kind}: {artifact.source}")
+        return
+
+    os.makedirs(_FILES_DIR, exist_ok=True)
+    os.makedirs(_GIT_DIR, exist_ok=True)
+
+    log.info(f"Prefetching {len(artifacts)} artifact(s) with {PREFETCH_WORKERS} workers...")
+    start = time.monotonic()
+    debs = [a for a in artifacts if a.kind == "deb"]
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as pool:
+        # The .debs are one job: a single transaction resolves them all
+        deb_job = pool.submit(_fetch_debs, exec_obj, debs) if debs else None
+        others = [a for a in artifacts if a.kind != "deb"]
+        downloaded = sum(pool.map(lambda a: _fetch_one(exec_obj, a), others))
+        downloaded += deb_job.result() if deb_job else 0
+    history.count("downloaded_bytes", downloaded)
+    log.success(
+        f"Prefetch complete: {len(artifacts)} artifact(s), {downloaded} bytes "
+        f"in {time.monotonic() - start:.1f}s."
+    )
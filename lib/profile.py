@@ -0,0 +1,250 @@
+"""
+profile.py
+==========
+Declarative host profiles (``--profile host.toml``).  A profile selects
+modules and their parameters, and can override the repo tables in
+lib/constants.py, instead of a long flag list.
+
+Example
+-------
+    [modules]
+    packages = true
+    docker = true
+    vm = true
+
+    [docker]
+    user = "adam"
+    rootful = false
+
+    [ollama]
+    port = 11435
+    model = "llama3.2"
+
+    [hwga_repos.herewegoagain]
+    dest = "/srv/herewegoagain"       # overrides one key of the built-in entry
+
+    [personal_repos.my-tool]
+    url = "https://github.com/adamamyl/my-tool.git"
+
+The profile is validated and compiled into a plan (argparse defaults plus
+the merged repo tables).  Compiled plans are cached in PROFILE_CACHE_DIR,
+keyed by the hash of the profile and of lib/constants.py, so repeated runs
+with an unchanged profile skip resolution and validation entirely.
+
+Command-line flags still win: the plan only supplies argparse defaults.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import tomllib
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import constants
+from .bundle import read_repo_file
+from .constants import PROFILE_CACHE_DIR
+from .logger import log
+
+# Bump when the compiled plan layout changes, so old cache entries are ignored.
+_PLAN_VERSION: int = 1
+
+# [modules] name -> argparse dest
+_MODULES: Dict[str, str] = {
+    "all": "all",
+    "root_ssh_keys": "do_root_ssh_keys",
+    "packages": "do_packages",
+    "sudoers": "do_sudoers",
+    "tailscale": "do_tailscale",
+    "docker": "do_docker",
+    "cloud_init": "do_cloud_init",
+    "firewall": "do_firewall",
+    "apt_cache": "do_apt_cache",
+    "no2id": "do_no2id",
+    "pseudohome": "do_pseudohome",
+    "fake_le": "do_fake_le",
+    "wolfcraig": "do_wolfcraig",
+    "personal_repos": "do_personal_repos",
+    "traefik_proxy": "do_traefik_proxy",
+    "dracula": "do_dracula",
+    "docker_dns_reso": "do_docker_dns_reso",
+    "ollama": "do_ollama",
+    "vm": "do_vm",
+}
+
+# [section] key -> (argparse dest, expected type)
+_PARAMS: Dict[str, Dict[str, Tuple[str, type]]] = {
+    "docker": {"user": ("docker_user", str), "rootful": ("do_docker_rootful", bool)},
+    "vm": {"user": ("vm_user", str), "force": ("do_vm_force", bool)},
+    "ollama": {
+        "port": ("ollama_port", int),
+        "webui_port": ("webui_port", int),
+        "model": ("ollama_model", str),
+        "user": ("ollama_user", str),
+    },
+    "fake_le": {
+        "debug": ("fake_le_debug", bool),
+        "dry_run": ("fake_le_dry_run", bool),
+        "force": ("fake_le_force", bool),
+        "ca_install": ("do_fake_le_ca_install", bool),
+    },
+    "options": {
+        "no_autoremove": ("no_autoremove", bool),
+        "no_prefetch": ("no_prefetch", bool),
+        "apt_proxy": ("apt_proxy", str),
+        "fast_dpkg": ("fast_dpkg", bool),
+    },
+}
+
+# Repo tables a profile may extend/override: section -> (allowed keys, keys new entries need)
+_REPO_TABLES: Dict[str, Tuple[Dict[str, type], List[str]]] = {
+    "hwga_repos": (
+        {
+            "user": str, "group": str, "url": str, "dest": str, "installer": str,
+            "extra_flags": str, "dotenv_sync": bool, "enabled": bool,
+        },
+        ["user", "url", "dest", "installer"],
+    ),
+    "personal_repos": (
+        {"url": str, "group": str, "enabled": bool},
+        ["url"],
+    ),
+}
+
+_CONSTANT_TABLES: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "hwga_repos": constants.HWGA_REPOS,
+    "personal_repos": constants.PERSONAL_GITHUB_REPOS,
+}
+
+
+def _type_ok(value: Any, expected: type) -> bool:
+    # bool is a subclass of int; don't let `port = true` through
+    if expected is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, expected)
+
+
+def _compile(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validates a parsed profile and resolves it into a plan. Raises ValueError."""
+    errors: List[str] = []
+    args: Dict[str, Any] = {}
+    tables: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    known = {"modules", *_PARAMS, *_REPO_TABLES}
+    for section in data:
+        if section not in known:
+            errors.append(f"unknown section [{section}]")
+
+    for name, enabled in data.get("modules", {}).items():
+        if name not in _MODULES:
+            errors.append(f"[modules] unknown module '{name}'")
+        elif not isinstance(enabled, bool):
+            errors.append(f"[modules] {name} must be true or false")
+        else:
+            args[_MODULES[name]] = enabled
+
+    for section, params in _PARAMS.items():
+        for key, value in data.get(section, {}).items():
+            if key not in params:
+                errors.append(f"[{section}] unknown key '{key}'")
+                continue
+            dest, expected = params[key]
+            if not _type_ok(value, expected):
+                errors.append(f"[{section}] {key} must be of type {expected.__name__}")
+                continue
+            args[dest] = value
+
+    for section, (allowed, required) in _REPO_TABLES.items():
+        merged = copy.deepcopy(_CONSTANT_TABLES[section])
+        for name, entry in data.get(section, {}).items():
+            if not isinstance(entry, dict):
+                errors.append(f"[{section}.{name}] must be a table")
+                continue
+            for key, value in entry.items():
+                if key not in allowed:
+                    errors.append(f"[{section}.{name}] unknown key '{key}'")
+                elif not _type_ok(value, allowed[key]):
+                    errors.append(
+                        f"[{section}.{name}] {key} must be of type {allowed[key].__name__}"
+                    )
+            if entry.get("enabled", True) is False:
+                merged.pop(name, None)
+                continue
+            combined = {**merged.get(name, {}), **entry}
+            combined.pop("enabled", None)
+            missing = [k for k in required if k not in combined]
+            if missing:
+                errors.append(f"[{section}.{name}] missing {', '.join(missing)}")
+            merged[name] = combined
+        tables[section] = merged
+
+    if errors:
+        raise ValueError("Invalid host profile:\n  " + "\n  ".join(errors))
+
+    return {"version": _PLAN_VERSION, "args": args, "tables": tables}
+
+
+def _cache_key(raw: bytes) -> str:
+    h = hashlib.sha256(raw)
+    h.update(read_repo_file("lib/constants.py"))
+    h.update(str(_PLAN_VERSION).encode())
+    return h.hexdigest()
+
+
+def _read_cached(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            plan: Dict[str, Any] = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return plan if plan.get("version") == _PLAN_VERSION else None
+
+
+def _write_cached(path: str, plan: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(PROFILE_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=PROFILE_CACHE_DIR, prefix=".plan-", delete=False
+        ) as tmp:
+            json.dump(plan, tmp)
+            tmp_path = tmp.name
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # Not being able to cache (e.g. not root yet) only costs a recompile.
+        log.debug(f"Could not cache compiled profile plan: {e}")
+
+
+def load_plan(path: str) -> Dict[str, Any]:
+    """
+    Returns the compiled plan for the profile at *path*, from the cache when
+    the profile (and lib/constants.py) are unchanged.  Raises ValueError on
+    an invalid profile and OSError if it can't be read.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    cache_path = os.path.join(PROFILE_CACHE_DIR, f"{_cache_key(raw)}.json")
+    plan = _read_cached(cache_path)
+    if plan is not None:
+        return plan
+
+    try:
+        data = tomllib.loads(raw.decode())
+    except tomllib.TOMLDecodeError as e:
+        raise ValueError(f"Invalid host profile {path}: {e}") from e
+
+    plan = _compile(data)
+    _write_cached(cache_path, plan)
+    return plan
+
+
+def apply_tables(tables: Dict[str, Dict[str, Dict[str, Any]]]) -> None:
+    """
+    Installs a plan's repo tables in place of the built-in constants.
+    Mutates the dicts in place so modules that imported them see the change.
+    """
+    for section, table in tables.items():
+        target = _CONSTANT_TABLES[section]
+        target.clear()
+        target.update(table)
@@ -0,0 +1,232 @@
+"""
+reconcile.py
+============
+Long-running agent mode (``--agent``).  Watches the files the modules manage
+with inotify and, when one changes, re-runs only the owning module's
+reconcile step.  Steady-state cost is a process blocked in ``poll()``.
+
+* Parent directories are watched (not the files themselves) so that
+  editors which save via rename, and deleted-then-recreated files, are seen.
+* Bursts of events are debounced: the agent waits until the watched paths
+  have been quiet for ``debounce`` seconds before acting.
+* A module is only reconciled if its drift check reports drift on one of its
+  watched paths, so the agent's own writes don't trigger it again.
+* Each pass's outcomes are exported for node_exporter (see metrics.py).
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from . import metrics
+from .constants import FIREWALL_SCRIPT_DEST
+from .executor import Executor
+from .logger import log
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+_READ_SIZE = 64 * 1024
+
+DEFAULT_DEBOUNCE_SECONDS: float = 2.0
+
+
+@dataclass
+class Watch:
+    """A managed path and the module whose reconcile step restores it."""
+
+    path: str
+    module: str
+
+
+def _watches() -> List[Watch]:
+    from .installer_utils.module_docker import DOCKER_APT_LIST
+    from .installer_utils.module_firewall import FIREWALL_SERVICE_PATH
+    from .installer_utils.user_mgmt import SUDOERS_STAFF_FILE
+    from .installer_utils.virtmachine import FSTAB_FILE
+
+    return [
+        Watch(SUDOERS_STAFF_FILE, "sudoers"),
+        Watch(DOCKER_APT_LIST, "docker"),
+        Watch(FIREWALL_SCRIPT_DEST, "firewall"),
+        Watch(FIREWALL_SERVICE_PATH, "firewall"),
+        Watch(FSTAB_FILE, "vm"),
+    ]
+
+
+def _reconcilers() -> Dict[str, Callable[[Executor], None]]:
+    from .installer_utils import module_docker, module_firewall, user_mgmt, virtmachine
+
+    return {
+        "sudoers": user_mgmt.setup_sudoers_staff,
+        "docker": module_docker.ensure_docker_apt_repo,
+        "firewall": module_firewall.reconcile_firewall,
+        "vm": virtmachine.ensure_fstab_virtio,
+    }
+
+
+# Modules the agent can watch, for argument validation and the default set.
+AGENT_MODULES: List[str] = ["sudoers", "docker", "firewall", "vm"]
+
+
+class Inotify:
+    """Minimal ctypes wrapper around inotify_init1/inotify_add_watch."""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd: int = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self._dirs: Dict[int, str] = {}
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+
+    def add_watch(self, directory: str) -> None:
+        wd = self._add_watch(self.fd, directory.encode(), _WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch({directory}): {os.strerror(errno)}")
+        self._dirs[wd] = directory
+
+    def read(self, timeout: Optional[float]) -> Optional[Set[str]]:
+        """
+        Waits up to *timeout* seconds (forever if None) and returns the paths
+        that changed, an empty set on timeout, or None on queue overflow.
+        """
+        ms = None if timeout is None else int(timeout * 1000)
+        if not self._poll.poll(ms):
+            return set()
+
+        data = os.read(self.fd, _READ_SIZE)
+        changed: Set[str] = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if wd in self._dirs and name:
+                changed.add(os.path.join(self._dirs[wd], name))
+        return changed
+
+    def wait_for_changes(self, debounce: float) -> Optional[Set[str]]:
+        """Blocks until something changes, then until things go quiet for *debounce*s."""
+        changed = self.read(None)
+        while changed:
+            more = self.read(debounce)
+            if more is None:
+                return None
+            if not more:
+                break
+            changed |= more
+        return changed
+
+    def drain(self) -> None:
+        """Discards pending events (e.g. caused by our own reconcile writes)."""
+        while self.read(0):
+            pass
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def _reconcile(exec_obj: Executor, module: str, paths: Set[str]) -> Tuple[str, int]:
+    """
+    Runs *module*'s reconcile step if its drift check flags one of *paths*.
+    Returns the outcome (one of metrics.RECONCILE_RESULTS) and the drift found.
+    """
+    from .drift import CHECKS
+
+    try:
+        drift = [d for d in CHECKS[module](exec_obj.facts) if d.item in paths]
+    except Exception as e:
+        log.error(f"Agent: drift check for '{module}' failed: {e}")
+        return "failed", 0
+
+    if not drift:
+        log.debug(f"Agent: '{module}' unchanged after file events; nothing to do.")
+        return "clean", 0
+
+    for d in drift:
+        log.warning(f"Agent: drift in '{module}': {d.kind} {d.item} {d.detail}".rstrip())
+    try:
+        _reconcilers()[module](exec_obj)
+        log.success(f"Agent: '{module}' reconciled.")
+        return "reconciled", len(drift)
+    except Exception as e:
+        # Keep watching; the next change (or restart) gets another attempt.
+        log.error(f"Agent: reconcile of '{module}' failed: {e}")
+        return "failed", len(drift)
+
+
+def run_agent(
+    exec_obj: Executor, modules: List[str], debounce: float = DEFAULT_DEBOUNCE_SECONDS
+) -> None:
+    """Watches the managed files for *modules* and reconciles them on change. Never returns."""
+    watches = [w for w in _watches() if w.module in modules]
+    if not watches:
+        log.error(f"Agent: nothing to watch for modules {modules}.")
+        return
+
+    paths_by_module: Dict[str, Set[str]] = {}
+    for w in watches:
+        paths_by_module.setdefault(w.module, set()).add(w.path)
+    module_by_path = {w.path: w.module for w in watches}
+
+    inotify = Inotify()
+    try:
+        for directory in sorted({os.path.dirname(w.path) for w in watches}):
+            try:
+                inotify.add_watch(directory)
+            except OSError as e:
+                log.warning(f"Agent: cannot watch {directory}: {e}")
+
+        log.info(
+            f"Agent: watching {len(watches)} path(s) for {', '.join(sorted(paths_by_module))} "
+            f"(debounce {debounce:g}s)."
+        )
+
+        # Converge once on start-up, then only on change.
+        pending: Set[str] = set(paths_by_module)
+        stats = metrics.ReconcileStats()
+        started = time.time()
+        while True:
+            for module in sorted(pending):
+                t0 = time.monotonic()
+                result, drift_items = _reconcile(exec_obj, module, paths_by_module[module])
+                stats.record(module, result, time.monotonic() - t0, drift_items)
+            metrics.write_agent_metrics(stats, sorted(paths_by_module), started)
+            inotify.drain()
+
+            changed = inotify.wait_for_changes(debounce)
+            if changed is None:
+                log.warning("Agent: inotify queue overflowed; re-checking every module.")
+                pending = set(paths_by_module)
+            else:
+                pending = {module_by_path[p] for p in changed if p in module_by_path}
+                if pending:
+                    log.info(f"Agent: change detected in {', '.join(sorted(changed))}")
+    finally:
+        inotify.close()
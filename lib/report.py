@@ -0,0 +1,207 @@
+"""
+report.py
+=========
+``--report run.html``: a self-contained HTML Gantt chart of a run, built
+from the run's history record (the same per-command timings the Executor
+records for ``--history``).
+
+Every module and every command is a bar on a shared timeline, coloured by
+resource class (apt, docker, git, network, human wait, other).  Bars that
+overlapped in time (concurrent modules, delegated children) are packed
+into separate lanes.  No scripts or external assets: hover a bar for the
+full command, its duration and exit status.
+"""
+
+import html
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import history
+from .history import Span, Timeline
+from .logger import log
+
+# Resource classes, checked in order: a command is in the first class with
+# a program among its words (so "curl ... | gpg" is network, "git clone" is git).
+_CLASS_PROGRAMS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("apt", ("apt", "apt-get", "apt-cache", "dpkg", "dpkg-query", "add-apt-repository")),
+    ("docker", ("docker", "docker-compose", "dockerd-rootless-setuptool.sh")),
+    ("git", ("git",)),
+    ("network", ("curl", "wget", "ssh", "ssh-keyscan", "scp", "rsync", "tailscale", "ollama")),
+]
+_COLOURS: Dict[str, str] = {
+    "module": "#56b4e9",
+    "apt": "#e69f00",
+    "docker": "#0072b2",
+    "git": "#d55e00",
+    "network": "#009e73",
+    "human wait": "#cc79a7",
+    "other": "#999999",
+}
+_TICK_STEPS: Tuple[int, ...] = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600)
+
+_STYLE = """
+body { font: 13px/1.4 system-ui, sans-serif; margin: 1.5em; color: #222; }
+h1 { font-size: 1.3em; margin: 0 0 .2em; }
+.meta { color: #555; margin-bottom: 1em; }
+.legend span { display: inline-block; margin-right: 1.2em; }
+.legend i { display: inline-block; width: .9em; height: .9em; margin-right: .3em;
+            vertical-align: -.1em; border-radius: 2px; }
+.row { display: flex; align-items: stretch; border-top: 1px solid #eee; }
+.name { flex: 0 0 11em; padding: 2px .5em 2px 0; font-weight: 600; overflow: hidden;
+        text-overflow: ellipsis; white-space: nowrap; }
+.lanes { flex: 1; position: relative; }
+.lane { position: relative; height: 18px; margin: 2px 0; }
+.bar { position: absolute; top: 0; height: 18px; min-width: 2px; border-radius: 2px;
+       color: #fff; font-size: 11px; line-height: 18px; padding: 0 3px; box-sizing: border-box;
+       overflow: hidden; white-space: nowrap; text-overflow: ellipsis; }
+.bar.failed { outline: 2px solid #c00; }
+.axis { position: relative; height: 1.4em; color: #777; font-size: 11px; }
+.axis span { position: absolute; transform: translateX(-50%); }
+.grid { position: absolute; top: 0; bottom: 0; border-left: 1px dashed #e4e4e4; }
+"""
+
+
+def _classify(command: str) -> str:
+    words = {os.path.basename(w.strip("'\"")) for w in command.replace("|", " ").split()}
+    for name, programs in _CLASS_PROGRAMS:
+        if words.intersection(programs):
+            return name
+    return "other"
+
+
+def _format_duration(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    minutes, secs = divmod(seconds, 60)
+    return f"{int(minutes)}m{secs:04.1f}s" if minutes else f"{secs:.1f}s"
+
+
+def _tick_label(seconds: int) -> str:
+    minutes, secs = divmod(seconds, 60)
+    return f"{minutes}m{secs:02d}s" if minutes else f"{secs}s"
+
+
+def _pack(spans: List[Span]) -> List[List[Span]]:
+    """Assigns overlapping spans to separate lanes (greedy interval partitioning)."""
+    lanes: List[List[Span]] = []
+    ends: List[float] = []
+    for span in sorted(spans, key=lambda s: s.started):
+        for i, end in enumerate(ends):
+            if span.started >= end:
+                lanes[i].append(span)
+                ends[i] = span.started + span.duration
+                break
+        else:
+            lanes.append([span])
+            ends.append(span.started + span.duration)
+    return lanes
+
+
+class _Chart:
+    def __init__(self, origin: float, total: float) -> None:
+        self.origin = origin
+        self.total = max(total, 0.001)
+
+    def _pct(self, t: float) -> float:
+        return max(0.0, min(100.0, (t - self.origin) / self.total * 100))
+
+    def bar(self, span: Span, kind: str) -> str:
+        left = self._pct(span.started)
+        width = max(self._pct(span.started + span.duration) - left, 0.0)
+        tip = f"{span.label}\n{_format_duration(span.duration)}"
+        if not span.ok:
+            tip += "\nFAILED"
+        classes = "bar" if span.ok else "bar failed"
+        return (
+            f'<div class="{classes}" style="left:{left:.3f}%;width:{width:.3f}%;'
+            f'background:{_COLOURS[kind]}" title="{html.escape(tip)}">'
+            f"{html.escape(span.label)}</div>"
+        )
+
+    def row(self, name: str, spans: List[Tuple[Span, str]]) -> str:
+        kinds = {id(span): kind for span, kind in spans}
+        lanes = "".join(
+            '<div class="lane">'
+            + "".join(self.bar(span, kinds[id(span)]) for span in lane)
+            + "</div>"
+            for lane in _pack([span for span, _ in spans])
+        )
+        return (
+            f'<div class="row"><div class="name" title="{html.escape(name)}">'
+            f'{html.escape(name)}</div><div class="lanes">{self.grid()}{lanes}</div></div>'
+        )
+
+    def ticks(self) -> List[int]:
+        step = next((s for s in _TICK_STEPS if self.total / s <= 10), _TICK_STEPS[-1])
+        return list(range(0, int(self.total) + 1, step))
+
+    def grid(self) -> str:
+        return "".join(
+            f'<div class="grid" style="left:{self._pct(self.origin + t):.3f}%"></div>'
+            for t in self.ticks()
+        )
+
+    def axis(self) -> str:
+        labels = "".join(
+            f'<span style="left:{self._pct(self.origin + t):.3f}%">{_tick_label(t)}</span>'
+            for t in self.ticks()
+        )
+        return (
+            f'<div class="row"><div class="name"></div>'
+            f'<div class="axis lanes">{labels}</div></div>'
+        )
+
+
+def render(timeline: Timeline) -> str:
+    """The report for *timeline* as a complete HTML document."""
+    spans = timeline.modules + timeline.commands + timeline.waits
+    end = max([timeline.finished or 0.0] + [s.started + s.duration for s in spans])
+    chart = _Chart(timeline.started, end - timeline.started)
+
+    rows = [chart.axis(), chart.row("modules", [(m, "module") for m in timeline.modules])]
+    # One row (with as many lanes as it needs) per module, in the order they started
+    order = [m.module for m in sorted(timeline.modules, key=lambda m: m.started)]
+    by_module: Dict[Optional[str], List[Tuple[Span, str]]] = {}
+    for command in timeline.commands:
+        by_module.setdefault(command.module, []).append((command, _classify(command.label)))
+    for wait in timeline.waits:
+        by_module.setdefault(wait.module, []).append((wait, "human wait"))
+    for module in order + [m for m in by_module if m not in order]:
+        if module in by_module:
+            rows.append(chart.row(module or "orchestrator", by_module[module]))
+
+    legend = "".join(
+        f'<span><i style="background:{colour}"></i>{html.escape(kind)}</span>'
+        for kind, colour in _COLOURS.items()
+    )
+    failed = [m.module for m in timeline.modules if not m.ok]
+    status = f"failed in {', '.join(str(m) for m in failed)}" if failed else "ok"
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timeline.started))
+    title = f"machine-setup run {timeline.run_id}"
+    return (
+        f'<!DOCTYPE html>\n<html lang="en"><head><meta charset="utf-8">'
+        f"<title>{html.escape(title)}</title><style>{_STYLE}</style></head><body>\n"
+        f"<h1>{html.escape(title)}</h1>\n"
+        f'<div class="meta">{html.escape(when)} · {_format_duration(end - timeline.started)} · '
+        f"{len(timeline.commands)} commands · {html.escape(status)} · "
+        f"<code>{html.escape(timeline.argv)}</code></div>\n"
+        f'<div class="legend">{legend}</div>\n'
+        + "\n".join(rows)
+        + "\n</body></html>\n"
+    )
+
+
+def write_report(path: str) -> None:
+    """Writes the current run's report to *path* (the run must have been recorded)."""
+    timeline = history.timeline()
+    if timeline is None:
+        log.warning(f"No run history to build {path} from (dry runs aren't recorded).")
+        return
+    try:
+        with open(path, "w") as f:
+            f.write(render(timeline))
+    except OSError as e:
+        log.error(f"Could not write report {path}: {e}")
+        return
+    log.success(f"Timeline report written to {path}")
@@ -0,0 +1,418 @@
+"""
+snapshot.py
+===========
+Golden-state snapshots: ``--snapshot-export FILE`` captures the managed
+state a successful run produced, ``--snapshot-import FILE`` lays it onto a
+fresh host in one pass before the normal run fixes any residual drift.
+
+A snapshot is a gzipped tar whose first member, ``snapshot.json``, indexes
+everything else:
+
+* the OS it was taken on and the modules that ran (an import with no
+  module flags re-runs the same modules),
+* manually installed packages (``apt-mark showmanual``),
+* non-system users and groups (uid/gid >= 1000, plus the service accounts
+  the modules create) with their group memberships,
+* system docker image references, with the digest and ID each resolved to,
+* the managed files and repo checkouts of those modules, plus the apt
+  sources and keyrings, as archive members under ``root/``; files carry a
+  sha256 that is verified on import.
+
+Secrets the modules don't manage (Tailscale node keys, SSH host keys,
+shadow entries) are never captured, so an imported host still has its own
+identity.  Rootless docker images live per user and are left for the
+normal run to pull.
+"""
+
+import hashlib
+import io
+import json
+import os
+import platform
+import socket
+import tarfile
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from .constants import (
+    FIREWALL_SCRIPT_DEST, HWGA_REPOS, OLLAMA_STACK_DIR, OLLAMA_USER, PERSONAL_GITHUB_REPOS,
+    ROOT_SRC_CHECKOUT, SYSTEM_REPOS,
+)
+from .executor import Executor
+from .logger import log
+from .paths import host_path, root, which
+
+SNAPSHOT_VERSION: int = 1
+INDEX_MEMBER: str = "snapshot.json"
+_ROOT_PREFIX: str = "root"
+
+# Captured with any snapshot: what apt needs to reinstall third-party packages
+_APT_PATHS: Tuple[str, ...] = ("/etc/apt/sources.list.d", "/etc/apt/keyrings")
+_FIRST_USER_ID: int = 1000
+_NOBODY_ID: int = 65534
+
+
+@dataclass
+class UserEntry:
+    name: str
+    uid: int
+    gid: int
+    home: str
+    shell: str
+    groups: List[str] = field(default_factory=list)
+
+
+@dataclass
+class GroupEntry:
+    name: str
+    gid: int
+
+
+@dataclass
+class ImageEntry:
+    ref: str  # repository:tag
+    digest: str  # repository@sha256:..., "" if the image was built locally
+    image_id: str
+
+
+@dataclass
+class PathEntry:
+    path: str
+    module: str
+    sha256: str = ""  # regular files only; repo checkouts are captured whole
+
+
+@dataclass
+class Index:
+    version: int
+    created: float
+    host: str
+    os_id: str
+    codename: str
+    arch: str
+    modules: List[str]
+    packages: List[str]
+    users: List[UserEntry]
+    groups: List[GroupEntry]
+    images: List[ImageEntry]
+    files: List[PathEntry]
+    repos: List[PathEntry]
+
+    @classmethod
+    def from_json(cls, text: str) -> "Index":
+        data: Dict[str, Any] = json.loads(text)
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {data.get('version')!r}")
+        return cls(
+            version=data["version"],
+            created=data["created"],
+            host=data["host"],
+            os_id=data["os_id"],
+            codename=data["codename"],
+            arch=data["arch"],
+            modules=data["modules"],
+            packages=data["packages"],
+            users=[UserEntry(**u) for u in data["users"]],
+            groups=[GroupEntry(**g) for g in data["groups"]],
+            images=[ImageEntry(**i) for i in data["images"]],
+            files=[PathEntry(**p) for p in data["files"]],
+            repos=[PathEntry(**p) for p in data["repos"]],
+        )
+
+
+# ---------------------------------------------------------------------------
+# What each module manages
+# ---------------------------------------------------------------------------
+
+def _managed(exec_obj: Executor, module: str) -> Tuple[List[str], List[str]]:
+    """(files, repo checkouts) that *module* writes, as host paths."""
+    facts = exec_obj.facts
+    if module == "root_ssh_keys":
+        homes = ["/root"] + ([facts.home("adam")] if facts.user_exists("adam") else [])
+        return [os.path.join(h, ".ssh", "authorized_keys") for h in homes], []
+    if module == "sudoers":
+        from .installer_utils.user_mgmt import SUDOERS_STAFF_FILE
+        return [SUDOERS_STAFF_FILE], []
+    if module == "packages":
+        return [], [os.path.join(ROOT_SRC_CHECKOUT, "update-all-the-packages")]
+    if module == "cloud_init":
+        return [], [os.path.join(ROOT_SRC_CHECKOUT, name) for name in SYSTEM_REPOS]
+    if module == "firewall":
+        from .installer_utils.module_firewall import FIREWALL_SERVICE_PATH
+        return [FIREWALL_SCRIPT_DEST, FIREWALL_SERVICE_PATH, "/usr/local/bin/firewall-rules"], []
+    if module == "no2id":
+        return [], [config["dest"] for config in HWGA_REPOS.values()]
+    if module == "pseudohome":
+        from .installer_utils.module_pseudohome import PSEUDOHOME_DEST_DIR
+        return [], [PSEUDOHOME_DEST_DIR]
+    if module == "wolfcraig":
+        from .installer_utils.module_wolfcraig import GHOST_DOCKER_REPO, WOLFCRAIG_REPO
+        return [], [WOLFCRAIG_REPO, GHOST_DOCKER_REPO]
+    if module in ("personal_repos", "traefik_proxy", "dracula", "docker_dns_reso"):
+        from .installer_utils.module_personal_repos import PERSONAL_REPOS_USER
+        if not facts.user_exists(PERSONAL_REPOS_USER):
+            return [], []
+        keys = (
+            list(PERSONAL_GITHUB_REPOS) if module == "personal_repos"
+            else [module.replace("_", "-")]
+        )
+        projects = os.path.join(facts.home(PERSONAL_REPOS_USER), "projects")
+        return [], [os.path.join(projects, key) for key in keys]
+    if module == "ollama":
+        return [os.path.join(OLLAMA_STACK_DIR, "docker-compose.yml")], []
+    if module == "vm":
+        from .installer_utils.virtmachine import FSTAB_FILE
+        return [FSTAB_FILE], []
+    return [], []
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _capture_accounts(exec_obj: Executor) -> Tuple[List[UserEntry], List[GroupEntry]]:
+    facts = exec_obj.facts
+    service_users = {OLLAMA_USER} | {str(c["user"]) for c in HWGA_REPOS.values() if "user" in c}
+    users = [
+        UserEntry(name, u.uid, u.gid, u.home, u.shell, facts.user_groups(name))
+        for name, u in sorted(facts.users.items(), key=lambda item: item[1].uid)
+        if _FIRST_USER_ID <= u.uid < _NOBODY_ID or name in service_users
+    ]
+    wanted = {g for u in users for g in u.groups}
+    wanted |= {name for name, g in facts.groups.items() if g.gid in {u.gid for u in users}}
+    groups = [
+        GroupEntry(name, g.gid)
+        for name, g in sorted(facts.groups.items(), key=lambda item: item[1].gid)
+        if name in wanted or _FIRST_USER_ID <= g.gid < _NOBODY_ID
+    ]
+    return users, groups
+
+
+def _capture_images(exec_obj: Executor) -> List[ImageEntry]:
+    if not which("docker"):
+        return []
+    result = exec_obj.run(
+        "docker image ls --digests --format '{{.Repository}} {{.Tag}} {{.Digest}} {{.ID}}'",
+        check=False, run_quiet=True,
+    )
+    images: List[ImageEntry] = []
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) != 4 or parts[0] == "<none>":
+            continue
+        repository, tag, digest, image_id = parts
+        images.append(ImageEntry(
+            f"{repository}:{tag}",
+            f"{repository}@{digest}" if digest.startswith("sha256:") else "",
+            image_id,
+        ))
+    return images
+
+
+def export_snapshot(exec_obj: Executor, path: str, modules: List[str]) -> None:
+    """Writes a snapshot of what *modules* manage on this host to *path*."""
+    if exec_obj.dry_run:
+        log.info(f"[DRY RUN] Would write a snapshot of {', '.join(modules)} to {path}")
+        return
+    facts = exec_obj.facts
+    facts.refresh("users", "groups")
+    packages = exec_obj.run("apt-mark showmanual", check=False, run_quiet=True).stdout.split()
+    users, groups = _capture_accounts(exec_obj)
+
+    files: List[PathEntry] = []
+    repos: List[PathEntry] = []
+    for apt_dir in _APT_PATHS:
+        if os.path.isdir(host_path(apt_dir)):
+            for name in sorted(os.listdir(host_path(apt_dir))):
+                files.append(PathEntry(os.path.join(apt_dir, name), "apt"))
+    for module in modules:
+        module_files, module_repos = _managed(exec_obj, module)
+        files += [PathEntry(p, module) for p in module_files]
+        repos += [PathEntry(p, module) for p in module_repos]
+    files = [f for f in files if os.path.isfile(host_path(f.path))]
+    repos = [r for r in repos if os.path.isdir(host_path(os.path.join(r.path, ".git")))]
+    for entry in files:
+        entry.sha256 = _sha256(host_path(entry.path))
+
+    index = Index(
+        version=SNAPSHOT_VERSION,
+        created=time.time(),
+        host=socket.gethostname(),
+        os_id=facts.os_id,
+        codename=facts.codename,
+        arch=platform.machine(),
+        modules=modules,
+        packages=packages,
+        users=users,
+        groups=groups,
+        images=_capture_images(exec_obj),
+        files=files,
+        repos=repos,
+    )
+    data = json.dumps(asdict(index), indent=2).encode()
+    # Holds deploy configs and authorized_keys: written to a temp file that is
+    # 0600 from creation, then renamed into place (never readable by others,
+    # and no partial archive left behind on error)
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(path)), prefix=".snapshot-", delete=False
+        ) as tmp:
+            tmp_path = tmp.name
+            with tarfile.open(fileobj=tmp, mode="w:gz") as tar:
+                info = tarfile.TarInfo(INDEX_MEMBER)
+                info.size = len(data)
+                info.mtime = int(index.created)
+                tar.addfile(info, io.BytesIO(data))
+                for entry in files + repos:
+                    tar.add(host_path(entry.path), arcname=f"{_ROOT_PREFIX}{entry.path}")
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.error(f"Could not write snapshot {path}: {e}")
+        return
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    log.success(
+        f"Snapshot written to {path}: {len(packages)} packages, {len(users)} users, "
+        f"{len(index.images)} images, {len(files)} files, {len(repos)} repos "
+        f"({os.path.getsize(path) // 1024} KiB)."
+    )
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def read_index(path: str) -> Index:
+    """The index of the snapshot at *path*; raises ValueError if it isn't one."""
+    try:
+        with tarfile.open(path, "r:gz") as tar:
+            first = tar.next()
+            if first is None or first.name != INDEX_MEMBER:
+                raise ValueError(f"{path} is not a machine-setup snapshot (no index).")
+            f = tar.extractfile(first)
+            if f is None:
+                raise ValueError(f"{path}: unreadable snapshot index.")
+            return Index.from_json(f.read().decode())
+    except (OSError, tarfile.TarError, json.JSONDecodeError, KeyError, TypeError) as e:
+        raise ValueError(f"Cannot read snapshot {path}: {e}") from e
+
+
+def _restore_accounts(exec_obj: Executor, index: Index) -> None:
+    facts = exec_obj.facts
+    for group in index.groups:
+        if facts.group_exists(group.name):
+            continue
+        gid_flag = "" if facts.gid_taken(group.gid) else f"-g {group.gid} "
+        exec_obj.run(f"groupadd {gid_flag}{group.name}", force_sudo=True)
+    facts.refresh("groups")
+    primary = {g.gid: g.name for g in index.groups}
+
+    for user in index.users:
+        if not facts.user_exists(user.name):
+            cmd = ["useradd", "-m", "-d", user.home, "-s", user.shell]
+            if not facts.uid_taken(user.uid):
+                cmd += ["-u", str(user.uid)]
+            cmd += ["-g", primary[user.gid]] if user.gid in primary else ["-U"]
+            exec_obj.run(" ".join(cmd + [user.name]), force_sudo=True)
+    facts.refresh("users", "groups")
+
+    for user in index.users:
+        if not facts.user_exists(user.name):
+            continue
+        missing = [
+            g for g in user.groups
+            if facts.group_exists(g) and g not in facts.user_groups(user.name)
+        ]
+        if missing:
+            exec_obj.run(f"usermod -aG {','.join(missing)} {user.name}", force_sudo=True)
+    facts.refresh("groups")
+
+
+def _restore_paths(path: str, index: Index) -> Tuple[int, List[str]]:
+    """Extracts the captured files and checkouts; returns (members, files that failed sha256)."""
+    expected = {f"{_ROOT_PREFIX}{f.path}": f.sha256 for f in index.files}
+    count = 0
+    corrupt: List[str] = []
+    with tarfile.open(path, "r:gz") as tar:
+        for member in tar:
+            if not member.name.startswith(f"{_ROOT_PREFIX}/"):
+                continue
+            digest = expected.get(member.name)
+            if digest and member.isfile():
+                f = tar.extractfile(member)
+                if f is None or hashlib.sha256(f.read()).hexdigest() != digest:
+                    corrupt.append(member.name[len(_ROOT_PREFIX):])
+                    continue
+            member.name = member.name[len(_ROOT_PREFIX) + 1:]
+            # filter="tar" keeps owners and modes but refuses absolute or escaping paths
+            tar.extract(member, path=root(), filter="tar")
+            count += 1
+    return count, corrupt
+
+
+def _restore_images(exec_obj: Executor, index: Index) -> None:
+    if not index.images:
+        return
+    if not which("docker"):
+        log.warning("docker isn't installed; the normal run will pull the images.")
+        return
+    for image in index.images:
+        if not image.digest:
+            log.info(f"{image.ref} was built locally; leaving it to the normal run.")
+            continue
+        result = exec_obj.run(f"docker pull {image.digest}", force_sudo=True, check=False)
+        if result.returncode == 0:
+            exec_obj.run(f"docker tag {image.digest} {image.ref}", force_sudo=True, check=False)
+        else:
+            log.warning(f"Could not pull {image.digest}; the normal run will fetch {image.ref}.")
+
+
+def import_snapshot(exec_obj: Executor, path: str, index: Index) -> None:
+    """Applies the snapshot at *path* (already read into *index*) to this host."""
+    from .installer_utils.apt_tools import apt_install
+
+    facts = exec_obj.facts
+    if (index.os_id, index.codename) != (facts.os_id, facts.codename):
+        message = (
+            f"Snapshot was taken on {index.os_id} {index.codename}, "
+            f"this host is {facts.os_id} {facts.codename}"
+        )
+        if not exec_obj.force:
+            raise ValueError(f"{message} (use --force to import anyway).")
+        log.warning(f"{message}; importing anyway (--force).")
+
+    age_days = (time.time() - index.created) / 86400
+    log.info(
+        f"Importing snapshot of {', '.join(index.modules)} from {index.host} "
+        f"({age_days:.0f} days old)."
+    )
+    _restore_accounts(exec_obj, index)
+
+    if exec_obj.dry_run:
+        log.info(f"[DRY RUN] Would restore {len(index.files)} files and {len(index.repos)} repos.")
+    else:
+        count, corrupt = _restore_paths(path, index)
+        if corrupt:
+            log.warning(
+                f"Skipped {len(corrupt)} file(s) that failed verification: {', '.join(corrupt)}"
+            )
+        log.success(f"Restored {count} files and directories.")
+
+    if index.packages:
+        apt_install(exec_obj, index.packages)
+    _restore_images(exec_obj, index)
+    facts.refresh("users", "groups", "packages")
+    log.success("Snapshot applied; the normal run now fixes whatever is left.")
+
@@ -0,0 +1,105 @@
+"""
+stubs.py
+========
+Command-stub backend for ``--root`` runs.  Instead of executing, every
+command the Executor (or a read-only probe) would run is answered from a
+rules file and appended to a call log, so the module suite can run
+hermetically against a scratch root in seconds.
+
+Rules live in ``<root>/stubs.toml``; the first whose regex matches the
+command (as logged, without the sudo/user prefix) wins, and a command no
+rule matches succeeds with empty output::
+
+    [[stub]]
+    match = "^systemd-detect-virt"
+    stdout = "kvm"
+
+    [[stub]]
+    match = "^id -u no2id-docker"
+    returncode = 1
+
+Calls are appended to ``<root>/commands.log`` as ``<returncode>\\t<command>``
+(delegated children append to the same log).
+"""
+
+import os
+import re
+import subprocess
+import threading
+import tomllib
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+STUBS_FILE: str = "stubs.toml"
+CALL_LOG: str = "commands.log"
+
+
+@dataclass
+class StubRule:
+    pattern: "re.Pattern[str]"
+    stdout: str = ""
+    stderr: str = ""
+    returncode: int = 0
+
+
+class CommandStub:
+    """Answers commands from a list of rules and records every call."""
+
+    def __init__(self, rules: List[StubRule], call_log: str):
+        self.rules = rules
+        self.call_log = call_log
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, root: str) -> "CommandStub":
+        """Reads ``<root>/stubs.toml`` (if present); raises ValueError if it's malformed."""
+        rules: List[StubRule] = []
+        path = os.path.join(root, STUBS_FILE)
+        if os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    data = tomllib.load(f)
+                for entry in data.get("stub", []):
+                    rules.append(
+                        StubRule(
+                            re.compile(entry["match"]),
+                            stdout=entry.get("stdout", ""),
+                            stderr=entry.get("stderr", ""),
+                            returncode=int(entry.get("returncode", 0)),
+                        )
+                    )
+            except (tomllib.TOMLDecodeError, KeyError, TypeError, re.error) as e:
+                raise ValueError(f"Invalid stub rules in {path}: {e}") from e
+        return cls(rules, os.path.join(root, CALL_LOG))
+
+    def run(self, command: str, args: Sequence[str], user: Optional[str] = None
+            ) -> subprocess.CompletedProcess[str]:
+        """The stubbed result of *command* (*args* is what would have been executed)."""
+        rule = next((r for r in self.rules if r.pattern.search(command)), None)
+        result = subprocess.CompletedProcess(
+            args=list(args),
+            returncode=rule.returncode if rule else 0,
+            stdout=rule.stdout if rule else "",
+            stderr=rule.stderr if rule else "",
+        )
+        # One line per call, even for multi-line shell snippets
+        logged = command.replace("\n", "\\n")
+        entry = f"{result.returncode}\t{f'(user: {user}) ' if user else ''}{logged}\n"
+        with self._lock, open(self.call_log, "a") as f:
+            f.write(entry)
+        return result
+
+
+_STUB: Optional[CommandStub] = None
+
+
+def install(root: str) -> CommandStub:
+    """Routes all commands to a stub backend loaded from *root*."""
+    global _STUB
+    _STUB = CommandStub.load(root)
+    return _STUB
+
+
+def current() -> Optional[CommandStub]:
+    """The active stub backend, or None when commands really run."""
+    return _STUB
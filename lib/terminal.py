@@ -0,0 +1,130 @@
+"""
+terminal.py
+===========
+Terminal locks for the orchestrator and its delegated children, so output
+and prompts from concurrent modules never interleave.
+
+* ``owner()`` — context manager held while writing output.  Process-local
+  and re-entrant: a delegated child's stdout is a pipe the parent relays, so
+  it must never wait on another process while writing to it.
+* ``exclusive()`` — ``owner()`` plus an ``flock`` on TTY_LOCK_FILE, held
+  only around prompts and interactive commands on the terminal itself, so
+  two processes never prompt at once.  Nothing writes to a pipe that the
+  other side needs the flock to drain: the parent's relay (``emit()``)
+  takes only ``owner()``.
+* ``ask()`` — prompts on the controlling terminal (``/dev/tty``) under
+  ``exclusive()``.  Delegated children have their stdout piped through the
+  parent's per-user prefixer, so prompts can't go through stdin/stdout.
+* ``emit()`` — writes one line of a delegated child's output, prefixed.
+* ``controlling_tty()`` — the terminal for interactive commands run from a
+  child whose stdio isn't one.
+
+Deliberately doesn't import the logger: the logger's handler uses ``owner()``.
+"""
+
+import fcntl
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+from .constants import TTY_LOCK_FILE
+
+_LOCAL = threading.RLock()
+# Serialises this process's threads around the flock (which is per process)
+_EXCLUSIVE = threading.RLock()
+_depth: int = 0
+_lock_fd: Optional[int] = None
+
+
+def _open_lock() -> Optional[int]:
+    try:
+        os.makedirs(os.path.dirname(TTY_LOCK_FILE), exist_ok=True)
+        fd = os.open(TTY_LOCK_FILE, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o666)
+    except OSError:
+        # No shared lock (e.g. unwritable /run/lock): still serialise our own threads.
+        return None
+    return fd
+
+
+@contextmanager
+def owner() -> Iterator[None]:
+    """Holds this process's output for the calling thread until exit."""
+    with _LOCAL:
+        yield
+
+
+@contextmanager
+def exclusive() -> Iterator[None]:
+    """
+    Holds the terminal across processes (a prompt, an interactive command).
+    The flock is taken before ``owner()``, so this process keeps relaying
+    children's output while it waits for another process's prompt.
+    """
+    global _depth, _lock_fd
+    with _EXCLUSIVE:
+        if _depth == 0:
+            if _lock_fd is None:
+                _lock_fd = _open_lock()
+            if _lock_fd is not None:
+                fcntl.flock(_lock_fd, fcntl.LOCK_EX)
+        _depth += 1
+        try:
+            with owner():
+                yield
+        finally:
+            _depth -= 1
+            if _depth == 0 and _lock_fd is not None:
+                fcntl.flock(_lock_fd, fcntl.LOCK_UN)
+
+
+def controlling_tty() -> Optional[IO[str]]:
+    """The controlling terminal opened read/write, or None if there isn't one."""
+    try:
+        return open("/dev/tty", "r+")
+    except OSError:
+        return None
+
+
+def ask(prompt: str) -> str:
+    """
+    Prompts on the controlling terminal while holding the terminal lock and
+    returns the stripped answer.  Returns "" if there's no terminal to ask on
+    (e.g. cloud-init), which callers treat as "no".
+    """
+    started = time.time()
+    try:
+        return _prompt(prompt)
+    finally:
+        # Imported here: history -> logger -> terminal
+        from . import history
+        history.record_wait(f"prompt: {prompt.strip()}", started, time.time() - started)
+
+
+def _prompt(prompt: str) -> str:
+    sys.stdout.flush()
+    with exclusive():
+        tty = controlling_tty()
+        if tty is None:
+            if sys.stdin.isatty():
+                return input(prompt).strip()
+            sys.stdout.write(f"{prompt}(no terminal to prompt on; assuming no)\n")
+            sys.stdout.flush()
+            return ""
+        with tty:
+            tty.write(prompt)
+            tty.flush()
+            return tty.readline().strip()
+
+
+def emit(prefix: str, line: str) -> None:
+    """
+    Writes one line of a delegated child's output under *prefix*.  Only the
+    process-local lock: the child may hold the flock while it writes the
+    pipe this line came from.
+    """
+    with owner():
+        sys.stdout.write(f"{prefix}{line.rstrip(chr(10))}\n")
+        sys.stdout.flush()
@@ -2,19 +2,24 @@
 import argparse
 import os
 import sys
-from typing import List, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
 # Set up the internal module search path for relative imports
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
 # Import core utilities
-from lib.constants import VENVDIR
+from lib.constants import VENVDIR, FLEET_DEFAULT_CONCURRENCY
 from lib.logger import configure_logger, log, log_module_start
 from lib.executor import EXEC, run_function_as_user
 
 # Global default VM user (used for Docker setup and VM module)
 DEFAULT_VM_USER: str = "adam"
 
+# Modules delegated to another user via run_function_as_user; adjacent ones run concurrently
+DELEGATED_MODULES: Tuple[str, ...] = ("pseudohome", "no2id")
+
 
 def require_root() -> None:
     """
@@ -59,6 +64,14 @@ def parse_args() -> Tuple[argparse.Namespace, List[str]]:
                                 help=argparse.SUPPRESS)
     group_internal.add_argument("--run-args", type=str, nargs='*', default=[], 
                                 help=argparse.SUPPRESS) 
+    group_internal.add_argument("--facts-file", type=str, default=None,
+                                help=argparse.SUPPRESS)
+    group_internal.add_argument("--history-context", type=str, default=None,
+                                help=argparse.SUPPRESS)
+    group_internal.add_argument("--prefetched", type=str, nargs="+", default=[],
+                                help=argparse.SUPPRESS)
+    group_internal.add_argument("--gate-file", type=str, default=None,
+                                help=argparse.SUPPRESS)
     
     # --- Global Options ---
     group_global = parser.add_argument_group("Global Options")
@@ -67,9 +80,83 @@ def parse_args() -> Tuple[argparse.Namespace, List[str]]:
     group_global.add_argument("-v", "--verbose", action="store_true", help="Verbose/debug output.")
     group_global.add_argument("-q", "--quiet", action="store_true", help="Warnings/errors only.")
     group_global.add_argument("--no-autoremove", action="store_true", help="Skip apt autoremove.")
+    group_global.add_argument("--no-prefetch", action="store_true",
+                              help="Skip the up-front concurrent download of module artifacts.")
+    group_global.add_argument("--apt-ttl", type=str, default=None, metavar="DURATION",
+                              help="Skip apt update while the lists are younger than DURATION\n"
+                                   "and no source or keyring changed (default 1h; --force\n"
+                                   "refreshes anyway).")
+    group_global.add_argument("--apt-proxy", type=str, default=None, metavar="URL",
+                              help="Fetch packages through the APT cache at URL (e.g.\n"
+                                   "http://cache.lan:3142, see --apt-cache) while it answers.")
+    group_global.add_argument("--fast-dpkg", action="store_true",
+                              help="Throwaway/fresh hosts: dpkg without fsync (unsafe-io,\n"
+                                   "eatmydata if installed) and triggers deferred to one\n"
+                                   "run and a sync at the end. Not crash-safe mid-run.")
+    group_global.add_argument("--check", action="store_true",
+                              help="Read-only: report drift of the selected modules (all if\n"
+                                   "none selected) as JSON. Exit 2 if anything drifted.")
+    group_global.add_argument("--check-output", type=str, default=None, metavar="FILE",
+                              help="Write the --check JSON report to FILE instead of stdout.")
+    group_global.add_argument("--profile", type=str, default=None, metavar="FILE",
+                              help="TOML host profile selecting modules and parameters\n"
+                                   "(explicit flags override it).")
+    group_global.add_argument("--resume", action="store_true",
+                              help="Skip modules the last run completed with unchanged\n"
+                                   "inputs and restart at the one that failed.")
+    group_global.add_argument("--history", action="store_true",
+                              help="List recent runs and modules that ran much slower\n"
+                                   "than their historical median, then exit.")
+    group_global.add_argument("--report", type=str, default=None, metavar="FILE",
+                              help="Write an HTML Gantt chart of this run's modules and\n"
+                                   "commands to FILE (also when the run fails).")
+    group_global.add_argument("--root", type=str, default=None, metavar="PATH",
+                              help="Run against a scratch directory instead of the host:\n"
+                                   "files resolve under PATH and commands are answered from\n"
+                                   "PATH/stubs.toml and logged to PATH/commands.log.")
+    group_global.add_argument("--budget", type=str, default=None, metavar="DURATION",
+                              help="Run the most important modules that fit in DURATION\n"
+                                   "(e.g. 5m) and defer the rest to a systemd timer.")
+    group_global.add_argument("--snapshot-export", type=str, default=None, metavar="FILE",
+                              help="After a successful run, capture the state the selected\n"
+                                   "modules manage (packages, users, files, repos, images)\n"
+                                   "into the snapshot archive FILE.")
+    group_global.add_argument("--snapshot-import", type=str, default=None, metavar="FILE",
+                              help="Apply a snapshot archive first, then run its modules\n"
+                                   "(or the selected ones) to fix any residual drift.")
+    group_global.add_argument("--offline-bundle", type=str, default=None, metavar="FILE",
+                              help="Collect every artifact the selected modules need (files,\n"
+                                   "repos, .debs, images, models) into FILE, then exit.")
+    group_global.add_argument("--from-bundle", type=str, default=None, metavar="FILE",
+                              help="Provision without the network, reading artifacts from an\n"
+                                   "--offline-bundle archive.")
+    group_global.add_argument("--agent", action="store_true",
+                              help="Stay running and watch the files the selected modules\n"
+                                   "manage (sudoers, docker, firewall, vm) with inotify;\n"
+                                   "re-run a module's reconcile step when they drift.")
+    group_global.add_argument("--agent-debounce", type=float, default=2.0, metavar="SECONDS",
+                              help="Quiet period after a burst of changes before the agent\n"
+                                   "reconciles (default: 2).")
     group_global.add_argument("--debug", type=int, nargs='?', const=1, default=0,
                               help="Enable debug tracing (1: basic, 2: detailed).")
 
+    # --- Fleet Options ---
+    group_fleet = parser.add_argument_group("Fleet Options")
+    group_fleet.add_argument(
+        "--fleet", type=str, default=None, dest="fleet_inventory", metavar="INVENTORY",
+        help="Push this orchestrator to every host in the TOML inventory over SSH and run\n"
+             "the other selected flags there (instead of on this machine)."
+    )
+    group_fleet.add_argument(
+        "--fleet-concurrency", type=int, default=FLEET_DEFAULT_CONCURRENCY,
+        dest="fleet_concurrency",
+        help=f"Hosts provisioned at once (default: {FLEET_DEFAULT_CONCURRENCY})."
+    )
+    group_fleet.add_argument(
+        "--fleet-hosts", type=str, default=None, dest="fleet_hosts",
+        help="Comma-separated subset of inventory host names to provision."
+    )
+
     # --- Module Options ---
     group_modules = parser.add_argument_group("Module Options")
     group_modules.add_argument("--all", action="store_true", help="Run all tasks.")
@@ -102,6 +189,9 @@ def parse_args() -> Tuple[argparse.Namespace, List[str]]:
                                help="Install system-level repos (post-cloud-init, etc.).")
     group_modules.add_argument("--firewall", action="store_true", dest="do_firewall",
                            help="Install iptables firewall script and systemd service.")
+    group_modules.add_argument("--apt-cache", action="store_true", dest="do_apt_cache",
+                               help="Make this host the APT cache (apt-cacher-ng) for\n"
+                                    "--apt-proxy on other hosts. Not part of --all.")
     
     # PRIVATE REPOS (Requires interactive key setup)
     group_modules.add_argument("--hwga", "--no2id", action="store_true", dest="do_no2id",
@@ -241,29 +331,134 @@ def parse_args() -> Tuple[argparse.Namespace, List[str]]:
                                      dest="do_fake_le_ca_install",
                                      help="Add the CA to the system trust store.")
 
+    # A host profile only supplies defaults, so explicit flags still override it.
+    # The compiled plan is cached by file hash (see lib/profile.py).
+    parser.set_defaults(profile_tables=None)
+    known, _ = parser.parse_known_args()
+    if known.profile:
+        from lib import profile
+        try:
+            plan = profile.load_plan(known.profile)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        parser.set_defaults(**plan["args"], profile_tables=plan["tables"])
+
     return parser.parse_known_args()
 
 
 # --- Main Execution Block ---
 def main() -> None:
+    global EXEC
     args, unknown = parse_args()
     
-    # Configure logger first based on quiet/verbose/debug flags
-    configure_logger(quiet=args.quiet, verbose=args.verbose or args.debug > 0)
+    # Configure logger first based on quiet/verbose/debug flags.
+    # --check without --check-output keeps stdout clean for the JSON report:
+    # the (warning-level) log goes to stderr instead.
+    json_stdout = args.check and not args.check_output
+    configure_logger(
+        quiet=args.quiet or json_stdout,
+        verbose=args.verbose or args.debug > 0,
+        stream=sys.stderr if json_stdout else sys.stdout,
+    )
     
     if unknown:
         log.error(f"Unknown arguments encountered: {', '.join(unknown)}")
         sys.exit(1)
 
-    # 1. Enforce Root Execution
-    require_root()
+    # Fleet mode runs locally as the invoking user; all root work happens on the hosts.
+    if args.fleet_inventory:
+        from lib import fleet
+        local = fleet.local_file_flags(sys.argv[1:])
+        if local:
+            log.critical(
+                f"--fleet: {', '.join(local)}: the hosts can't read files on this machine. "
+                "Give these flags in the inventory's args instead, with paths on the host."
+            )
+            sys.exit(1)
+        EXEC.dry_run = args.dry_run
+        only_hosts = args.fleet_hosts.split(",") if args.fleet_hosts else None
+        try:
+            ok = fleet.run_fleet(
+                EXEC,
+                args.fleet_inventory,
+                fleet.strip_fleet_args(sys.argv[1:]),
+                args.fleet_concurrency,
+                only_hosts=only_hosts,
+            )
+        except ValueError as e:
+            log.critical(f"--fleet: {e}")
+            sys.exit(1)
+        sys.exit(0 if ok else 1)
+
+    # The time budget counts from here; modules that won't fit are deferred (lib/budget.py)
+    from lib.budget import Budget, parse_duration, schedule_followup
+    budget: Optional[Budget] = None
+    if args.budget:
+        try:
+            budget = Budget(parse_duration(args.budget))
+        except ValueError as e:
+            log.critical(f"--budget: {e}")
+            sys.exit(1)
+    if args.apt_ttl:
+        from lib.installer_utils.apt_tools import set_lists_ttl
+        try:
+            set_lists_ttl(parse_duration(args.apt_ttl))
+        except ValueError as e:
+            log.critical(f"--apt-ttl: {e}")
+            sys.exit(1)
+    if args.fast_dpkg:
+        from lib.installer_utils.apt_tools import set_fast_dpkg
+        set_fast_dpkg(True)
+    if args.apt_proxy:
+        from lib.installer_utils.apt_tools import set_proxy
+        try:
+            set_proxy(args.apt_proxy)
+        except ValueError as e:
+            log.critical(f"--apt-proxy: {e}")
+            sys.exit(1)
+
+    # 1. Enforce Root Execution (an alternate root never touches the host)
+    if args.root:
+        from lib import paths, stubs
+        if not os.path.isdir(args.root):
+            log.critical(f"--root {args.root} is not a directory.")
+            sys.exit(1)
+        paths.set_root(args.root)
+        try:
+            stubs.install(paths.root())
+        except ValueError as e:
+            log.critical(str(e))
+            sys.exit(1)
+        log.info(
+            f"Alternate root {paths.root()}: commands are stubbed and logged to "
+            f"{os.path.join(paths.root(), stubs.CALL_LOG)}."
+        )
+    else:
+        require_root()
 
     # 2. Configure Global Executor Instance
-    global EXEC
     EXEC.dry_run = args.dry_run
     EXEC.quiet = args.quiet
     EXEC.verbose = args.verbose
     EXEC.force = args.force # Propagate force flag for idempotency overrides
+
+    # Host profile repo tables replace the built-in ones (children get --profile too)
+    if args.profile:
+        from lib import profile
+        profile.apply_tables(args.profile_tables)
+        EXEC.profile = os.path.abspath(args.profile)
+
+    if args.history:
+        from lib import history
+        history.print_history()
+        sys.exit(0)
+
+    # Delegated children reuse the parent's facts snapshot instead of re-probing
+    if args.facts_file:
+        from lib.facts import Facts
+        parent_facts = Facts.load(args.facts_file)
+        if parent_facts:
+            EXEC.facts = parent_facts
     
     # 3. Import Modules (required here for internal command lookup and execution)
     from lib.installer_utils import (  # noqa: E402
@@ -281,6 +476,19 @@ def main() -> None:
     # 4. Internal Command Execution (Handles recursive calls from sudo -u)
     if args.run_cmd:
         log.debug(f"Executing internal command: {args.run_cmd} with args: {args.run_args}")
+        from lib import history
+        if args.history_context:
+            history.attach(args.history_context)
+        # The parent's prefetch (or offline restore) results
+        from lib import offline, prefetch
+        for source in args.prefetched:
+            prefetch.mark_fresh(source)
+        if args.from_bundle:
+            offline.attach(args.from_bundle)
+        # Pending deploy keys are handed to the parent rather than waited on here
+        if args.gate_file:
+            from lib import gates
+            gates.set_handoff_file(args.gate_file)
         try:
             # Functions that expect the executor object
             module_map = {
@@ -303,6 +511,8 @@ def main() -> None:
         except Exception as e:
             log.error(f"Internal command failed: {args.run_cmd}. Error: {e}")
             sys.exit(1)
+        finally:
+            history.flush()
             
     # 5. Determine Task List
     tasks = {
@@ -327,6 +537,67 @@ def main() -> None:
     if args.all:
         for key in tasks:
             tasks[key] = True
+    # One cache host serves the others, so --all doesn't turn every host into one
+    tasks["apt_cache"] = args.do_apt_cache
+
+    # Read-only drift check: never mutates, so it short-circuits everything below.
+    if args.check:
+        from lib import drift
+        selected = [key for key, enabled in tasks.items() if enabled]
+        if args.do_vm:
+            selected.append("vm")
+        # Only the cache host runs apt_cache, so it's checked only when asked for
+        default = [name for name in drift.CHECKS if name != "apt_cache"]
+        report = drift.run_checks(selected or default, EXEC.facts)
+        missing = drift.missing_packages(report)
+        if missing:
+            # What installing them would take (a read-only apt-get simulation)
+            from lib.installer_utils.apt_tools import plan_transaction
+            apt_plan = plan_transaction(EXEC, missing)
+            if apt_plan.simulated:
+                report["apt_plan"] = apt_plan.to_dict()
+        drift.write_report(report, args.check_output)
+        sys.exit(2 if report["drift"] else 0)
+
+    # Agent mode: watch managed files and reconcile on change, instead of a one-shot run.
+    if args.agent:
+        from lib import reconcile
+        selected = [key for key, enabled in tasks.items() if enabled]
+        if args.do_vm:
+            selected.append("vm")
+        modules = [m for m in selected if m in reconcile.AGENT_MODULES]
+        if not modules:
+            log.error(
+                "--agent needs at least one watchable module: "
+                + ", ".join(f"--{m}" for m in reconcile.AGENT_MODULES)
+            )
+            sys.exit(1)
+        try:
+            reconcile.run_agent(EXEC, modules, debounce=args.agent_debounce)
+        except KeyboardInterrupt:
+            log.info("Agent stopped.")
+        sys.exit(0)
+
+    # Offline bundle: fetch the selected modules' artifacts for another host, then stop.
+    if args.offline_bundle:
+        from lib import offline, prefetch
+        artifacts = prefetch.collect_artifacts(EXEC, tasks, args, offline=True)
+        sys.exit(0 if offline.build(EXEC, args.offline_bundle, artifacts) else 1)
+
+    # A snapshot import re-runs the modules it was taken from unless others are selected
+    snapshot_index = None
+    if args.snapshot_import:
+        from lib import snapshot
+        try:
+            snapshot_index = snapshot.read_index(args.snapshot_import)
+        except ValueError as e:
+            log.critical(str(e))
+            sys.exit(1)
+        if not any(tasks.values()) and not args.do_vm:
+            for key in snapshot_index.modules:
+                if key in tasks:
+                    tasks[key] = True
+            args.do_vm = "vm" in snapshot_index.modules
 
     # --ollama-terminal is a standalone action (no --ollama flag needed)
     has_terminal_action = bool(getattr(args, "ollama_terminal_path", None))
@@ -341,113 +612,285 @@ def main() -> None:
     os.environ['VENVDIR'] = VENVDIR
     os.environ['PATH'] = f"{VENVDIR}/bin:{os.environ.get('PATH', '')}"
 
-    # 6. Execute Modules in Order
-    
-    if tasks["root_ssh_keys"]:
-        log_module_start("ROOT SSH KEYS", EXEC)
+    # 5a. Gather host facts once (concurrently); modules read EXEC.facts from here on.
+    facts = EXEC.facts
+    log.debug(
+        f"Facts: os={facts.os_id} {facts.codename}, virt={facts.virt or 'unknown'}, "
+        f"desktop={facts.desktop}, {len(facts.users)} users, {len(facts.packages)} packages"
+    )
+
+    # 6. Build the Execution Plan (order matters): (journal key, banner, step)
+    plan: List[Tuple[str, str, Callable[[], object]]] = []
+
+    def _root_ssh_keys() -> None:
         user_mgmt.install_root_ssh_keys(EXEC)
         if user_mgmt.ensure_adam_user(EXEC, DEFAULT_VM_USER):
             user_mgmt.install_mapped_ssh_keys(EXEC, DEFAULT_VM_USER)
         else:
             log.warning(f"Skipping SSH key install for '{DEFAULT_VM_USER}': user not created.")
-        
-    if tasks["packages"]:
-        log_module_start("PACKAGES", EXEC)
+
+    def _packages() -> None:
         packages.install_packages(EXEC)
         packages.install_update_all_packages(EXEC)
 
-    if tasks["cloud_init"]:
-        log_module_start("CLOUD-INIT REPOS", EXEC)
-        module_no2id.install_system_repos(EXEC)
-
-    if tasks["sudoers"]:
-        log_module_start("SUDOERS CONFIG", EXEC)
-        user_mgmt.setup_sudoers_staff(EXEC)
-
-    if tasks["tailscale"]:
-        log_module_start("TAILSCALE", EXEC)
+    def _tailscale() -> None:
         tailscale.install_tailscale(EXEC)
         tailscale.ensure_tailscale_strict(EXEC)
 
-    # After Tailscale, before Private User Repos
-    if tasks["firewall"]:
+    def _firewall() -> None:
         from lib.installer_utils import module_firewall
-        log_module_start("FIREWALL SETUP", EXEC)
         module_firewall.setup_firewall(EXEC)
 
-    # Private User Repositories
-    if tasks["pseudohome"]:
-        log_module_start("PSEUDOHOME SETUP (USER: ADAM)", EXEC)
+    def _pseudohome() -> None:
         if user_mgmt.ensure_adam_user(EXEC, "adam"):
             run_function_as_user(EXEC, "adam", "setup_pseudohome")
         else:
             log.warning("Skipping pseudohome setup: user 'adam' not created.")
 
+    # The delegated modules' accounts and groups.  Before a concurrent batch
+    # the parent sets them up one module at a time: side by side, the children
+    # would race on useradd/groupadd and /etc/group.
+    def _pseudohome_accounts() -> None:
+        if user_mgmt.ensure_adam_user(EXEC, "adam"):
+            module_pseudohome.setup_pseudohome_accounts(EXEC)
+
+    delegated_accounts: Dict[str, Callable[[], object]] = {
+        "pseudohome": _pseudohome_accounts,
+        "no2id": lambda: module_no2id.setup_no2id_accounts(EXEC),
+    }
+
+    def _desktop_extras() -> None:
+        vscode.install_vscode(EXEC)
+        tweaks.install_gnome_tweaks(EXEC)
+
+    if snapshot_index is not None:
+        index = snapshot_index
+        plan.append(("snapshot_import", "SNAPSHOT IMPORT",
+                     lambda: snapshot.import_snapshot(EXEC, args.snapshot_import, index)))
+    if tasks["root_ssh_keys"]:
+        plan.append(("root_ssh_keys", "ROOT SSH KEYS", _root_ssh_keys))
+    if tasks["packages"]:
+        plan.append(("packages", "PACKAGES", _packages))
+    if tasks["apt_cache"]:
+        from lib.installer_utils import module_apt_cache
+        plan.append(("apt_cache", "APT CACHE (APT-CACHER-NG)",
+                     lambda: module_apt_cache.setup_apt_cache(EXEC)))
+    if tasks["cloud_init"]:
+        plan.append(("cloud_init", "CLOUD-INIT REPOS",
+                     lambda: module_no2id.install_system_repos(EXEC)))
+    if tasks["sudoers"]:
+        plan.append(("sudoers", "SUDOERS CONFIG", lambda: user_mgmt.setup_sudoers_staff(EXEC)))
+    if tasks["tailscale"]:
+        plan.append(("tailscale", "TAILSCALE", _tailscale))
+    # After Tailscale, before Private User Repos
+    if tasks["firewall"]:
+        plan.append(("firewall", "FIREWALL SETUP", _firewall))
+
+    # Private User Repositories
+    if tasks["pseudohome"]:
+        plan.append(("pseudohome", "PSEUDOHOME SETUP (USER: ADAM)", _pseudohome))
     if tasks["no2id"]:
-        log_module_start("NO2ID SETUP (USER: NO2ID-DOCKER)", EXEC)
-        run_function_as_user(EXEC, "no2id-docker", "setup_no2id")
+        plan.append(("no2id", "NO2ID SETUP (USER: NO2ID-DOCKER)",
+                     lambda: run_function_as_user(EXEC, "no2id-docker", "setup_no2id")))
 
     # Docker after users — ensures all user accounts are fully configured before group membership
     if tasks["docker"]:
-        log_module_start("DOCKER", EXEC)
-        module_docker.install_docker_and_add_users(
+        plan.append(("docker", "DOCKER", lambda: module_docker.install_docker_and_add_users(
             EXEC, args.docker_user, rootless=not args.do_docker_rootful
-        )
+        )))
     
     if tasks["wolfcraig"]:
-        log_module_start("WOLFCRAIG SETUP", EXEC)
-        module_wolfcraig.setup_wolfcraig(EXEC)
+        plan.append(("wolfcraig", "WOLFCRAIG SETUP",
+                     lambda: module_wolfcraig.setup_wolfcraig(EXEC)))
 
     # Personal GitHub Repos (public)
     if tasks["personal_repos"]:
-        log_module_start("PERSONAL REPOS (ALL)", EXEC)
-        module_personal_repos.setup_all_personal_repos(EXEC)
+        plan.append(("personal_repos", "PERSONAL REPOS (ALL)",
+                     lambda: module_personal_repos.setup_all_personal_repos(EXEC)))
     else:
         if tasks["traefik_proxy"]:
-            log_module_start("PERSONAL REPOS: TRAEFIK-PROXY", EXEC)
-            module_personal_repos.setup_traefik_proxy(EXEC)
+            plan.append(("traefik_proxy", "PERSONAL REPOS: TRAEFIK-PROXY",
+                         lambda: module_personal_repos.setup_traefik_proxy(EXEC)))
         if tasks["dracula"]:
-            log_module_start("PERSONAL REPOS: DRACULA", EXEC)
-            module_personal_repos.setup_dracula(EXEC)
+            plan.append(("dracula", "PERSONAL REPOS: DRACULA",
+                         lambda: module_personal_repos.setup_dracula(EXEC)))
         if tasks["docker_dns_reso"]:
-            log_module_start("PERSONAL REPOS: DOCKER-DNS-RESO", EXEC)
-            module_personal_repos.setup_docker_dns_reso(EXEC)
+            plan.append(("docker_dns_reso", "PERSONAL REPOS: DOCKER-DNS-RESO",
+                         lambda: module_personal_repos.setup_docker_dns_reso(EXEC)))
 
     # Local CA and TLS certs setup-a-tron
     if tasks["fake_le"]:
-        log_module_start("FAKE-LE ORCHESTRATION", EXEC)
         # Pass the entire 'args' object so the module can read all the new flags
-        module_fake_le.setup_fake_le(EXEC, args)
+        plan.append(("fake_le", "FAKE-LE ORCHESTRATION",
+                     lambda: module_fake_le.setup_fake_le(EXEC, args)))
 
     # Ollama (local) + Open WebUI (Docker Compose)
     if tasks["ollama"]:
-        log_module_start("OLLAMA + OPEN WEBUI", EXEC)
-        module_ollama.setup_ollama(EXEC, args)
+        plan.append(("ollama", "OLLAMA + OPEN WEBUI",
+                     lambda: module_ollama.setup_ollama(EXEC, args)))
 
     # open-terminal: spin up a sibling container with an extra path bind-mounted
     if has_terminal_action:
-        log_module_start("OLLAMA OPEN TERMINAL", EXEC)
-        module_ollama.open_terminal_with_path(EXEC, args.ollama_terminal_path)
+        plan.append(("ollama_terminal", "OLLAMA OPEN TERMINAL",
+                     lambda: module_ollama.open_terminal_with_path(
+                         EXEC, args.ollama_terminal_path
+                     )))
 
     # 7. VM Setup
     if args.do_vm:
-        log_module_start(f"VIRT MACHINE SETUP (USER: {args.vm_user})", EXEC)
         # Pass the specific flag state directly:
-        virtmachine.setup_virtmachine(EXEC, args.vm_user, force_detection=args.do_vm_force)
+        plan.append(("vm", f"VIRT MACHINE SETUP (USER: {args.vm_user})",
+                     lambda: virtmachine.setup_virtmachine(
+                         EXEC, args.vm_user, force_detection=args.do_vm_force
+                     )))
         
     # 8. Ubuntu Desktop Extras
-    from lib.platform_utils import is_ubuntu_desktop
-    if is_ubuntu_desktop():
-        log_module_start("DESKTOP EXTRAS (VSCODE, TWEAKS)", EXEC)
-        vscode.install_vscode(EXEC)
-        tweaks.install_gnome_tweaks(EXEC)
+    if facts.desktop:
+        plan.append(("desktop", "DESKTOP EXTRAS (VSCODE, TWEAKS)", _desktop_extras))
 
     # 9. Final Cleanup
     if not args.no_autoremove:
-        log_module_start("FINAL CLEANUP (APT AUTOREMOVE)", EXEC)
-        apt_autoremove(EXEC)
-        
-    log.success("All requested tasks completed.")
+        plan.append(("autoremove", "FINAL CLEANUP (APT AUTOREMOVE)", lambda: apt_autoremove(EXEC)))
+
+    # 9b. Within a --budget, keep what fits (highest priority first) and defer the rest
+    if budget is not None:
+        from lib.installer_utils.apt_tools import plan_transaction, planned_packages
+        apt_estimates = {
+            module: plan_transaction(EXEC, packages).seconds
+            for module, packages in planned_packages(EXEC, [k for k, _, _ in plan], args).items()
+        }
+        plan = budget.schedule(plan, apt_estimates)
+        tasks = {key: enabled and key not in budget.deferred for key, enabled in tasks.items()}
+
+    # 9c. Prefetch: download everything the planned modules need, concurrently,
+    # before anything is mutated (modules then read from the local cache).
+    # With --from-bundle the artifacts come from the bundle instead of the network.
+    if args.from_bundle:
+        from lib import offline, prefetch
+        log_module_start("OFFLINE BUNDLE", EXEC)
+        try:
+            offline.use(args.from_bundle)
+            offline.restore(EXEC, prefetch.collect_artifacts(EXEC, tasks, args))
+        except ValueError as e:
+            log.critical(str(e))
+            sys.exit(1)
+    elif not args.no_prefetch and not args.root:
+        from lib import prefetch
+        log_module_start("PREFETCH", EXEC)
+        prefetch.prefetch(EXEC, prefetch.collect_artifacts(EXEC, tasks, args))
+
+    # 9d. Queue the planned modules' distro packages: the first apt_install
+    # installs them together (lib/installer_utils/apt_tools.py)
+    from lib.installer_utils.apt_tools import finish_fast_dpkg, queue_planned_packages
+    queue_planned_packages(EXEC, [key for key, _, _ in plan], args)
+
+    # 10. Execute the Plan, journalling each module so a failed run can --resume
+    from lib import gates, history, journal, metrics
+    from lib.report import write_report
+    if args.resume and not journal.exists():
+        log.warning("--resume: no previous run journal found; running every selected module.")
+    elif args.resume:
+        log.info(f"--resume: previous run: {journal.summary()}")
+    journal.begin_run(EXEC, resume=args.resume)
+    history.begin_run(EXEC, sys.argv[1:], [key for key, _, _ in plan])
+    packages_before = dict(EXEC.facts.packages)  # for the packages_installed metric
+
+    def _run_step(key: str, banner: str, step: Callable[[], object]) -> None:
+        digest = journal.input_hash(key, args)
+        if args.resume and journal.is_done(key, digest):
+            log.success(f"--resume: '{key}' completed last run with unchanged inputs; skipping.")
+            return
+
+        log_module_start(banner, EXEC)
+        journal.start_module(EXEC, key, digest)
+        history.start_module(key)
+        started = time.time()
+        try:
+            step()
+        except BaseException:
+            journal.finish_module(EXEC, key, ok=False)
+            history.finish_module(key, started, ok=False)
+            log.error(f"Module '{key}' failed. Fix the cause and re-run with --resume.")
+            raise
+        journal.finish_module(EXEC, key, ok=True)
+        history.finish_module(key, started, ok=True)
+
+    # Runs are recorded in the history DB (ETA, slow-module flags, --history)
+    ok = False
+    try:
+        i = 0
+        while i < len(plan):
+            # Consecutive delegated modules are mostly SSH/git network time as
+            # different users, so they run side by side (output prefixed per user).
+            batch = [plan[i]]
+            while (
+                plan[i][0] in DELEGATED_MODULES
+                and i + len(batch) < len(plan)
+                and plan[i + len(batch)][0] in DELEGATED_MODULES
+            ):
+                batch.append(plan[i + len(batch)])
+            eta = history.eta_message([key for key, _, _ in plan[i:]])
+            if eta:
+                log.info(eta)
+            i += len(batch)
+            if budget is not None:
+                batch = [entry for entry in batch if budget.admit(entry[0])]
+                if not batch:
+                    continue
+
+            if len(batch) == 1:
+                _run_step(*batch[0])
+            else:
+                for key, _, _ in batch:
+                    delegated_accounts[key]()
+                log.info(f"Running {', '.join(k for k, _, _ in batch)} concurrently.")
+                with ThreadPoolExecutor(max_workers=len(batch)) as pool:
+                    futures = [pool.submit(_run_step, *entry) for entry in batch]
+                for future in futures:
+                    # Every module in the batch has finished; surface the first failure.
+                    future.result()
+            # Print any newly pending deploy keys, resume work whose key now works
+            gates.checkpoint()
+
+        try:
+            if budget is None:
+                gates.wait_all()
+            else:
+                # Never past the deadline: what's still gated finishes in the follow-up run
+                gated = gates.wait_all(timeout=max(budget.remaining(), 0.0), defer=True)
+                for key in gated:
+                    journal.finish_module(EXEC, key, ok=False)
+                budget.defer(gated, "its deploy key is still pending")
+        except RuntimeError:
+            # Their gated work never ran, so --resume must run them again
+            for key in gates.failed_modules():
+                journal.finish_module(EXEC, key, ok=False)
+            raise
+        # Before the snapshot, so it captures a host whose triggers have run
+        finish_fast_dpkg(EXEC)
+        ok = True
+        if args.snapshot_export:
+            from lib import snapshot
+            if budget is not None and budget.deferred:
+                log.warning("Not writing a snapshot: --budget deferred some modules.")
+            else:
+                snapshot.export_snapshot(
+                    EXEC, args.snapshot_export,
+                    [key for key, _, _ in plan if key != "snapshot_import"],
+                )
+    finally:
+        # Also after a failure, so pending triggers aren't left behind (no-op if done)
+        finish_fast_dpkg(EXEC)
+        if budget is not None and budget.deferred:
+            schedule_followup(EXEC, sys.argv[1:])
+        history.end_run(ok)
+        metrics.write_run_metrics(EXEC, packages_before)
+        if args.report:
+            write_report(args.report)
+    if budget is not None and budget.deferred:
+        log.success(f"Budget met; deferred to the follow-up run: {', '.join(budget.deferred)}.")
+    else:
+        log.success("All requested tasks completed.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+import socket
+from typing import Iterator
+
+import pytest
+
+from lib.constants import APT_CACHE_PORT
+from lib.installer_utils import apt_tools
+from lib.installer_utils.apt_tools import DebDownload
+
+
+@pytest.fixture(autouse=True)
+def _no_proxy() -> Iterator[None]:
+    yield
+    apt_tools._proxy, apt_tools._proxy_reachable = None, None
+
+
+@pytest.fixture
+def listener() -> Iterator[int]:
+    """A TCP listener on loopback standing in for the APT cache; yields its port."""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        yield server.getsockname()[1]
+
+
+def _closed_port() -> int:
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port: int = server.getsockname()[1]
+    return port
+
+
+# --- --apt-proxy ---
+
+def test_proxy_reachable(listener: int) -> None:
+    assert apt_tools.proxy_reachable(f"http://127.0.0.1:{listener}")
+    assert not apt_tools.proxy_reachable(f"http://127.0.0.1:{_closed_port()}")
+
+
+def test_proxy_options_when_reachable(listener: int) -> None:
+    apt_tools.set_proxy(f"127.0.0.1:{listener}")
+    assert apt_tools._proxy_options() == (
+        f" -o Acquire::http::Proxy=http://127.0.0.1:{listener}"
+    )
+
+
+def test_proxy_options_when_unreachable() -> None:
+    apt_tools.set_proxy(f"http://127.0.0.1:{_closed_port()}")
+    assert apt_tools._proxy_options() == ""
+
+
+def test_proxy_probed_once(listener: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    apt_tools.set_proxy(f"http://127.0.0.1:{listener}")
+    first = apt_tools._proxy_options()
+    monkeypatch.setattr(apt_tools, "proxy_reachable", lambda url: pytest.fail("probed again"))
+    assert apt_tools._proxy_options() == first != ""
+
+
+def test_proxy_options_unset() -> None:
+    assert apt_tools._proxy_options() == ""
+
+
+def test_set_proxy_normalises() -> None:
+    apt_tools.set_proxy("cache.lan")
+    assert apt_tools._proxy == f"http://cache.lan:{APT_CACHE_PORT}"
+    apt_tools.set_proxy("http://[fd00::1]:8080/")
+    assert apt_tools._proxy == "http://[fd00::1]:8080"
+
+
+@pytest.mark.parametrize("url", ["https://cache.lan", "http://", "http://cache.lan:port"])
+def test_set_proxy_rejects(url: str) -> None:
+    with pytest.raises(ValueError):
+        apt_tools.set_proxy(url)
+
+
+# --- deb822 sources ---
+
+def test_deb822_stanza() -> None:
+    line = (
+        "deb [arch=amd64,arm64 signed-by=/etc/apt/keyrings/docker.asc] "
+        "https://download.docker.com/linux/ubuntu noble stable"
+    )
+    assert apt_tools.deb822_stanza(line) == (
+        "Types: deb\n"
+        "URIs: https://download.docker.com/linux/ubuntu\n"
+        "Suites: noble\n"
+        "Components: stable\n"
+        "Architectures: amd64 arm64\n"
+        "Signed-By: /etc/apt/keyrings/docker.asc\n"
+    )
+
+
+def test_deb822_stanza_without_options() -> None:
+    assert apt_tools.deb822_stanza("deb http://x/ubuntu noble") == (
+        "Types: deb\nURIs: http://x/ubuntu\nSuites: noble\n"
+    )
+    with pytest.raises(ValueError):
+        apt_tools.deb822_stanza("deb http://x/ubuntu")
+
+
+# --- apt-get --print-uris ---
+
+def test_parse_uris() -> None:
+    output = (
+        "Reading package lists...\n"
+        "'http://archive.ubuntu.com/ubuntu/pool/main/t/tree/tree_2.1.1-2_amd64.deb' "
+        "tree_2.1.1-2_amd64.deb 47708 SHA512:ABCDEF\n"
+        "'http://example.com/x.deb' x_1_all.deb 10 SHA256:0123\n"
+        "'http://example.com/y.deb' y_1_all.deb 10 Checksum-FileSize:10\n"
+    )
+    assert apt_tools._parse_uris(output) == [
+        DebDownload(
+            "http://archive.ubuntu.com/ubuntu/pool/main/t/tree/tree_2.1.1-2_amd64.deb",
+            "tree_2.1.1-2_amd64.deb", 47708, "sha512", "abcdef",
+        ),
+        DebDownload("http://example.com/x.deb", "x_1_all.deb", 10, "sha256", "0123"),
+    ]
+
+
+# --- apt-get -s disk space ---
+
+@pytest.mark.parametrize("output, delta", [
+    ("After this operation, 1,234 kB of additional disk space will be used.\n", 1_234_000),
+    ("After this operation, 2.5 MB disk space will be freed.\n", -2_500_000),
+    ("0 upgraded, 0 newly installed, 0 to remove and 0 not upgraded.\n", 0),
+])
+def test_size_delta(output: str, delta: int) -> None:
+    assert apt_tools._size_delta(output) == delta
@@ -0,0 +1,21 @@
+import pytest
+
+from lib.budget import parse_duration
+
+
+@pytest.mark.parametrize("text, seconds", [
+    ("90s", 90),
+    ("5m", 300),
+    ("1h30m", 5400),
+    ("1.5h", 5400),
+    ("45", 45),
+    (" 2M ", 120),
+])
+def test_parse_duration(text: str, seconds: float) -> None:
+    assert parse_duration(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["", "m", "5 m", "5d", "-5m", "0s", "1h-30m"])
+def test_parse_duration_rejects(text: str) -> None:
+    with pytest.raises(ValueError):
+        parse_duration(text)
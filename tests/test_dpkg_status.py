@@ -0,0 +1,51 @@
+from lib.dpkg_status import PackageStatus, _parse
+
+STATUS = """\
+Package: tree
+Status: install ok installed
+Priority: optional
+Architecture: amd64
+Version: 2.1.1-2
+Description: displays an indented directory tree
+ Status: not a field (continuation line)
+
+Package: libc6
+Status: install ok triggers-pending
+Architecture: i386
+Version: 2.39-0ubuntu8
+
+Package: vim
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 2:9.1.0016-1ubuntu7
+
+Package: broken
+Status: install ok
+
+Package: fonts-noto
+Status: hold ok half-configured
+Version: 1
+"""
+
+
+def test_parse() -> None:
+    index = _parse(STATUS)
+    assert sorted(index) == [
+        ("fonts-noto", "all"), ("libc6", "i386"), ("tree", "amd64"), ("vim", "amd64"),
+    ]
+    assert index[("tree", "amd64")] == PackageStatus(
+        "tree", "amd64", "install", "installed", "2.1.1-2"
+    )
+    assert index[("fonts-noto", "all")].want == "hold"
+
+
+def test_installed_states() -> None:
+    index = _parse(STATUS)
+    assert index[("tree", "amd64")].installed
+    assert index[("libc6", "i386")].installed  # only its triggers are pending
+    assert not index[("vim", "amd64")].installed
+    assert not index[("fonts-noto", "all")].installed
+
+
+def test_parse_empty() -> None:
+    assert _parse("") == {}
@@ -0,0 +1,131 @@
+import os
+import re
+import types
+from typing import Any, List
+
+import pytest
+
+from lib import fleet
+from lib.fleet import FleetHost, FleetResult
+
+INVENTORY = """\
+[defaults]
+ssh_user = "deploy"
+args = ["--packages"]
+
+[hosts.web1]
+address = "web1.example.org"
+args = ["--docker"]
+
+[hosts.vm2]
+address = "100.64.0.12"
+ssh_user = "root"
+port = 2222
+"""
+
+
+def _inventory(tmp_path: Any, text: str) -> str:
+    path = tmp_path / "hosts.toml"
+    path.write_text(text)
+    return str(path)
+
+
+# --- inventory ---
+
+def test_load_inventory(tmp_path: Any) -> None:
+    assert fleet.load_inventory(_inventory(tmp_path, INVENTORY)) == [
+        FleetHost("web1", "web1.example.org", "deploy", 22, ["--packages", "--docker"]),
+        FleetHost("vm2", "100.64.0.12", "root", 2222, ["--packages"]),
+    ]
+
+
+def test_load_inventory_address_defaults_to_name(tmp_path: Any) -> None:
+    (host,) = fleet.load_inventory(_inventory(tmp_path, "[hosts.db1]\n"))
+    assert host.target == "root@db1"
+
+
+@pytest.mark.parametrize("text, message", [
+    ("[hosts\n", "Invalid inventory"),
+    ("[defaults]\n", "No [hosts.*] entries"),
+    ("hosts = [1]\n", "[hosts] must be a table"),
+    ("[hosts]\nweb1 = \"x\"\n", "[hosts.web1] must be a table"),
+    ("[hosts.web1]\nport = \"ssh\"\n", "invalid port"),
+    ("[hosts.web1]\nargs = \"--docker\"\n", "'args' must be a list of strings"),
+    ("[defaults]\nargs = [1]\n[hosts.web1]\n", "'args' must be a list of strings"),
+])
+def test_load_inventory_rejects(tmp_path: Any, text: str, message: str) -> None:
+    with pytest.raises(ValueError, match=re.escape(message)):
+        fleet.load_inventory(_inventory(tmp_path, text))
+
+
+def test_load_inventory_missing(tmp_path: Any) -> None:
+    with pytest.raises(ValueError, match="Cannot read inventory"):
+        fleet.load_inventory(str(tmp_path / "missing.toml"))
+
+
+# --- forwarded flags ---
+
+def test_strip_fleet_args() -> None:
+    argv = [
+        "--fleet", "hosts.toml", "--fleet-concurrency=8", "--tailscale",
+        "--fleet-hosts", "web1,vm2", "--ollama-model", "llama3", "--force",
+    ]
+    assert fleet.strip_fleet_args(argv) == ["--tailscale", "--ollama-model", "llama3", "--force"]
+
+
+def test_local_file_flags() -> None:
+    argv = ["--fleet", "hosts.toml", "--profile", "p.toml", "--report=/tmp/r.json", "--docker"]
+    assert fleet.local_file_flags(argv) == ["--profile", "--report"]
+    assert fleet.local_file_flags(["--fleet", "hosts.toml", "--docker"]) == []
+
+
+# --- summary ---
+
+def test_print_summary(capsys: pytest.CaptureFixture[str]) -> None:
+    fleet._print_summary([
+        FleetResult("web1", 0, 12.34),
+        FleetResult("vm2", 255, 0.5, stage="push"),
+    ])
+    rows = [line.split() for line in capsys.readouterr().out.splitlines() if line.strip()]
+    assert ["web1", "ok", "0", "12.3s"] in rows
+    assert ["vm2", "FAILED", "(push)", "255", "0.5s"] in rows
+
+
+# --- stand-in hosts: "ssh" runs the remote command locally ---
+
+@pytest.fixture
+def local_hosts(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Hosts whose ssh is a local shell; the bundle is unpacked under tmp_path."""
+    remote_dir = str(tmp_path / "remote")
+    monkeypatch.setattr(fleet, "FLEET_REMOTE_DIR", remote_dir)
+    monkeypatch.setattr(fleet, "_ssh_cmd", lambda host, remote: ["sh", "-c", remote])
+    return remote_dir
+
+
+def _run(hosts: List[FleetHost], monkeypatch: pytest.MonkeyPatch, argv: List[str]) -> bool:
+    monkeypatch.setattr(fleet, "load_inventory", lambda path: hosts)
+    exec_obj = types.SimpleNamespace(dry_run=False)
+    return fleet.run_fleet(exec_obj, "hosts.toml", argv, 2)  # type: ignore[arg-type]
+
+
+def test_run_fleet_on_stand_in_hosts(
+    local_hosts: str, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    # b's args don't parse (--budget without its value)
+    hosts = [FleetHost("a", "a", args=["--help"]), FleetHost("b", "b", args=["--budget"])]
+    assert not _run(hosts, monkeypatch, [])
+    out = capsys.readouterr().out
+    assert os.path.isfile(os.path.join(local_hosts, "setup_machine.py"))
+    assert "[a] usage: setup_machine.py" in out  # pushed, unpacked and run
+    rows = [line.split() for line in out.splitlines() if line.strip()]
+    assert ["a", "ok", "0"] == rows[[r[0] for r in rows].index("a")][:3]
+    assert ["b", "FAILED", "(run)"] == rows[[r[0] for r in rows].index("b")][:3]
+
+
+def test_run_fleet_host_without_ssh(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    monkeypatch.setattr(fleet, "_ssh_cmd", lambda host, remote: ["/nonexistent/ssh"])
+    assert not _run([FleetHost("a", "a"), FleetHost("b", "b")], monkeypatch, [])
+    out = capsys.readouterr().out
+    assert out.count("FAILED (push)") == 2
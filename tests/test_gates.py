@@ -0,0 +1,53 @@
+import json
+from typing import Any, List
+
+import pytest
+
+from lib import gates, history
+
+
+def _hand_off(path: Any) -> None:
+    """What a delegated child leaves behind with one deploy key still pending."""
+    path.write_text(json.dumps([{"name": "repo", "command": "true", "user": "nobody"}]))
+
+
+def _adopt_rerun(tmp_path: Any, probes: List[bool]) -> None:
+    """
+    Adopts a child's hand-off in module 'no2id'; the first probe opens it
+    and the re-run child hands off again, from checkpoint() (outside the module).
+    """
+    def run_probe(command: str, user: str) -> bool:
+        return probes.pop(0) if probes else False
+
+    def rerun() -> None:
+        again = tmp_path / "again.json"
+        _hand_off(again)
+        gates.adopt(str(again), "setup_no2id as no2id-docker", run_probe, lambda: None,
+                    module=history.current_module())
+
+    first = tmp_path / "first.json"
+    _hand_off(first)
+    history.start_module("no2id")
+    gates.adopt(str(first), "setup_no2id as no2id-docker", run_probe, rerun,
+                module=history.current_module())
+    history.finish_module("no2id", 0.0, ok=True)
+    assert history.current_module() is None
+
+
+def test_rerun_gate_keeps_its_module_when_deferred(tmp_path: Any) -> None:
+    _adopt_rerun(tmp_path, [True])
+    assert gates.wait_all(timeout=3, defer=True) == ["no2id"]
+
+
+def test_rerun_gate_keeps_its_module_when_failed(tmp_path: Any) -> None:
+    _adopt_rerun(tmp_path, [True])
+    with pytest.raises(RuntimeError):
+        gates.wait_all(timeout=3)
+    assert gates.failed_modules() == ["no2id"]
+
+
+def test_adopt_nothing_handed(tmp_path: Any) -> None:
+    path = tmp_path / "empty.json"
+    path.write_text("")
+    gates.adopt(str(path), "child", lambda command, user: True, lambda: None, module="no2id")
+    assert gates.pending() == []
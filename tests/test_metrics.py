@@ -0,0 +1,22 @@
+from typing import Any
+
+import pytest
+
+from lib import metrics
+from lib.metrics import AGENT_TEXTFILE, ReconcileStats, write_agent_metrics
+
+
+def test_counter_metadata_names_the_samples(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(metrics, "METRICS_TEXTFILE_DIR", str(tmp_path))
+    stats = ReconcileStats()
+    stats.record("firewall", "reconciled", 1.5, 2)
+    write_agent_metrics(stats, ["firewall"])
+
+    lines = (tmp_path / AGENT_TEXTFILE).read_text().splitlines()
+    assert "# TYPE machine_setup_agent_reconciles_total counter" in lines
+    assert 'machine_setup_agent_reconciles_total{module="firewall",result="reconciled"} 1' in lines
+    assert "# TYPE machine_setup_agent_drift_items gauge" in lines
+    # Every sample belongs to a family declared under exactly its own name
+    declared = {line.split()[2] for line in lines if line.startswith("# TYPE ")}
+    samples = {line.split("{")[0].split()[0] for line in lines if not line.startswith("#")}
+    assert samples <= declared
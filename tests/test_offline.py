@@ -0,0 +1,56 @@
+import os
+import types
+from typing import Any, Dict, List
+
+import pytest
+
+from lib import offline
+
+
+def _build(tmp_path: Any, monkeypatch: pytest.MonkeyPatch, blobs: Dict[str, bytes]) -> str:
+    """Builds a bundle of the ("file", source) -> content *blobs*; returns its path."""
+    staged: List[Dict[str, str]] = []
+    for i, (source, content) in enumerate(blobs.items()):
+        path = tmp_path / f"blob{i}"
+        path.write_bytes(content)
+        staged.append({"kind": "file", "source": source, "module": "test", "path": str(path)})
+    monkeypatch.setattr(offline, "_stage", lambda exec_obj, artifacts, staging: staged)
+    exec_obj = types.SimpleNamespace(
+        dry_run=False, facts=types.SimpleNamespace(os_id="ubuntu", codename="noble")
+    )
+    bundle = str(tmp_path / "test.offline")
+    assert offline.build(exec_obj, bundle, [])  # type: ignore[arg-type]
+    return bundle
+
+
+def test_find(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    blobs = {f"https://example.com/{i}.gpg": os.urandom(i * 100) for i in range(1, 20)}
+    bundle = offline.OfflineBundle(_build(tmp_path, monkeypatch, blobs))
+    for source, content in blobs.items():
+        entry = bundle.find("file", source)
+        assert entry is not None
+        assert entry.length == len(content)
+        assert entry.offset % offline._ALIGN == 0
+        assert bundle.verify(entry)
+    assert bundle.find("file", "https://example.com/missing.gpg") is None
+    assert bundle.find("git", "https://example.com/1.gpg") is None  # other kind
+    assert sorted(bundle.sources("file")) == sorted(blobs)
+
+
+def test_build_nothing_staged(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(offline, "_stage", lambda exec_obj, artifacts, staging: [])
+    exec_obj = types.SimpleNamespace(dry_run=False)
+    assert not offline.build(exec_obj, str(tmp_path / "x.offline"), [])  # type: ignore[arg-type]
+
+
+def test_bundle_private(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    bundle = _build(tmp_path, monkeypatch, {"https://example.com/key": b"secret"})
+    assert os.stat(bundle).st_mode & 0o777 == 0o600
+    assert sorted(os.listdir(tmp_path)) == ["blob0", "test.offline"]
+
+
+def test_not_a_bundle(tmp_path: Any) -> None:
+    path = tmp_path / "junk"
+    path.write_bytes(b"x" * 100)
+    with pytest.raises(ValueError):
+        offline.OfflineBundle(str(path))
@@ -0,0 +1,177 @@
+"""End-to-end runs of the orchestrator against a scratch --root with stubbed commands."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any, List, Tuple
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEY = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAITEST test@example"
+
+STUBS = f"""\
+[[stub]]
+match = "^curl .*github\\\\.com/.*\\\\.keys"
+stdout = "{KEY}"
+
+[[stub]]
+match = "^systemd-detect-virt"
+stdout = "none"
+"""
+
+
+@pytest.fixture
+def root(tmp_path: Any) -> Any:
+    """A scratch root with adam and the staff group, and the stub rules."""
+    (tmp_path / "etc").mkdir()
+    (tmp_path / "etc/passwd").write_text(
+        "root:x:0:0:root:/root:/bin/bash\nadam:x:1000:1000::/home/adam:/bin/bash\n"
+    )
+    (tmp_path / "etc/group").write_text("root:x:0:\nadam:x:1000:\nstaff:x:50:adam\n")
+    (tmp_path / "stubs.toml").write_text(STUBS)
+    return tmp_path
+
+
+def _run(root: Any, *flags: str) -> "subprocess.CompletedProcess[str]":
+    return subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "setup_machine.py"), "--root", str(root),
+         "--force", "--no-autoremove", *flags],
+        capture_output=True, text=True, timeout=120,
+    )
+
+
+def _calls(root: Any) -> List[Tuple[int, str]]:
+    calls = []
+    for line in (root / "commands.log").read_text().splitlines():
+        returncode, _, command = line.partition("\t")
+        calls.append((int(returncode), command))
+    return calls
+
+
+def _mode(path: Any) -> int:
+    return os.stat(path).st_mode & 0o777
+
+
+def test_modules_write_only_under_the_root(root: Any) -> None:
+    before = set(os.listdir(tempfile.gettempdir()))
+    result = _run(root, "--sudoers", "--firewall", "--root-ssh-keys")
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    sudoers = root / "etc/sudoers.d/staff"
+    assert sudoers.read_text() == "%staff ALL=(ALL:ALL) NOPASSWD: ALL\n"
+    assert _mode(sudoers) == 0o440
+    for home in ("root", "home/adam"):
+        keys = root / home / ".ssh/authorized_keys"
+        assert KEY in keys.read_text()
+        assert _mode(keys) == 0o600
+    script = root / "usr/local/bin/apply-firewall.sh"
+    assert script.read_text().startswith("#!")
+    assert _mode(script) == 0o755
+    unit = root / "etc/systemd/system/firewall.service"
+    assert "ExecStart=/usr/local/bin/apply-firewall.sh" in unit.read_text()
+    assert _mode(unit) == 0o644
+
+    calls = _calls(root)
+    commands = [command for _, command in calls]
+    assert all(returncode == 0 for returncode, _ in calls)
+    assert "curl -fsSL https://github.com/adamamyl.keys" in commands
+    assert "apt install -y iptables curl" in commands
+    assert "systemctl enable firewall.service" in commands
+    # Whole files are written into the root, not through a shell
+    assert not any(c.startswith(("tee ", "install ")) or " | tee " in c for c in commands)
+    assert not [
+        name for name in set(os.listdir(tempfile.gettempdir())) - before
+        if name.startswith("machine-setup-")
+    ]
+
+
+def test_rerun_changes_nothing(root: Any) -> None:
+    assert _run(root, "--sudoers").returncode == 0
+    sudoers = root / "etc/sudoers.d/staff"
+    written = os.stat(sudoers).st_mtime_ns
+    result = _run(root, "--sudoers")
+    assert result.returncode == 0
+    assert "already contains the correct content" in result.stdout
+    assert os.stat(sudoers).st_mtime_ns == written
+
+
+def test_failing_stub_fails_the_module(root: Any) -> None:
+    with open(root / "stubs.toml", "a") as f:
+        f.write('\n[[stub]]\nmatch = "^apt install"\nreturncode = 100\nstderr = "E: broken"\n')
+    result = _run(root, "--firewall")
+    assert result.returncode != 0
+    assert (100, "apt install -y iptables curl") in _calls(root)
+    assert not (root / "usr/local/bin/apply-firewall.sh").exists()
+
+
+# --- --check against the live firewall rules ---
+
+IPTABLES_S = """\
+-P INPUT DROP
+-P FORWARD DROP
+-P OUTPUT ACCEPT
+-A FORWARD -j DOCKER-USER
+-A INPUT -i tailscale0 -j ACCEPT
+-A INPUT -j REJECT --reject-with icmp-port-unreachable
+"""
+FLUSHED_S = "-P INPUT DROP\n-P FORWARD DROP\n-P OUTPUT ACCEPT\n"
+
+
+def _firewall_check(root: Any, iptables_s: str) -> List[Any]:
+    with open(root / "stubs.toml", "a") as f:
+        f.write(
+            '\n[[stub]]\nmatch = "^systemctl is-active"\nstdout = "active"\n'
+            '\n[[stub]]\nmatch = "^systemctl is-enabled"\nstdout = "enabled"\n'
+            f'\n[[stub]]\nmatch = "^iptables -S"\nstdout = """{iptables_s}"""\n'
+            f'\n[[stub]]\nmatch = "^ip6tables -S"\nstdout = """{IPTABLES_S}"""\n'
+        )
+    result = _run(root, "--check", "--firewall")
+    report = json.loads(result.stdout)
+    drift: List[Any] = report["modules"]["firewall"]["items"]
+    return [item for item in drift if item["kind"] != "package_missing"]
+
+
+def test_check_passes_with_the_rules_loaded(root: Any) -> None:
+    assert _run(root, "--firewall").returncode == 0
+    assert _firewall_check(root, IPTABLES_S) == []
+
+
+def test_check_reports_flushed_rules(root: Any) -> None:
+    assert _run(root, "--firewall").returncode == 0
+    drift = _firewall_check(root, FLUSHED_S)
+    assert {(d["kind"], d["item"], d["detail"]) for d in drift} == {
+        ("rule_missing", "iptables", "-A FORWARD -j DOCKER-USER"),
+        ("rule_missing", "iptables", "-A INPUT -i tailscale0 -j ACCEPT"),
+        ("rule_missing", "iptables", "-A INPUT -j REJECT"),
+    }
+
+
+# --- the planned modules' packages merged into the first apt install ---
+
+def _apt_installs(root: Any) -> List[Tuple[int, str]]:
+    return [(rc, c) for rc, c in _calls(root) if c.startswith("apt install")]
+
+
+def test_planned_packages_install_in_one_transaction(root: Any) -> None:
+    result = _run(root, "--packages", "--firewall")
+    assert result.returncode == 0, result.stdout + result.stderr
+    ((returncode, command),) = _apt_installs(root)  # firewall's own install was merged
+    assert returncode == 0
+    assert "diceware" in command.split() and "iptables" in command.split()
+
+
+def test_failed_merged_install_falls_back_to_own_packages(root: Any) -> None:
+    # Any transaction with the firewall's iptables in it fails
+    with open(root / "stubs.toml", "a") as f:
+        f.write('\n[[stub]]\nmatch = "^apt install .*iptables"\nreturncode = 100\n')
+    result = _run(root, "--packages", "--firewall")
+    assert result.returncode != 0  # the firewall still fails, on its own install
+    merged, own, firewall = _apt_installs(root)
+    assert merged[0] == 100 and "diceware" in merged[1] and "iptables" in merged[1]
+    assert own[0] == 0 and "diceware" in own[1] and "iptables" not in own[1]
+    assert firewall == (100, "apt install -y iptables curl")
+    assert "Module 'firewall' failed" in result.stdout
+    assert "Module 'packages' failed" not in result.stdout
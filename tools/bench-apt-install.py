@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+bench-apt-install.py
+====================
+Times apt_install() as the orchestrator runs it, with and without
+--fast-dpkg, on the host it runs on.
+
+Every round purges the packages, then installs them once in each mode
+(alternating which goes first) from archives already in apt's cache, so
+only unpack/configure/trigger work is measured, not the network.  Fast
+mode's time includes the deferred trigger run and the final sync.
+
+It installs and purges real packages: run it as root on a throwaway VM or
+container, never on a host you care about.
+
+Usage:
+    sudo python3 tools/bench-apt-install.py --yes [--rounds 3] [PACKAGE ...]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, REPO_ROOT)
+
+from lib.executor import Executor  # noqa: E402
+from lib.installer_utils import apt_tools  # noqa: E402
+
+# Man pages, shared libraries and a service: the triggers fast mode defers
+DEFAULT_PACKAGES: List[str] = ["vim", "mtr", "tree", "net-tools", "diceware", "apache2"]
+
+
+def _purge(exec_obj: Executor, packages: List[str]) -> None:
+    exec_obj.run(["apt-get", "purge", "-y", "-qq"] + packages, check=False, run_quiet=True)
+    exec_obj.run(["apt-get", "autoremove", "--purge", "-y", "-qq"], check=False, run_quiet=True)
+    exec_obj.facts.refresh("packages")
+
+
+def _timed_install(exec_obj: Executor, packages: List[str], fast: bool) -> float:
+    apt_tools.set_fast_dpkg(fast)
+    start = time.monotonic()
+    apt_tools.apt_install(exec_obj, packages)
+    apt_tools.finish_fast_dpkg(exec_obj)
+    if not fast:
+        # Level the field: fast mode's time includes its sync
+        exec_obj.run("sync", run_quiet=True)
+    return time.monotonic() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time apt_install() with and without --fast-dpkg (destructive)."
+    )
+    parser.add_argument("packages", nargs="*", default=DEFAULT_PACKAGES)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--yes", action="store_true",
+                        help="Confirm that installing and purging the packages is fine here.")
+    args = parser.parse_args()
+
+    if os.geteuid() != 0:
+        sys.exit("Run as root (on a throwaway host).")
+    if not args.yes:
+        sys.exit(f"This installs and purges {', '.join(args.packages)}; re-run with --yes.")
+
+    exec_obj = Executor(quiet=True)
+    missing = [p for p in args.packages if not exec_obj.facts.is_installed(p)]
+    if missing != args.packages:
+        sys.exit(f"Already installed (would be purged): "
+                 f"{', '.join(sorted(set(args.packages) - set(missing)))}")
+
+    # Lists and archives up front, so neither mode pays for the network
+    apt_tools.apt_update(exec_obj)
+    exec_obj.run(["apt-get", "install", "-y", "-qq", "--download-only"] + args.packages)
+
+    times: Dict[str, List[float]] = {"default": [], "fast": []}
+    for round_no in range(args.rounds):
+        order = ["default", "fast"] if round_no % 2 == 0 else ["fast", "default"]
+        for mode in order:
+            _purge(exec_obj, args.packages)
+            times[mode].append(_timed_install(exec_obj, args.packages, mode == "fast"))
+            print(f"round {round_no + 1}: {mode:<7} {times[mode][-1]:6.1f}s", flush=True)
+    _purge(exec_obj, args.packages)
+
+    default, fast = statistics.median(times["default"]), statistics.median(times["fast"])
+    print(f"\n{len(args.packages)} package(s), median of {args.rounds} round(s):")
+    print(f"  default      {default:6.1f}s")
+    saved = f" ({(1 - fast / default) * 100:.0f}% less)" if default else ""
+    print(f"  --fast-dpkg  {fast:6.1f}s{saved}")
+
+
+if __name__ == "__main__":
+    main()
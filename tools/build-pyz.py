@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+build-pyz.py
+============
+Builds a single-file zipapp of the orchestrator for cloud-init bootstraps:
+no clone, no venv, nothing third-party imported at startup.
+
+The archive holds setup_machine.py and lib/ as precompiled, sourceless .pyc
+files (unchecked-hash, so zipimport never stats a source), tools/ as-is
+(lib/bundle.py unpacks them at run time), and a small source __main__.py
+that refuses to run on a Python whose bytecode format differs.
+
+Usage:
+    python3 tools/build-pyz.py [-o dist/machine-setup.pyz]
+    sudo python3 dist/machine-setup.pyz --all
+"""
+
+import argparse
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import zipapp
+from typing import List
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, "dist", "machine-setup.pyz")
+
+MAIN_TEMPLATE = '''\
+import sys
+
+_BUILT_FOR = {version!r}
+if sys.version_info[:2] != _BUILT_FOR:
+    sys.exit(
+        "machine-setup.pyz holds bytecode for Python %d.%d but this is %d.%d; "
+        "rebuild it with tools/build-pyz.py on the target Python, or run from a checkout."
+        % (_BUILT_FOR + tuple(sys.version_info[:2]))
+    )
+
+import setup_machine  # noqa: E402
+
+setup_machine.main()
+'''
+
+
+def _python_sources() -> List[str]:
+    """setup_machine.py plus every importable module under lib/ (repo-relative)."""
+    sources = ["setup_machine.py"]
+    for dirpath, dirnames, filenames in os.walk(os.path.join(REPO_ROOT, "lib")):
+        dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+        for name in sorted(filenames):
+            # Skip scripts that aren't importable modules (e.g. github-deploy-key.py)
+            if name.endswith(".py") and name[:-3].isidentifier():
+                sources.append(os.path.relpath(os.path.join(dirpath, name), REPO_ROOT))
+    return sources
+
+
+def _stage(staging: str) -> int:
+    for rel in _python_sources():
+        py_compile.compile(
+            os.path.join(REPO_ROOT, rel),
+            cfile=os.path.join(staging, rel + "c"),
+            dfile=rel,
+            doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+        )
+
+    shutil.copytree(
+        os.path.join(REPO_ROOT, "tools"),
+        os.path.join(staging, "tools"),
+        ignore=shutil.ignore_patterns("__pycache__", "*.pyc", os.path.basename(__file__)),
+    )
+
+    with open(os.path.join(staging, "__main__.py"), "w") as f:
+        f.write(MAIN_TEMPLATE.format(version=tuple(sys.version_info[:2])))
+    return len(_python_sources())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the machine-setup zipapp.")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT,
+                        help=f"Archive to write (default: {DEFAULT_OUTPUT}).")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="machine-setup-pyz-") as staging:
+        count = _stage(staging)
+        zipapp.create_archive(
+            staging, args.output, interpreter="/usr/bin/env python3", compressed=True
+        )
+
+    size_kib = os.path.getsize(args.output) / 1024
+    print(
+        f"Built {args.output} ({size_kib:.0f} KiB, {count} modules, "
+        f"Python {sys.version_info[0]}.{sys.version_info[1]} bytecode)"
+    )
+
+
+if __name__ == "__main__":
+    main()